@@ -0,0 +1,161 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import cv2
+import numpy as np
+
+from model import ModelLoadError, check_worker, init_worker, predict, worker_model
+
+
+def model_tag(weights):
+    """权重文件变化后缓存自动失效"""
+    stat = os.stat(weights)
+    return f"{os.path.splitext(os.path.basename(weights))[0]}-{stat.st_size}-{int(stat.st_mtime)}"
+
+
+def _predict_file(path, cache_dir, tag, conf_thres):
+    start = time.perf_counter()
+    with open(path, 'rb') as f:
+        data = f.read()
+    digest = hashlib.sha1(data).hexdigest()
+    cache_path = os.path.join(cache_dir, f"{digest}-{tag}.json")
+
+    if os.path.exists(cache_path):
+        with open(cache_path) as f:
+            result = json.load(f)
+        result['cached'] = True
+        return result
+
+    bgr = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if bgr is None:
+        raise IOError(f"Failed to read {path}")
+    ids, quads, scores = predict(worker_model(), [bgr], conf_thres=conf_thres)[0]
+    result = {
+        'ids': ids.tolist(),
+        'quads': quads.tolist(),
+        'scores': scores.tolist(),
+        'latency': time.perf_counter() - start,
+    }
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(result, f)
+    os.replace(tmp_path, cache_path)
+    result['cached'] = False
+    return result
+
+
+class AssistService:
+    """在后台进程池中对当前图之后的若干张图预先推理，结果按图像哈希缓存到磁盘"""
+
+    def __init__(self, weights, repo_dir=None, workers=2, ahead=4, conf_thres=0.5,
+                 cache_dir=os.path.join(".annotation_cache", "predictions"), on_ready=None):
+        self.ahead = ahead
+        self.conf_thres = conf_thres
+        self.cache_dir = cache_dir
+        self.tag = model_tag(weights)
+        self.on_ready = on_ready
+        self.results = {}
+        self.errors = {}  # 推理失败的图像 -> 错误信息，不影响其他图像
+        self.failed = None  # 模型不可用（加载失败、进程池损坏）的原因，此后不再提交任务
+        self._pending = {}
+        self._lock = threading.RLock()  # cancel() 会在当前线程同步触发回调
+        os.makedirs(cache_dir, exist_ok=True)
+        # spawn 避免把 pygame/线程状态 fork 进子进程
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+            initializer=init_worker, initargs=(weights, repo_dir))
+        # 先用一个探测任务确认工作进程里的模型能加载，失败时通过 on_ready(None) 通知
+        probe = self._executor.submit(check_worker)
+        probe.add_done_callback(self._probed)
+
+    def _probed(self, future):
+        if future.cancelled():
+            return
+        try:
+            future.result()
+        except Exception as e:
+            self._fail(e)
+
+    def _fail(self, error):
+        """模型不可用：记下原因、取消排队中的任务并通知界面关闭辅助"""
+        with self._lock:
+            if self.failed is not None:
+                return
+            self.failed = str(error) or type(error).__name__
+            for future in list(self._pending.values()):
+                future.cancel()
+            self._pending.clear()
+        if self.on_ready:
+            self.on_ready(None)
+
+    def schedule(self, files, index):
+        """为 index 及其后 ahead 张图提交推理，离开窗口的未开始任务会被取消；
+        切到一张之前推理失败的图时会重试一次"""
+        wanted = files[index:index + self.ahead + 1]
+        keep = set(files[max(0, index - self.ahead):index + self.ahead + 1])
+        with self._lock:
+            if self.failed is not None:
+                return
+            # 内存中只保留窗口附近的结果，其余留在磁盘缓存里
+            for path in [p for p in self.results if p not in keep]:
+                del self.results[path]
+            for path in [p for p in self.errors if p not in keep]:
+                del self.errors[path]
+            if wanted:
+                self.errors.pop(wanted[0], None)
+            for path in list(self._pending):
+                if path not in wanted and self._pending[path].cancel():
+                    self._pending.pop(path, None)
+            for path in wanted:
+                if path in self.results or path in self._pending or path in self.errors:
+                    continue
+                try:
+                    future = self._executor.submit(_predict_file, path, self.cache_dir,
+                                                   self.tag, self.conf_thres)
+                except BrokenProcessPool as e:
+                    self._fail(e)
+                    return
+                self._pending[path] = future
+                future.add_done_callback(lambda f, p=path: self._done(p, f))
+
+    def _done(self, path, future):
+        with self._lock:
+            self._pending.pop(path, None)
+        if future.cancelled():
+            return
+        try:
+            result = future.result()
+        except (ModelLoadError, BrokenProcessPool) as e:
+            self._fail(e)
+            return
+        except Exception as e:
+            with self._lock:
+                self.errors[path] = str(e) or type(e).__name__
+            if self.on_ready:
+                self.on_ready(path)
+            return
+        result['ids'] = np.asarray(result['ids'], np.int32)
+        result['quads'] = np.asarray(result['quads'], np.float32).reshape(-1, 4, 2)
+        result['scores'] = np.asarray(result['scores'], np.float32)
+        with self._lock:
+            self.results[path] = result
+        if self.on_ready:
+            self.on_ready(path)
+
+    def get(self, path):
+        with self._lock:
+            return self.results.get(path)
+
+    def error(self, path):
+        """该图最近一次推理失败的原因，没有失败时返回 None"""
+        with self._lock:
+            return self.errors.get(path)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,299 @@
+"""标注工具的无显示器性能基准
+
+用法:
+    python benchmark.py frame [--counts 100 1000 10000] [--repeat 20]
+    python benchmark.py hotpaths [--megapixels 1 12 50] [--counts 10 1000 10000]
+                                 [--json out.json] [--baseline base.json] [--threshold 1.2]
+
+hotpaths 生成合成图像和标注，对 load_image、fit_image_to_screen、update_display、
+右键命中、撤销历史和 save_annotations 计时，结果（分位数与峰值 RSS）可写成 JSON，
+并与保存的基线比较，p50 超过基线 threshold 倍的项记为回归。
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import cv2
+import numpy as np
+import pygame
+
+from dataset import DatasetIndex
+from main import AnnotationApp
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def synthetic_quads(count, image_size, seed=0):
+    """在图像范围内随机生成 count 个小四边形，返回 (N,4,2) float32 与 (N,) int32"""
+    rng = np.random.default_rng(seed)
+    img_w, img_h = image_size
+    centers = rng.uniform((40, 40), (img_w - 40, img_h - 40), (count, 2))
+    half = rng.uniform(8, 30, (count, 2))
+    signs = np.array([[-1, -1], [1, -1], [1, 1], [-1, 1]], np.float32)
+    quads = centers[:, None, :] + signs[None] * half[:, None, :]
+    ids = rng.integers(0, 10, count)
+    return quads.astype(np.float32), ids.astype(np.int32)
+
+
+def synthetic_image(path, megapixels, seed=0):
+    """生成约 megapixels 百万像素、4:3 的带纹理 JPEG，返回 (宽, 高)"""
+    h = int(round((megapixels * 1e6 * 3 / 4) ** 0.5))
+    w = int(round(h * 4 / 3))
+    rng = np.random.default_rng(seed)
+    # 小噪声图放大得到平滑纹理，避免在内存中生成整张随机大图
+    small = rng.integers(0, 256, (max(2, h // 64), max(2, w // 64), 3), np.uint8)
+    cv2.imwrite(path, cv2.resize(small, (w, h), interpolation=cv2.INTER_LINEAR))
+    return w, h
+
+
+def make_app(image_size=(1280, 1024)):
+    app = AnnotationApp()
+    app.screen = pygame.display.set_mode((app.screen_width, app.screen_height))
+    app.image = pygame.Surface(image_size)
+    app.image_size = image_size
+    app.fit_image_to_screen()
+    return app
+
+
+def fill_store(app, quads, ids):
+    app.annotations.clear()
+    app.history.clear()
+    for quad, class_id in zip(quads, ids):
+        app.annotations.insert(len(app.annotations), quad, class_id)
+    app.annotations_changed()
+
+
+def sample(func, repeat, setup=None):
+    """返回每次调用耗时（毫秒）列表；setup 不计时"""
+    samples = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def timeit(func, repeat):
+    return float(np.median(sample(func, repeat)))
+
+
+def summarize(samples):
+    samples = np.asarray(samples)
+    p50, p90, p99 = np.percentile(samples, [50, 90, 99])
+    return {'n': len(samples), 'mean_ms': float(samples.mean()), 'min_ms': float(samples.min()),
+            'p50_ms': float(p50), 'p90_ms': float(p90), 'p99_ms': float(p99),
+            'max_ms': float(samples.max())}
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 计，macOS 以字节计
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / 1024
+
+
+def legacy_frame(app, annotations):
+    """重现改造前每帧全量重绘的 update_display（列表+字典存储，逐帧渲染ID文字）"""
+    app.screen.fill((40, 40, 40))
+    app.screen.blit(app.image, app.image_offset)
+    for ann in annotations:
+        points = app.scale_points(ann['points'], to_screen=True)
+        color = app.get_color_for_id(ann['id'])
+        pygame.draw.lines(app.screen, color, True, [
+            (points[0], points[1]),
+            (points[2], points[3]),
+            (points[4], points[5]),
+            (points[6], points[7])
+        ], 3)
+        center_x = sum(points[::2]) // 4
+        center_y = sum(points[1::2]) // 4
+        id_surf = app.title_font.render(str(ann['id']), True, (255, 255, 0))
+        app.screen.blit(id_surf, (center_x - 10, center_y - 10))
+        for i in range(0, len(points), 2):
+            pygame.draw.circle(app.screen, (250, 50, 50),
+                               (points[i], points[i+1]), app.point_radius)
+    app.draw_control_panel()
+    pygame.display.flip()
+
+
+def bench_frame(counts, repeat):
+    app = make_app()
+    rows = []
+    for count in counts:
+        quads, ids = synthetic_quads(count, app.image_size)
+        legacy = [{'id': int(i), 'points': q.astype(int).ravel().tolist(), 'selected': False}
+                  for q, i in zip(quads, ids)]
+        fill_store(app, quads, ids)
+        app.update_display()
+
+        def rebuild():
+            app.invalidate_overlay()
+            app.update_display()
+
+        def add_point():
+            app.add_annotation_point((50, 50))
+            app.update_display()
+
+        rows.append({
+            'quads': count,
+            'legacy_full_redraw_ms': timeit(lambda: legacy_frame(app, legacy), repeat),
+            'overlay_rebuild_ms': timeit(rebuild, repeat),
+            'add_point_ms': timeit(add_point, repeat),
+            'idle_frame_ms': timeit(app.update_display, repeat),
+        })
+    return rows
+
+
+def bench_hotpaths(megapixels, counts, repeat, workdir):
+    results = {}
+    image_dir = os.path.join(workdir, "images")
+    label_dir = os.path.join(workdir, "labels")
+    os.makedirs(image_dir)
+    os.makedirs(label_dir)
+    paths = []
+    for mp in megapixels:
+        path = os.path.join(image_dir, f"{mp:g}mp.jpg")
+        synthetic_image(path, mp)
+        paths.append(path)
+
+    app = make_app()
+    app.save_directory = label_dir
+    app.image_dir = image_dir
+    app.dataset = DatasetIndex(image_dir, label_dir,
+                               manifest_path=os.path.join(workdir, "manifest.sqlite"))
+    app.dataset.start_scan().join()
+    app.image_files = app.dataset.files
+    app.prefetcher.set_files(app.image_files)
+
+    for mp, path in zip(megapixels, paths):
+        app.current_index = app.dataset.index_of(path)
+        tag = f"{mp:g}MP"
+        # 冷加载：每次清空预取缓存，计入解码与缩放
+        results[f"load_image[{tag}]"] = sample(
+            lambda: app.load_image(path), repeat, setup=app.prefetcher.cache.clear)
+        results[f"fit_image_to_screen[{tag}]"] = sample(app.fit_image_to_screen, repeat)
+
+        for count in counts:
+            quads, ids = synthetic_quads(count, app.image_size)
+            fill_store(app, quads, ids)
+            results[f"update_display[{tag},{count}q]"] = sample(
+                app.update_display, repeat, setup=app.invalidate_all)
+
+    # 以下与图像大小无关，使用最后一张图
+    rng = np.random.default_rng(1)
+    panel = app.image_panel_rect
+    for count in counts:
+        quads, ids = synthetic_quads(count, app.image_size)
+        fill_store(app, quads, ids)
+        app.update_display()
+        clicks = iter(rng.uniform(panel.topleft, panel.bottomright, (repeat, 2)).astype(int)
+                      .tolist())
+        results[f"handle_right_click[{count}q]"] = sample(
+            lambda: app.handle_right_click(tuple(next(clicks))), repeat)
+
+        # 改造前的做法：逐个四边形调用 point_in_polygon
+        polygons = quads.reshape(count, -1).tolist()
+        point = tuple(quads[0].mean(axis=0).tolist())
+        results[f"point_in_polygon_scan[{count}q]"] = sample(
+            lambda: [app.point_in_polygon(point, p) for p in polygons], repeat)
+
+        corners = iter(rng.uniform((0, 0), app.image_size, (repeat, 2)).tolist())
+        results[f"record_history[{count}q]"] = sample(
+            lambda: app.add_annotation_point(tuple(next(corners))), repeat)
+        results[f"undo[{count}q]"] = sample(app.undo, repeat)
+
+        fill_store(app, quads, ids)
+        app.current_index = len(app.image_files) - 1  # 保存后不再切图，只计保存本身
+        app.current_file = app.image_files[-1]
+        results[f"save_annotations[{count}q]"] = sample(app.save_annotations, repeat)
+        results[f"save_flush[{count}q]"] = sample(
+            lambda: app.writer.flush(), repeat, setup=app.save_annotations)
+
+    app.writer.close()
+    app.prefetcher.shutdown()
+    app.dataset.close()
+    return {name: summarize(samples) for name, samples in results.items()}
+
+
+def compare(results, baseline, threshold):
+    """返回 p50 超过基线 threshold 倍的项：[(名称, 基线 p50, 当前 p50)]"""
+    regressions = []
+    for name, stats in results.items():
+        base = baseline.get(name)
+        if base and stats['p50_ms'] > base['p50_ms'] * threshold:
+            regressions.append((name, base['p50_ms'], stats['p50_ms']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless benchmarks for the annotation tool")
+    parser.add_argument("suite", choices=["frame", "hotpaths"])
+    parser.add_argument("--counts", type=int, nargs="+")
+    parser.add_argument("--megapixels", type=float, nargs="+", default=[1, 12, 50])
+    parser.add_argument("--repeat", type=int)
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--baseline", help="compare against a previous --json output")
+    parser.add_argument("--threshold", type=float, default=1.2,
+                        help="flag a regression when p50 exceeds baseline by this factor")
+    args = parser.parse_args()
+
+    if args.suite == "frame":
+        rows = bench_frame(args.counts or [100, 1000, 10000], args.repeat or 20)
+        keys = list(rows[0])
+        print("  ".join(f"{k:>22}" for k in keys))
+        for row in rows:
+            print("  ".join(f"{row[k]:>22.3f}" if isinstance(row[k], float) else f"{row[k]:>22}"
+                            for k in keys))
+        pygame.quit()
+        return
+
+    workdir = tempfile.mkdtemp(prefix="annotation-bench-")
+    try:
+        results = bench_hotpaths(args.megapixels, args.counts or [10, 1000, 10000],
+                                 args.repeat or 10, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+        pygame.quit()
+
+    report = {
+        'meta': {'time': time.strftime("%Y-%m-%dT%H:%M:%S"), 'python': platform.python_version(),
+                 'platform': platform.platform(), 'pygame': pygame.version.ver,
+                 'opencv': cv2.__version__, 'peak_rss_mb': peak_rss_mb()},
+        'results': results,
+    }
+    width = max(len(name) for name in results)
+    print(f"{'':<{width}}  {'p50':>9}  {'p90':>9}  {'p99':>9}  (ms)")
+    for name, stats in results.items():
+        print(f"{name:<{width}}  {stats['p50_ms']:9.3f}  {stats['p90_ms']:9.3f}  "
+              f"{stats['p99_ms']:9.3f}")
+    if report['meta']['peak_rss_mb'] is not None:
+        print(f"peak RSS: {report['meta']['peak_rss_mb']:.0f} MB")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        for name, base, current in regressions:
+            print(f"REGRESSION {name}: {base:.3f} ms -> {current:.3f} ms ({current / base:.2f}x)")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
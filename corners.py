@@ -0,0 +1,96 @@
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from prefetch import LRUCache
+from spatial import PointGrid
+
+
+def detect_corners(path, max_corners=10000, quality=0.005, min_distance=4):
+    """在原分辨率灰度图上检测角点并细化到亚像素，返回 (N,2) float32 图像坐标"""
+    gray = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if gray is None:
+        raise IOError(f"Failed to read {path}")
+    corners = cv2.goodFeaturesToTrack(gray, max_corners, quality, min_distance, blockSize=5)
+    if corners is None:
+        return np.empty((0, 2), np.float32)
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 20, 0.03)
+    cv2.cornerSubPix(gray, corners, (5, 5), (-1, -1), criteria)
+    return corners.reshape(-1, 2).astype(np.float32)
+
+
+def cache_key(path):
+    """按路径、大小和 mtime 生成缓存键，图像被替换后自动失效"""
+    stat = os.stat(path)
+    text = f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}"
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+class CornerService:
+    """后台为当前图及其后若干张图计算角点候选并建网格索引，结果在内存和磁盘上按图缓存"""
+
+    def __init__(self, ahead=2, workers=1, max_images=64,
+                 cache_dir=os.path.join(".annotation_cache", "corners"), on_ready=None):
+        self.ahead = ahead
+        self.cache_dir = cache_dir
+        self.on_ready = on_ready
+        self.grids = LRUCache(max_items=max_images)
+        self.errors = {}  # 检测失败的图像 -> 错误信息
+        self._pending = {}
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="corners")
+
+    def schedule(self, files, index):
+        """当前图优先，其后 ahead 张依次排队；离开窗口的未开始任务会被取消。
+        切到一张之前检测失败的图时会重试一次"""
+        wanted = files[index:index + self.ahead + 1]
+        with self._lock:
+            for path in [p for p in self.errors if p not in wanted]:
+                del self.errors[path]
+            if wanted:
+                self.errors.pop(wanted[0], None)
+            for path in list(self._pending):
+                if path not in wanted and self._pending[path].cancel():
+                    del self._pending[path]
+            for path in wanted:
+                if path in self._pending or path in self.grids or path in self.errors:
+                    continue
+                self._pending[path] = self._executor.submit(self._load, path)
+
+    def get(self, path):
+        """已就绪时返回该图的 PointGrid，否则返回 None（不阻塞）"""
+        return self.grids.peek(path)
+
+    def error(self, path):
+        """该图最近一次检测失败的原因，没有失败时返回 None"""
+        with self._lock:
+            return self.errors.get(path)
+
+    def _load(self, path):
+        try:
+            cache_path = os.path.join(self.cache_dir, f"{cache_key(path)}.npy")
+            try:
+                points = np.load(cache_path)
+            except (OSError, ValueError):
+                points = detect_corners(path)
+                tmp_path = f"{cache_path}.{threading.get_ident()}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    np.save(f, points)
+                os.replace(tmp_path, cache_path)
+            self.grids.put(path, PointGrid(points))
+        except Exception as e:
+            with self._lock:
+                self.errors[path] = str(e) or type(e).__name__
+        finally:
+            with self._lock:
+                self._pending.pop(path, None)
+        if self.on_ready:
+            self.on_ready(path)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,260 @@
+import bisect
+import hashlib
+import os
+import sqlite3
+import struct
+import threading
+
+IMAGE_EXTS = ('png', 'jpg', 'jpeg', 'bmp')
+
+# 排序键中用 \x01 代替路径分隔符，使按键排序与逐层按名称排序的深度优先遍历顺序一致
+_KEY_SEP = '\x01'
+
+
+def sort_key(rel_path):
+    return rel_path.replace(os.sep, _KEY_SEP).replace('/', _KEY_SEP)
+
+
+def scan_entries(folder):
+    """递归遍历目录，逐个产出 (路径, 大小, mtime)；每层按名称排序，整体顺序确定"""
+    try:
+        with os.scandir(folder) as it:
+            entries = sorted(it, key=lambda e: e.name)
+    except OSError:
+        return
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                yield from scan_entries(entry.path)
+            elif entry.name.lower().endswith(IMAGE_EXTS):
+                stat = entry.stat()
+                yield entry.path, stat.st_size, stat.st_mtime
+        except OSError:
+            continue
+
+
+def iter_images(folder):
+    for path, _, _ in scan_entries(folder):
+        yield path
+
+
+# JPEG 中携带图像尺寸的 SOF 段（排除 DHT/JPG/DAC）
+_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def read_image_size(path):
+    """只读文件头得到图像 (宽, 高)，支持 JPEG/PNG/BMP；无法识别时返回 None"""
+    with open(path, 'rb') as f:
+        head = f.read(26)
+        if head[:8] == b'\x89PNG\r\n\x1a\n':
+            return struct.unpack('>II', head[16:24])
+        if head[:2] == b'BM':
+            w, h = struct.unpack('<ii', head[18:26])
+            return w, abs(h)
+        if head[:2] != b'\xff\xd8':
+            return None
+        f.seek(2)
+        while True:
+            byte = f.read(1)
+            while byte and byte != b'\xff':
+                byte = f.read(1)
+            while byte == b'\xff':
+                byte = f.read(1)
+            if not byte:
+                return None
+            marker = byte[0]
+            if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+                continue  # 无长度字段的标记
+            length = f.read(2)
+            if len(length) < 2:
+                return None
+            if marker in _SOF_MARKERS:
+                data = f.read(5)
+                if len(data) < 5:
+                    return None
+                h, w = struct.unpack('>HH', data[1:5])
+                return w, h
+            f.seek(struct.unpack('>H', length)[0] - 2, os.SEEK_CUR)
+
+
+def label_path_for(image_path, image_dir, label_dir):
+    """标注文件路径：与图像同名的 .txt，保留相对子目录结构"""
+    rel_dir = os.path.relpath(os.path.dirname(image_path), image_dir)
+    base_name = os.path.basename(image_path).split('.')[0]
+    return os.path.normpath(os.path.join(label_dir, rel_dir, f"{base_name}.txt"))
+
+
+def _label_set(label_dir):
+    """标注目录下所有 .txt 的相对路径集合"""
+    labels = set()
+    if not label_dir or not os.path.isdir(label_dir):
+        return labels
+    stack = [label_dir]
+    while stack:
+        folder = stack.pop()
+        with os.scandir(folder) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.endswith('.txt'):
+                    labels.add(os.path.relpath(entry.path, label_dir))
+    return labels
+
+
+class DatasetIndex:
+    """图像目录的持久化索引：SQLite 清单记录每张图的状态、大小和 mtime，
+    后台增量扫描，首次扫描时边扫边产出图像"""
+
+    STATUSES = ('unlabeled', 'labeled', 'skipped')
+
+    def __init__(self, image_dir, label_dir=None, manifest_path=None):
+        self.image_dir = os.path.abspath(image_dir)
+        self.label_dir = os.path.abspath(label_dir) if label_dir else None
+        if manifest_path is None:
+            digest = hashlib.sha1(f"{self.image_dir}|{self.label_dir}".encode()).hexdigest()[:16]
+            manifest_path = os.path.join(".annotation_cache", "manifests", f"{digest}.sqlite")
+        os.makedirs(os.path.dirname(os.path.abspath(manifest_path)), exist_ok=True)
+        self.manifest_path = manifest_path
+
+        self.files = []
+        self.keys = []
+        self.scan_done = threading.Event()
+        self._found = threading.Condition()
+        self._db = self._connect()
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS images (
+                key TEXT PRIMARY KEY,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                status TEXT NOT NULL DEFAULT 'unlabeled'
+            );
+            CREATE INDEX IF NOT EXISTS images_status ON images (status, key);
+        """)
+        for key, rel in self._db.execute("SELECT key, path FROM images ORDER BY key"):
+            self.keys.append(key)
+            self.files.append(os.path.join(self.image_dir, rel))
+
+    def _connect(self):
+        # 连接可能在其他线程（如任务服务器的请求线程）中使用，由调用方负责串行化
+        db = sqlite3.connect(self.manifest_path, timeout=10, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def start_scan(self, on_complete=None):
+        thread = threading.Thread(target=self._scan, args=(on_complete,),
+                                  name="dataset-scan", daemon=True)
+        thread.start()
+        return thread
+
+    def _scan(self, on_complete):
+        db = self._connect()
+        known = {key: (size, mtime, status) for key, size, mtime, status in
+                 db.execute("SELECT key, size, mtime, status FROM images")}
+        labels = _label_set(self.label_dir)
+        # 清单为空说明是首次扫描，直接向 files 追加，界面可以立即显示第一张图
+        streaming = not self.files
+        files, keys, changed = [], [], []
+
+        for path, size, mtime in scan_entries(self.image_dir):
+            rel = os.path.relpath(path, self.image_dir)
+            key = sort_key(rel)
+            old = known.pop(key, None)
+            status = old[2] if old else 'unlabeled'
+            if self.label_dir:
+                base_name = os.path.basename(rel).split('.')[0]
+                if os.path.join(os.path.dirname(rel), f"{base_name}.txt") in labels:
+                    status = 'labeled'
+                elif status == 'labeled':
+                    status = 'unlabeled'
+            if old != (size, mtime, status):
+                changed.append((key, rel, size, mtime, status))
+
+            if streaming:
+                with self._found:
+                    self.files.append(path)
+                    self.keys.append(key)
+                    self._found.notify_all()
+            else:
+                files.append(path)
+                keys.append(key)
+            if len(changed) >= 1000:
+                self._write(db, changed)
+                changed = []
+
+        self._write(db, changed)
+        # 只删除已不存在的图像，未变化的条目不做任何写入
+        if known:
+            db.executemany("DELETE FROM images WHERE key = ?", [(k,) for k in known])
+            db.commit()
+        db.close()
+
+        if not streaming and keys != self.keys:
+            with self._found:
+                # 原地替换，持有同一列表引用的地方（预取等）随之更新
+                self.files[:] = files
+                self.keys[:] = keys
+        with self._found:
+            self.scan_done.set()
+            self._found.notify_all()
+        if on_complete:
+            on_complete()
+
+    def _write(self, db, rows):
+        if not rows:
+            return
+        db.executemany("""
+            INSERT INTO images (key, path, size, mtime, status) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET
+                path = excluded.path, size = excluded.size,
+                mtime = excluded.mtime, status = excluded.status
+        """, rows)
+        db.commit()
+
+    def wait_for_first(self, timeout=None):
+        """等到至少扫描到一张图（或扫描结束）"""
+        with self._found:
+            self._found.wait_for(lambda: self.files or self.scan_done.is_set(), timeout)
+        return bool(self.files)
+
+    def index_of(self, path):
+        key = sort_key(os.path.relpath(path, self.image_dir))
+        i = bisect.bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            return i
+        return None
+
+    def first_unlabeled(self):
+        """借助 (status, key) 索引直接取出第一张未标注图像的位置"""
+        row = self._db.execute(
+            "SELECT key FROM images WHERE status = 'unlabeled' ORDER BY key LIMIT 1").fetchone()
+        if row is None:
+            return None
+        i = bisect.bisect_left(self.keys, row[0])
+        return i if i < len(self.keys) and self.keys[i] == row[0] else None
+
+    def iter_status(self, status):
+        """按排序键顺序逐个产出某状态的 (key, 相对路径)，走 (status, key) 索引"""
+        cursor = self._db.execute(
+            "SELECT key, path FROM images WHERE status = ? ORDER BY key", (status,))
+        yield from cursor
+
+    def status(self, path):
+        row = self._db.execute("SELECT status FROM images WHERE key = ?",
+                               (sort_key(os.path.relpath(path, self.image_dir)),)).fetchone()
+        return row[0] if row else None
+
+    def set_status(self, path, status):
+        assert status in self.STATUSES
+        self._db.execute("UPDATE images SET status = ? WHERE key = ?",
+                         (status, sort_key(os.path.relpath(path, self.image_dir))))
+        self._db.commit()
+
+    def counts(self):
+        counts = dict.fromkeys(self.STATUSES, 0)
+        counts.update(self._db.execute("SELECT status, COUNT(*) FROM images GROUP BY status"))
+        return counts
+
+    def close(self):
+        self._db.close()
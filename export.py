@@ -0,0 +1,410 @@
+"""把图像和四点标注导出成训练集群直接消费的格式：COCO 关键点 JSON 与按大小切分的 tar 分片
+
+用法:
+    python export.py IMAGE_DIR LABEL_DIR OUT_DIR [--format coco shards] [--val 0.1]
+                     [--shard-size 1024] [--workers 8] [--classes names.txt]
+
+只导出有标注文件的图像。train/val 按图像相对路径的哈希划分，数据集增删图像不会改变已有图像的归属。
+tar 分片按 webdataset 惯例把同名的图像和 .txt 放在一起，分片划分只取决于扫描顺序和文件大小，
+各分片由工作线程并行写出（零拷贝 sendfile）。每个输出先写临时文件再原子改名，
+并在 OUT_DIR/export_state.json 中记录其内容摘要；重新运行时摘要未变的输出直接跳过。
+"""
+import argparse
+import hashlib
+import json
+import os
+import tarfile
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from dataset import label_path_for, read_image_size, scan_entries
+from label_io import LabelCache, load_class_names
+
+STATE_FILE = "export_state.json"
+SKELETON = [[1, 2], [2, 3], [3, 4], [4, 1]]
+
+
+class Sample:
+    __slots__ = ('rel', 'image_path', 'image_size', 'label_rel', 'label_path', 'label_size',
+                 'digest')
+
+    def __init__(self, rel, image_path, image_size, label_rel, label_path, label_size, digest):
+        self.rel = rel
+        self.image_path = image_path
+        self.image_size = image_size  # 字节数
+        self.label_rel = label_rel
+        self.label_path = label_path
+        self.label_size = label_size
+        self.digest = digest  # 图像与标注的路径、大小、mtime，任何一项变化都会使输出失效
+
+
+def split_of(rel, val_fraction):
+    """按相对路径哈希确定性地划分 train/val"""
+    if val_fraction <= 0:
+        return 'train'
+    bucket = int.from_bytes(hashlib.sha1(rel.encode()).digest()[:8], 'big') / 2 ** 64
+    return 'val' if bucket < val_fraction else 'train'
+
+
+def iter_samples(image_dir, label_dir, cache):
+    """按扫描顺序逐个产出有标注的图像"""
+    for image_path, size, mtime in scan_entries(image_dir):
+        label_path = label_path_for(image_path, image_dir, label_dir)
+        label_rel = os.path.relpath(label_path, label_dir)
+        i = cache.index_of(label_rel)
+        if i is None:
+            continue
+        rel = os.path.relpath(image_path, image_dir)
+        label_size = int(cache.sizes[i])
+        digest = f"{rel}|{size}|{mtime}|{label_size}|{float(cache.mtimes[i])}"
+        yield Sample(rel, image_path, size, label_rel, label_path, label_size, digest)
+
+
+def _tar_size(size):
+    """一个成员在 tar 中大约占用的字节数（头部加按块对齐的内容）"""
+    return tarfile.BLOCKSIZE * (1 + (size + tarfile.BLOCKSIZE - 1) // tarfile.BLOCKSIZE)
+
+
+def plan_shards(samples, shard_bytes, val_fraction):
+    """按累计 tar 大小切分，逐个产出 (名称, 样本列表)；同样的输入总是得到同样的划分"""
+    open_shards = {}  # split -> [序号, 样本列表, 字节数]
+    for sample in samples:
+        split = split_of(sample.rel, val_fraction)
+        shard = open_shards.setdefault(split, [0, [], 0])
+        size = _tar_size(sample.image_size) + _tar_size(sample.label_size)
+        if shard[1] and shard[2] + size > shard_bytes:
+            yield f"{split}-{shard[0]:06d}.tar", shard[1]
+            shard[:] = [shard[0] + 1, [], 0]
+        shard[1].append(sample)
+        shard[2] += size
+    for split, shard in sorted(open_shards.items()):
+        if shard[1]:
+            yield f"{split}-{shard[0]:06d}.tar", shard[1]
+
+
+def _digest(samples):
+    h = hashlib.sha1()
+    for sample in samples:
+        h.update(sample.digest.encode())
+        h.update(b'\n')
+    return h.hexdigest()
+
+
+def _copy(src, out, size):
+    """把 src 的 size 字节追加到 out，能用 sendfile 时不经过用户态"""
+    if hasattr(os, 'sendfile'):
+        offset = 0
+        while offset < size:
+            sent = os.sendfile(out.fileno(), src.fileno(), offset, size - offset)
+            if not sent:
+                raise IOError(f"{src.name} is shorter than expected")
+            offset += sent
+    else:
+        while size > 0:
+            chunk = src.read(min(size, 1 << 20))
+            if not chunk:
+                raise IOError(f"{src.name} is shorter than expected")
+            out.write(chunk)
+            size -= len(chunk)
+
+
+def _add_member(out, name, path, mtime=0):
+    """写一个 tar 成员：头部由 tarfile 生成，内容直接从源文件拷贝"""
+    with open(path, 'rb') as src:
+        size = os.fstat(src.fileno()).st_size
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = mtime
+        out.write(info.tobuf(format=tarfile.PAX_FORMAT))
+        _copy(src, out, size)
+        out.write(b'\0' * (-size % tarfile.BLOCKSIZE))
+    return size
+
+
+def write_shard(path, samples):
+    """写一个 tar 分片：每个样本为 <键>.<图像扩展名> 和 <键>.txt"""
+    tmp_path = f"{path}.tmp"
+    total = 0
+    # 不带缓冲，sendfile 直接写在文件当前位置之后
+    with open(tmp_path, 'wb', buffering=0) as out:
+        for sample in samples:
+            key, ext = os.path.splitext(sample.rel.replace(os.sep, '/'))
+            total += _add_member(out, f"{key}{ext.lower()}", sample.image_path)
+            total += _add_member(out, f"{key}.txt", sample.label_path)
+        out.write(b'\0' * tarfile.BLOCKSIZE * 2)
+        os.fsync(out.fileno())
+    os.replace(tmp_path, path)
+    return len(samples), total
+
+
+def _coco_chunk(chunk, cache):
+    """在工作线程中读文件头得到尺寸，并把归一化四点坐标换算成像素关键点"""
+    images = []
+    for sample in chunk:
+        size = read_image_size(sample.image_path)
+        if size is None:
+            # 无法从文件头读出尺寸的格式才解码整张图
+            bgr = cv2.imread(sample.image_path)
+            size = None if bgr is None else (bgr.shape[1], bgr.shape[0])
+        ids, quads = cache.get(sample.label_rel)
+        images.append((sample, size, np.array(ids), np.array(quads)))
+    return images
+
+
+def _quad_records(quads, size):
+    """(N,4,2) 归一化坐标 -> 每个四边形的关键点、外接框和面积"""
+    pixels = quads.astype(np.float64) * size
+    lo, hi = pixels.min(axis=1), pixels.max(axis=1)
+    x, y = pixels[..., 0], pixels[..., 1]
+    area = 0.5 * np.abs((x * np.roll(y, -1, axis=1) - np.roll(x, -1, axis=1) * y).sum(axis=1))
+    # COCO 关键点为 (x, y, v) 三元组，v=2 表示可见
+    keypoints = np.concatenate([pixels, np.full((len(pixels), 4, 1), 2.0)], axis=2)
+    return (np.round(keypoints.reshape(len(pixels), -1), 2).tolist(),
+            np.round(np.concatenate([lo, hi - lo], axis=1), 2).tolist(),
+            np.round(pixels.reshape(len(pixels), -1), 2).tolist(),
+            np.round(area, 2).tolist())
+
+
+class CocoWriter:
+    """流式写 COCO JSON：images 直接写入目标文件，annotations 先写到旁边的临时文件，最后拼接"""
+
+    def __init__(self, path, category_name):
+        self.path = path
+        self.tmp_path = f"{path}.tmp"
+        self.ann_path = f"{path}.annotations.tmp"
+        self.category_name = category_name
+        self.out = open(self.tmp_path, 'w')
+        self.ann = open(self.ann_path, 'w')
+        self.out.write('{"info": {"description": "four-point annotations"},\n"images": [')
+        self.image_id = 0
+        self.ann_id = 0
+        self.class_ids = set()
+
+    def add(self, sample, size, ids, quads):
+        if size is None:
+            return
+        self.image_id += 1
+        image = {'id': self.image_id, 'file_name': sample.rel.replace(os.sep, '/'),
+                 'width': int(size[0]), 'height': int(size[1])}
+        self.out.write((',\n' if self.image_id > 1 else '\n') + json.dumps(image))
+        if not len(ids):
+            return
+        keypoints, boxes, polygons, areas = _quad_records(quads, size)
+        for class_id, kp, box, polygon, area in zip(ids.tolist(), keypoints, boxes, polygons,
+                                                    areas):
+            self.ann_id += 1
+            self.class_ids.add(class_id)
+            record = {'id': self.ann_id, 'image_id': self.image_id, 'category_id': class_id,
+                      'keypoints': kp, 'num_keypoints': 4, 'bbox': box,
+                      'segmentation': [polygon], 'area': area, 'iscrowd': 0}
+            self.ann.write((',\n' if self.ann_id > 1 else '\n') + json.dumps(record))
+
+    def close(self):
+        self.ann.close()
+        self.out.write('\n],\n"annotations": [')
+        with open(self.ann_path) as ann:
+            while True:
+                chunk = ann.read(1 << 20)
+                if not chunk:
+                    break
+                self.out.write(chunk)
+        os.remove(self.ann_path)
+        categories = [{'id': class_id, 'name': self.category_name(class_id),
+                       'supercategory': 'object', 'keypoints': ['p1', 'p2', 'p3', 'p4'],
+                       'skeleton': SKELETON}
+                      for class_id in sorted(self.class_ids)]
+        self.out.write('\n],\n"categories": ' + json.dumps(categories) + '}\n')
+        self.out.flush()
+        os.fsync(self.out.fileno())
+        self.out.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        for f, path in ((self.out, self.tmp_path), (self.ann, self.ann_path)):
+            f.close()
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+class Exporter:
+    def __init__(self, image_dir, label_dir, out_dir, val_fraction=0.1, workers=8,
+                 class_names=None):
+        self.image_dir = os.path.abspath(image_dir)
+        self.label_dir = os.path.abspath(label_dir)
+        self.out_dir = out_dir
+        self.val_fraction = val_fraction
+        self.workers = workers
+        self.class_names = class_names or []
+        os.makedirs(out_dir, exist_ok=True)
+        self.cache = LabelCache(self.label_dir)
+        self.cache.update()
+        self.state_path = os.path.join(out_dir, STATE_FILE)
+        try:
+            with open(self.state_path) as f:
+                self.state = json.load(f)
+        except (OSError, ValueError):
+            self.state = {}
+
+    def samples(self):
+        return iter_samples(self.image_dir, self.label_dir, self.cache)
+
+    def _done(self, name, digest):
+        return (self.state.get(name) == digest and
+                os.path.exists(os.path.join(self.out_dir, name)))
+
+    def _record(self, name, digest):
+        self.state[name] = digest
+        self._save_state()
+
+    def _save_state(self):
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.state_path)
+
+    def _prune(self, suffix, keep):
+        """删除上次导出留下、本次划分中已不存在的输出（如分片大小或 val 比例改变后）"""
+        stale = [name for name in self.state if name.endswith(suffix) and name not in keep]
+        for name in stale:
+            try:
+                os.remove(os.path.join(self.out_dir, name))
+            except OSError:
+                pass
+            del self.state[name]
+        if stale:
+            self._save_state()
+        return len(stale)
+
+    def category_name(self, class_id):
+        if 0 <= class_id < len(self.class_names):
+            return self.class_names[class_id]
+        return str(class_id)
+
+    def export_shards(self, shard_bytes):
+        """并行写出所有分片，在途分片数有上限，内存只与分片数和工作线程数有关"""
+        stats = {'shards': 0, 'skipped': 0, 'samples': 0, 'bytes': 0}
+        pending = deque()
+        planned = set()
+
+        def finish(name, digest, future):
+            count, nbytes = future.result()
+            self._record(name, digest)
+            stats['shards'] += 1
+            stats['samples'] += count
+            stats['bytes'] += nbytes
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for name, samples in plan_shards(self.samples(), shard_bytes, self.val_fraction):
+                digest = _digest(samples)
+                planned.add(name)
+                if self._done(name, digest):
+                    stats['skipped'] += 1
+                    continue
+                path = os.path.join(self.out_dir, name)
+                pending.append((name, digest, executor.submit(write_shard, path, samples)))
+                if len(pending) >= self.workers * 2:
+                    finish(*pending.popleft())
+            while pending:
+                finish(*pending.popleft())
+        stats['removed'] = self._prune('.tar', planned)
+        return stats
+
+    def export_coco(self, chunk_size=256):
+        """每个划分一个 <split>.json；文件头读取在线程池中进行，结果按扫描顺序写出"""
+        stats = {'images': 0, 'annotations': 0, 'skipped': 0}
+        digests = {}
+        for sample in self.samples():
+            h = digests.setdefault(split_of(sample.rel, self.val_fraction), hashlib.sha1())
+            h.update(sample.digest.encode())
+            h.update(b'\n')
+        names = ','.join(self.class_names)
+        todo = {}
+        for split, h in digests.items():
+            name = f"{split}.json"
+            digest = hashlib.sha1(f"{h.hexdigest()}|{names}".encode()).hexdigest()
+            if self._done(name, digest):
+                stats['skipped'] += 1
+            else:
+                todo[split] = (name, digest)
+        stats['removed'] = self._prune('.json', {f"{split}.json" for split in digests})
+        if not todo:
+            return stats
+
+        writers = {split: CocoWriter(os.path.join(self.out_dir, name), self.category_name)
+                   for split, (name, _) in todo.items()}
+
+        def consume(result):
+            for sample, size, ids, quads in result:
+                writers[split_of(sample.rel, self.val_fraction)].add(sample, size, ids, quads)
+
+        def chunks():
+            chunk = []
+            for sample in self.samples():
+                if split_of(sample.rel, self.val_fraction) in todo:
+                    chunk.append(sample)
+                    if len(chunk) == chunk_size:
+                        yield chunk
+                        chunk = []
+            if chunk:
+                yield chunk
+
+        try:
+            pending = deque()
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for chunk in chunks():
+                    pending.append(executor.submit(_coco_chunk, chunk, self.cache))
+                    if len(pending) >= self.workers * 2:
+                        consume(pending.popleft().result())
+                while pending:
+                    consume(pending.popleft().result())
+        except BaseException:
+            for writer in writers.values():
+                writer.abort()
+            raise
+        for split, writer in writers.items():
+            writer.close()
+            self._record(*todo[split])
+            stats['images'] += writer.image_id
+            stats['annotations'] += writer.ann_id
+        return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export four-point labels for training")
+    parser.add_argument("image_dir")
+    parser.add_argument("label_dir")
+    parser.add_argument("out_dir")
+    parser.add_argument("--format", nargs="+", choices=("coco", "shards"),
+                        default=["coco", "shards"])
+    parser.add_argument("--val", type=float, default=0.1, help="fraction of images for val")
+    parser.add_argument("--shard-size", type=float, default=1024, help="tar shard size in MB")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--classes",
+                        help="comma-separated class names, or a file with one name per line")
+    args = parser.parse_args()
+
+    exporter = Exporter(args.image_dir, args.label_dir, args.out_dir, args.val, args.workers,
+                        load_class_names(args.classes) if args.classes else None)
+    if "coco" in args.format:
+        start = time.perf_counter()
+        stats = exporter.export_coco()
+        print(f"COCO: {stats['images']} images, {stats['annotations']} annotations "
+              f"in {time.perf_counter() - start:.1f}s ({stats['skipped']} splits up to date)")
+    if "shards" in args.format:
+        start = time.perf_counter()
+        stats = exporter.export_shards(int(args.shard_size * 2 ** 20))
+        elapsed = time.perf_counter() - start
+        print(f"Shards: {stats['shards']} written, {stats['skipped']} up to date, "
+              f"{stats['removed']} stale removed, {stats['samples']} samples, "
+              f"{stats['bytes'] / 2 ** 20:.0f} MB "
+              f"in {elapsed:.1f}s ({stats['bytes'] / 2 ** 20 / max(elapsed, 1e-9):.0f} MB/s)")
+
+
+if __name__ == "__main__":
+    main()
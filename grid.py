@@ -0,0 +1,239 @@
+"""缩略图总览：磁盘缓存的缩略图，以及只绘制可见格子的虚拟化网格
+
+缩略图在后台线程中按缩小比例直接解码（JPEG 可在解码时缩小 2/4/8 倍），
+编码成小 JPEG 存到 .annotation_cache/thumbs，键为路径、大小和 mtime，图像替换后自动失效。
+网格滚动时只为可见范围（及前后各一行）请求缩略图，离开可见范围的未开始任务会被取消。
+"""
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+import pygame
+
+from prefetch import LRUCache, imread_reduced
+
+BADGE_COLORS = {
+    'labeled': (46, 204, 113),
+    'skipped': (230, 126, 34),
+    'unlabeled': (120, 120, 120),
+}
+
+
+def make_thumbnail(path, size, read=None):
+    """解码并缩放到不超过 size×size 的 BGR 图；read 为自定义解码函数（如视频帧源）"""
+    if read is not None:
+        bgr = read(path)
+    else:
+        bgr, _ = imread_reduced(path, (size, size), margin=0)
+    if bgr is None:
+        return None
+    h, w = bgr.shape[:2]
+    scale = min(size / w, size / h, 1.0)
+    return cv2.resize(bgr, (max(1, int(w * scale)), max(1, int(h * scale))),
+                      interpolation=cv2.INTER_AREA)
+
+
+def cache_key(path, size):
+    """按路径、大小和 mtime 生成缓存键；视频帧等虚拟路径取所在视频文件的信息"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        stat = os.stat(os.path.dirname(path))
+    text = f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}|{size}"
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+class ThumbnailCache:
+    """后台生成缩略图：内存中按字节数 LRU，磁盘上按键持久化"""
+
+    def __init__(self, size=128, workers=2, max_bytes=64 * 1024 * 1024,
+                 cache_dir=os.path.join(".annotation_cache", "thumbs"), read=None,
+                 on_ready=None):
+        self.size = size
+        self.cache_dir = cache_dir
+        self.read = read
+        self.on_ready = on_ready
+        self.surfaces = LRUCache(max_bytes)
+        self.failed = set()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="thumbs")
+
+    def get(self, path):
+        """已就绪时返回 surface，否则返回 None（不阻塞）"""
+        entry = self.surfaces.peek(path)
+        return entry[0] if entry is not None else None
+
+    def request(self, paths):
+        """只保留 paths 的生成任务：新请求排队，其余未开始的任务取消"""
+        wanted = set(paths)
+        with self._lock:
+            for path in list(self._pending):
+                if path not in wanted and self._pending[path].cancel():
+                    del self._pending[path]
+            for path in paths:
+                if path in self._pending or path in self.failed or path in self.surfaces:
+                    continue
+                self._pending[path] = self._executor.submit(self._load, path)
+
+    def _load(self, path):
+        try:
+            bgr = self._thumbnail(path)
+        except Exception:
+            bgr = None
+        with self._lock:
+            self._pending.pop(path, None)
+            if bgr is None:
+                self.failed.add(path)
+        if bgr is None:
+            return
+        rgb = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+        surface = pygame.image.frombuffer(rgb.data, (rgb.shape[1], rgb.shape[0]), 'RGB')
+        self.surfaces.put(path, (surface, rgb), rgb.nbytes)
+        if self.on_ready:
+            self.on_ready()
+
+    def _thumbnail(self, path):
+        key = cache_key(path, self.size)
+        cache_path = os.path.join(self.cache_dir, key[:2], f"{key}.jpg")
+        try:
+            with open(cache_path, 'rb') as f:
+                data = np.frombuffer(f.read(), np.uint8)
+        except OSError:
+            pass  # 还没有缓存
+        else:
+            bgr = cv2.imdecode(data, cv2.IMREAD_COLOR)
+            if bgr is not None:
+                return bgr
+        bgr = make_thumbnail(path, self.size, self.read)
+        if bgr is not None:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            ok, data = cv2.imencode('.jpg', bgr, [cv2.IMWRITE_JPEG_QUALITY, 85])
+            if ok:
+                tmp_path = f"{cache_path}.{threading.get_ident()}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(data.tobytes())
+                os.replace(tmp_path, cache_path)
+        return bgr
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class GridView:
+    """虚拟化的缩略图网格：按滚动位置算出可见的序号范围，只绘制和加载这些格子
+
+    info(path) 返回 (状态, 四边形数量或 None)，用于角标。
+    """
+
+    def __init__(self, rect, files, thumbs, info, font, current=0):
+        self.rect = pygame.Rect(rect)
+        self.files = files  # 与主程序共享的图像列表，扫描中可能继续增长
+        self.thumbs = thumbs
+        self.info = info
+        self.font = font
+        self.cell_w = thumbs.size + 12
+        self.cell_h = thumbs.size + 28
+        self.cols = max(1, (self.rect.width - 8) // self.cell_w)
+        self.margin = (self.rect.width - self.cols * self.cell_w) // 2
+        self.scroll = 0.0  # 像素
+        self.cursor = current
+        self.current = current
+        self.dirty = True
+        self._cells = {}  # 可见格子的角标与文字，滚动时只为新露出的格子重新计算
+        self.ensure_visible(current, center=True)
+
+    @property
+    def rows(self):
+        return (len(self.files) + self.cols - 1) // self.cols
+
+    @property
+    def max_scroll(self):
+        return max(0.0, self.rows * self.cell_h - self.rect.height)
+
+    def scroll_to(self, y):
+        y = min(max(0.0, y), self.max_scroll)
+        if y != self.scroll:
+            self.scroll = y
+            self.dirty = True
+
+    def scroll_by(self, dy):
+        self.scroll_to(self.scroll + dy)
+
+    def ensure_visible(self, index, center=False):
+        top = (index // self.cols) * self.cell_h
+        if center:
+            self.scroll_to(top - (self.rect.height - self.cell_h) / 2)
+        elif top < self.scroll:
+            self.scroll_to(top)
+        elif top + self.cell_h > self.scroll + self.rect.height:
+            self.scroll_to(top + self.cell_h - self.rect.height)
+
+    def move_cursor(self, delta):
+        if not len(self.files):
+            return
+        self.cursor = min(max(0, self.cursor + delta), len(self.files) - 1)
+        self.ensure_visible(self.cursor)
+        self.dirty = True
+
+    def visible_range(self, extra_rows=0):
+        first_row = max(0, int(self.scroll // self.cell_h) - extra_rows)
+        last_row = int((self.scroll + self.rect.height) // self.cell_h) + 1 + extra_rows
+        return first_row * self.cols, min(len(self.files), last_row * self.cols)
+
+    def index_at(self, pos):
+        x, y = pos[0] - self.rect.x - self.margin, pos[1] - self.rect.y + self.scroll
+        if not self.rect.collidepoint(pos) or x < 0 or x >= self.cols * self.cell_w:
+            return None
+        index = int(y // self.cell_h) * self.cols + int(x // self.cell_w)
+        return index if index < len(self.files) else None
+
+    def cell_rect(self, index):
+        row, col = divmod(index, self.cols)
+        return pygame.Rect(self.rect.x + self.margin + col * self.cell_w,
+                           self.rect.y + row * self.cell_h - int(self.scroll),
+                           self.cell_w, self.cell_h)
+
+    def _cell(self, index, path):
+        status, count = self.info(path)
+        count_text = self.font.render(str(count), True, (255, 255, 255)) if count else None
+        caption = self.font.render(f"{index + 1}  {os.path.basename(path)}", True,
+                                   (200, 200, 200))
+        return BADGE_COLORS.get(status, (120, 120, 120)), count_text, caption
+
+    def draw(self, surface):
+        """绘制可见格子，并为可见范围前后各一行请求缩略图"""
+        surface.fill((30, 30, 30), self.rect)
+        lo, hi = self.visible_range()
+        self.thumbs.request(self.files[slice(*self.visible_range(extra_rows=1))])
+        size = self.thumbs.size
+        cells = {}
+        for index in range(lo, hi):
+            path = self.files[index]
+            cell = self._cells.get((index, path))
+            if cell is None:
+                cell = self._cell(index, path)
+            cells[index, path] = cell
+            badge, count_text, caption = cell
+            rect = self.cell_rect(index)
+            box = pygame.Rect(rect.x + 6, rect.y + 4, size, size)
+            surface.fill((50, 50, 50), box)
+            thumb = self.thumbs.get(path)
+            if thumb is not None:
+                surface.blit(thumb, thumb.get_rect(center=box.center))
+            pygame.draw.circle(surface, badge, (box.x + 8, box.y + 8), 6)
+            if count_text is not None:
+                bg = count_text.get_rect(topright=(box.right - 2, box.y + 2)).inflate(6, 2)
+                surface.fill((0, 0, 0), bg)
+                surface.blit(count_text, count_text.get_rect(center=bg.center))
+            surface.blit(caption, (box.x, box.bottom + 4),
+                         pygame.Rect(0, 0, size, caption.get_height()))
+            if index == self.current:
+                pygame.draw.rect(surface, (241, 196, 15), box.inflate(4, 4), 2)
+            if index == self.cursor:
+                pygame.draw.rect(surface, (255, 255, 255), box.inflate(8, 8), 1)
+        self._cells = cells
+        self.dirty = False
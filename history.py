@@ -0,0 +1,132 @@
+from collections import deque
+
+
+class AddPoint:
+    """追加一个点；凑满四个点时自动成为完整的四边形"""
+
+    def __init__(self, point, class_id):
+        self.point = tuple(point)
+        self.class_id = class_id
+
+    def apply(self, store):
+        store.add_point(self.point, self.class_id)
+
+    def revert(self, store):
+        store.remove_point()
+
+    def indices(self, store):
+        # 只有 pending 为空时（刚补全或即将拆回 pending）才涉及最后一个四边形
+        return [len(store) - 1] if len(store) and not store.pending else []
+
+
+class AddAnnotations:
+    """一次性加入多个四边形（如接受模型给出的候选）"""
+
+    def __init__(self, quads, ids):
+        self.quads = quads
+        self.ids = ids
+
+    def apply(self, store):
+        for quad, class_id in zip(self.quads, self.ids):
+            store.insert(len(store), quad, class_id)
+
+    def revert(self, store):
+        for _ in range(len(self.ids)):
+            store.delete(len(store) - 1)
+
+    def indices(self, store):
+        return range(max(len(store) - len(self.ids), 0), len(store))
+
+
+class DeleteAnnotation:
+    def __init__(self, index):
+        self.index = index
+        self.quad = None
+        self.class_id = None
+
+    def apply(self, store):
+        self.quad, self.class_id = store.delete(self.index)
+
+    def revert(self, store):
+        store.insert(self.index, self.quad, self.class_id)
+
+    def indices(self, store):
+        return [self.index]
+
+
+class ChangeId:
+    def __init__(self, index, new_id):
+        self.index = index
+        self.new_id = new_id
+        self.old_id = None
+
+    def apply(self, store):
+        self.old_id = int(store.ids[self.index])
+        store.set_id(self.index, self.new_id)
+
+    def revert(self, store):
+        store.set_id(self.index, self.old_id)
+
+    def indices(self, store):
+        return [self.index]
+
+
+class MoveVertex:
+    """拖动已有标注的某个角点"""
+
+    def __init__(self, index, vertex, old, new):
+        self.index = index
+        self.vertex = vertex
+        self.old = tuple(old)
+        self.new = tuple(new)
+
+    def apply(self, store):
+        store.set_vertex(self.index, self.vertex, self.new)
+
+    def revert(self, store):
+        store.set_vertex(self.index, self.vertex, self.old)
+
+    def indices(self, store):
+        return [self.index]
+
+
+class History:
+    """基于命令的撤销/重做：只记录增量，容量有上限，每张图一份
+
+    每个命令的 indices(store) 给出它在 store 当前状态下涉及的标注下标，
+    撤销/重做前后各取一次即可得到需要重绘的区域"""
+
+    def __init__(self, max_entries=1000):
+        self.undo_stack = deque(maxlen=max_entries)
+        self.redo_stack = []
+
+    def execute(self, command, store):
+        command.apply(store)
+        self.undo_stack.append(command)
+        self.redo_stack.clear()
+
+    def peek_undo(self):
+        return self.undo_stack[-1] if self.undo_stack else None
+
+    def peek_redo(self):
+        return self.redo_stack[-1] if self.redo_stack else None
+
+    def undo(self, store):
+        if not self.undo_stack:
+            return None
+        command = self.undo_stack.pop()
+        command.revert(store)
+        self.redo_stack.append(command)
+        return command
+
+    def redo(self, store):
+        if not self.redo_stack:
+            return None
+        command = self.redo_stack.pop()
+        command.apply(store)
+        self.undo_stack.append(command)
+        return command
+
+    def clear(self):
+        self.undo_stack.clear()
+        self.redo_stack.clear()
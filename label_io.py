@@ -0,0 +1,255 @@
+"""YOLO 四点标注的读写，以及把整个标注目录编译为列式缓存
+
+每行格式为 `id x1 y1 x2 y2 x3 y3 x4 y4`，坐标按图像宽高归一化。
+列式缓存把所有标注存成几个 .npy：ids(M,)、quads(M,4,2) float32 和每个文件的 offsets(N+1,)，
+加载时内存映射，不必再逐个打开小文件；标注文件变化时只重新解析变化的文件。
+
+用法:
+    python label_io.py LABEL_DIR
+"""
+import bisect
+import hashlib
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+FIELDS = 9
+
+
+def _tokens(text):
+    """逐行拆分为数值字段，字段数不对的行整行丢弃，只保留完整的四点标注。返回 (字段, 丢弃的行数)
+
+    必须逐行检查：总字段数是 FIELDS 的倍数并不代表每行都完整，
+    例如 7 个字段的行后面跟一行 11 个字段，整体拼起来会错位成两条错误的标注。"""
+    tokens = []
+    bad = 0
+    for line in text.splitlines():
+        fields = line.split()
+        if len(fields) == FIELDS:
+            tokens.extend(fields)
+        elif fields:
+            bad += 1
+    return tokens, bad
+
+
+def _columns(tokens):
+    values = np.array(tokens, np.float32).reshape(-1, FIELDS)
+    return values[:, 0].astype(np.int32), values[:, 1:].reshape(-1, 4, 2)
+
+
+def parse_labels(text):
+    """返回 (ids(N,), quads(N,4,2))，坐标为归一化值"""
+    return _columns(_tokens(text)[0])
+
+
+def read_labels(path):
+    with open(path, 'r') as f:
+        return parse_labels(f.read())
+
+
+def _read_checked(path):
+    """同 read_labels，另外返回字段数不对而被丢弃的行数"""
+    with open(path, 'r') as f:
+        tokens, bad = _tokens(f.read())
+    return _columns(tokens) + (bad,)
+
+
+def format_labels(ids, quads, image_size):
+    """quads 为像素坐标，按 `id x1 y1 x2 y2 x3 y3 x4 y4` 输出归一化坐标"""
+    img_w, img_h = image_size
+    lines = []
+    for class_id, quad in zip(np.asarray(ids).tolist(), np.asarray(quads).tolist()):
+        coords = ' '.join(f"{x/img_w} {y/img_h}" for x, y in quad)
+        lines.append(f"{class_id} {coords}\n")
+    return ''.join(lines)
+
+
+def write_labels(path, ids, quads, image_size):
+    """先写临时文件再原子替换，中途崩溃不会留下半截标注"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(format_labels(ids, quads, image_size))
+    os.replace(tmp_path, path)
+
+
+def load_class_names(spec):
+    """--classes 可以是逗号分隔的类别名，也可以是每行一个类别名的文件"""
+    if os.path.isfile(spec):
+        with open(spec, encoding='utf-8') as f:
+            return [line.strip() for line in f if line.strip()]
+    return [name.strip() for name in spec.split(',') if name.strip()]
+
+
+def scan_labels(label_dir):
+    """递归列出所有 .txt，返回按相对路径排序的 [(相对路径, 大小, mtime)]"""
+    entries = []
+    stack = [(label_dir, '')]
+    while stack:
+        folder, prefix = stack.pop()
+        try:
+            with os.scandir(folder) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append((entry.path, prefix + entry.name + os.sep))
+                    elif entry.name.endswith('.txt'):
+                        stat = entry.stat()
+                        entries.append((prefix + entry.name, stat.st_size, stat.st_mtime))
+        except OSError:
+            continue
+    entries.sort()
+    return entries
+
+
+class LabelCache:
+    """标注目录的列式缓存，内存映射加载，按文件的大小和 mtime 增量失效"""
+
+    ARRAYS = ('ids', 'quads', 'offsets', 'sizes', 'mtimes', 'malformed')
+    # 解析规则变化时递增，旧缓存里的标注和残缺行计数整体作废
+    # 2: 逐行检查字段数，此前总字段数凑巧整除的错位文件会被当成完好的
+    FORMAT = 2
+
+    def __init__(self, label_dir, cache_dir=None):
+        self.label_dir = os.path.abspath(label_dir)
+        if cache_dir is None:
+            digest = hashlib.sha1(self.label_dir.encode()).hexdigest()[:16]
+            cache_dir = os.path.join(".annotation_cache", "labels", digest)
+        self.cache_dir = cache_dir
+        self.names = []
+        self.ids = np.empty(0, np.int32)
+        self.quads = np.empty((0, 4, 2), np.float32)
+        self.offsets = np.zeros(1, np.int64)
+        self.sizes = np.empty(0, np.int64)
+        self.mtimes = np.empty(0, np.float64)
+        self.malformed = np.empty(0, np.int32)  # 每个文件被丢弃的残缺行数
+        self.reparsed = 0
+        self._load()
+
+    def _load(self):
+        meta_path = os.path.join(self.cache_dir, "meta.json")
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            arrays = {name: np.load(os.path.join(self.cache_dir, f"{name}.npy"), mmap_mode='r')
+                      for name in self.ARRAYS}
+        except (OSError, ValueError):
+            return
+        # meta.json 最后写入，数组与之不符说明上次写到一半，整体作废
+        if len(meta['names']) + 1 != len(arrays['offsets']) or \
+                len(arrays['ids']) != meta['count'] or meta.get('format') != self.FORMAT:
+            return
+        self.names = meta['names']
+        for name, array in arrays.items():
+            setattr(self, name, array)
+
+    def _save(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        for name in self.ARRAYS:
+            path = os.path.join(self.cache_dir, f"{name}.npy")
+            with open(f"{path}.tmp", 'wb') as f:
+                np.save(f, np.ascontiguousarray(getattr(self, name)))
+            os.replace(f"{path}.tmp", path)
+        meta_path = os.path.join(self.cache_dir, "meta.json")
+        with open(f"{meta_path}.tmp", 'w') as f:
+            json.dump({'names': self.names, 'count': int(len(self.ids)),
+                       'format': self.FORMAT}, f)
+        os.replace(f"{meta_path}.tmp", meta_path)
+
+    def update(self):
+        """重新扫描目录，只解析新增或变化的文件；无变化时不写盘。返回重新解析的文件数"""
+        entries = scan_labels(self.label_dir)
+        names = [rel for rel, _, _ in entries]
+        sizes = np.array([e[1] for e in entries], np.int64)
+        mtimes = np.array([e[2] for e in entries], np.float64)
+
+        # 与缓存逐文件比对大小和 mtime（向量化），找出可以直接复用的文件
+        cached = {name: i for i, name in enumerate(self.names)}
+        src = np.array([cached.get(rel, -1) for rel in names], np.int64)
+        keep = src >= 0
+        keep[keep] = (np.asarray(self.sizes)[src[keep]] == sizes[keep]) & \
+                     (np.asarray(self.mtimes)[src[keep]] == mtimes[keep])
+        self.reparsed = int((~keep).sum())
+        if not self.reparsed and names == self.names:
+            return 0
+
+        old_offsets = np.asarray(self.offsets)
+        counts = np.zeros(len(names), np.int64)
+        counts[keep] = old_offsets[src[keep] + 1] - old_offsets[src[keep]]
+        malformed = np.zeros(len(names), np.int32)
+        malformed[keep] = np.asarray(self.malformed)[src[keep]]
+        parsed = {}
+        for i in np.flatnonzero(~keep).tolist():
+            try:
+                file_ids, file_quads, malformed[i] = _read_checked(
+                    os.path.join(self.label_dir, names[i]))
+            except (OSError, ValueError):
+                # 含非数字字段等无法解析的文件整体记为残缺
+                file_ids, file_quads = np.empty(0, np.int32), np.empty((0, 4, 2), np.float32)
+                malformed[i] = -1
+            parsed[i] = (file_ids, file_quads)
+            counts[i] = len(file_ids)
+
+        offsets = np.zeros(len(names) + 1, np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        ids = np.empty(offsets[-1], np.int32)
+        quads = np.empty((offsets[-1], 4, 2), np.float32)
+        # 复用部分按标注条目一次性 gather，不逐文件切片
+        kept_counts = counts[keep]
+        run_start = np.repeat(np.cumsum(kept_counts) - kept_counts, kept_counts)
+        intra = np.arange(kept_counts.sum()) - run_start
+        dest = np.repeat(offsets[:-1][keep], kept_counts) + intra
+        source = np.repeat(old_offsets[src[keep]], kept_counts) + intra
+        ids[dest] = np.asarray(self.ids)[source]
+        quads[dest] = np.asarray(self.quads)[source]
+        for i, (file_ids, file_quads) in parsed.items():
+            ids[offsets[i]:offsets[i + 1]] = file_ids
+            quads[offsets[i]:offsets[i + 1]] = file_quads
+
+        self.names = names
+        self.ids, self.quads, self.offsets = ids, quads, offsets
+        self.sizes, self.mtimes, self.malformed = sizes, mtimes, malformed
+        self._save()
+        self._load()  # 换回内存映射，释放刚拼接的数组
+        return self.reparsed
+
+    def __len__(self):
+        return len(self.names)
+
+    def index_of(self, rel_path):
+        i = bisect.bisect_left(self.names, rel_path)
+        if i < len(self.names) and self.names[i] == rel_path:
+            return i
+        return None
+
+    def get(self, rel_path):
+        """取某个标注文件（相对 label_dir 的路径）的 (ids, quads)，不存在时返回 None"""
+        i = self.index_of(rel_path)
+        if i is None:
+            return None
+        lo, hi = int(self.offsets[i]), int(self.offsets[i + 1])
+        return self.ids[lo:hi], self.quads[lo:hi]
+
+    def file_index(self):
+        """每条标注所属文件的序号，便于按文件做向量化统计"""
+        return np.repeat(np.arange(len(self.names)), np.diff(self.offsets))
+
+
+def main():
+    if len(sys.argv) != 2:
+        print(__doc__.strip().splitlines()[-1].strip())
+        sys.exit(1)
+    start = time.perf_counter()
+    cache = LabelCache(sys.argv[1])
+    loaded = time.perf_counter()
+    parsed = cache.update()
+    updated = time.perf_counter()
+    print(f"{len(cache)} label files, {len(cache.ids)} annotations")
+    print(f"load {1000*(loaded-start):.1f} ms, update {1000*(updated-loaded):.1f} ms "
+          f"({parsed} files re-parsed)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,66 @@
+import time
+
+_START = time.perf_counter()  # 用于统计启动到显示第一张图的耗时
+
+import argparse
 import pygame
 import sys
 import os
-import numpy as np
-import cv2
-import tkinter as tk
-from tkinter import filedialog, simpledialog, colorchooser
-import copy
 import json
 import hashlib
+import threading
+
+import numpy as np
+
+# tkinter、模型推理（torch）和瓦片金字塔只在用到时才导入，缩短启动时间
+from history import AddAnnotations, AddPoint, ChangeId, DeleteAnnotation, History, MoveVertex
+from dataset import DatasetIndex, label_path_for
+from label_io import format_labels, load_class_names, read_labels
+from prefetch import ImagePrefetcher, LRUCache, fit_scale
+from profiler import Profiler
+from spatial import SpatialIndex
+from store import AnnotationStore
+from video import is_video
+from writer import LabelWriter
+
+# 后台推理完成时投递的事件，用于唤醒空闲中的主循环
+ASSIST_READY = pygame.event.custom_type()
+# 后台角点检测完成时投递，event.path 为对应图像
+CORNERS_READY = pygame.event.custom_type()
+# 后台目录扫描结束时投递，用于更新图像序号和统计
+DATASET_SCANNED = pygame.event.custom_type()
+# 连接任务服务器时，后台租到下一批图像后投递，event.paths 为新图像
+TASKS_LEASED = pygame.event.custom_type()
+# 视频帧索引在后台建好时投递，此后帧数准确、跳转更快
+VIDEO_INDEXED = pygame.event.custom_type()
+# 上一张图的标注跟踪到当前图后投递，event.path 为对应图像
+PROPAGATE_READY = pygame.event.custom_type()
+# 后台生成了新的缩略图时投递（未处理前不重复投递），用于重绘网格
+THUMBS_READY = pygame.event.custom_type()
+# 瓦片金字塔的某一层在后台解码完成时投递，event.path 为对应图像
+PYRAMID_READY = pygame.event.custom_type()
+# 已有标注文件在写入线程上读完时投递，event.path 为对应图像
+LABELS_LOADED = pygame.event.custom_type()
+
+class ImageState:
+    """一张图的标注状态：标注、撤销历史，以及最近一次写盘时的结构版本号
+    （只看已完成的四边形，未凑满四个点的点击不算修改）"""
+
+    def __init__(self, path, image_size, store, history):
+        self.path = path
+        self.image_size = image_size
+        self.store = store
+        self.history = history
+        self.saved_version = store.structure_version
+        self.loading = False  # 已有标注文件尚未读完，期间不接受编辑
+
+    @property
+    def dirty(self):
+        return self.store.structure_version != self.saved_version
+
+    def mark_saved(self):
+        self.saved_version = self.store.structure_version
 
-# Initialize Pygame
-pygame.init()
 
 class Button:
     def __init__(self, rect, text, color, hover_color):
@@ -34,6 +84,10 @@ class Button:
 
 class AnnotationApp:
     def __init__(self):
+        # 只初始化用到的子系统（不含音频、手柄），事件队列随 display 一起初始化
+        pygame.display.init()
+        pygame.font.init()
+
         # Window settings
         self.screen_width = 1600
         self.screen_height = 900
@@ -43,30 +97,70 @@ class AnnotationApp:
         self.screen = None
         self.clock = pygame.time.Clock()
         self.running = True
+
+        # 渲染相关：底图与标注分层缓存，只刷新变化区域
+        self.event_driven = True  # False 时退回每帧全量重绘
+        self.idle_timeout = 500  # 空闲时 event.wait 的超时(ms)
+        self.image_panel_rect = pygame.Rect(0, 0, self.image_panel_width, self.screen_height)
+        self.background = None
+        self.overlay = None
+        self.overlay_valid = False
+        self.dirty_rects = []
+        self.panel_state = None
+        self.menu_rect = None
+        self.drawn_selection = -1
         
         # Image related
         self.image = None
         self.image_scale = 1.0
         self.image_offset = (0, 0)
-        self.original_image = None
+        self.image_size = (0, 0)  # 原图 (w, h)
+        self.fit_scale = 1.0
+        self.max_zoom_scale = 8.0  # 最大放大到原图的 8 倍
+        self.pyramid = None  # 放大时才按需构建的瓦片金字塔
+        self.pan_anchor = None
         self.current_file = ""
         self.image_files = []
         self.current_index = 0
         
         # Annotation related
-        self.annotations = []
-        self.history = []
-        self.selected_annotation = -1  # 当前选中的标注索引
         self.max_points = 4
+        self.annotations = AnnotationStore(max_points=self.max_points)
+        self.history = History(max_entries=1000)  # 每张图单独一份，随 ImageState 缓存
+        # 最近访问过的图像的标注状态，回看时不必再读盘；离开一张图时有修改就后台写回
+        self.states = LRUCache(max_items=300)
+        self.state = None
+        self.track_source = None  # 标注就绪后从这张图跟踪候选框
+        self.selected_annotation = -1  # 当前选中的标注索引
+        self.index = SpatialIndex()  # 命中测试/最近角点查询用的网格索引
+        self.index_version = -1
+        self.drag = None  # 正在拖动的角点
+        self.vertex_pick_radius = 8  # 屏幕像素
+        self.snap = None  # 角点吸附（S 键开关），开启后后台计算角点候选
+        self.snap_radius = 12  # 屏幕像素
+        self.propagate = None  # 标注传播（P 键开关），切到下一张图时跟踪上一张图的四边形
+        self.grid = None  # 缩略图网格（Tab 键开关），打开时覆盖图像区域
+        self.thumbs = None  # 缩略图缓存，首次打开网格时创建，关闭网格后保留
+        self.thumbs_posted = False
+        self.label_counts = LRUCache(max_items=4096)  # 标注路径 -> (mtime, 四边形数)
         self.class_id = 0
+        self.class_names = []  # 通过 --classes 指定时限制 ID 范围并显示类别名
         self.id_colors = {}
         self.load_id_colors()
         
         # UI elements
         self.font = pygame.font.Font(None, 36)
         self.title_font = pygame.font.Font(None, 24)
+        self.glyphs = {}  # (文字, 颜色) -> 已渲染的 surface
         self.control_bg = (60, 60, 60)
         self.save_directory = None
+        self.image_dir = None
+        self.dataset = None
+        self.tasks = None  # --server 模式下的任务服务器客户端，取代本地索引和写入线程
+        self.lease_batch = 8
+        self.leasing = False
+        self.video = None  # 直接标注视频时的帧源
+        self.video_stride = 1
         
         # Control panel
         control_x = self.image_panel_width + 20
@@ -106,11 +200,35 @@ class AnnotationApp:
         
         # 右键菜单
         self.context_menu = None
+
+        # 窗口内的文本输入框，替代 Tk 对话框
+        self.prompt = None
+        self.prompt_rect = pygame.Rect(0, 0, 460, 110)
+        self.prompt_rect.center = self.image_panel_rect.center
+        self.drawn_prompt = None
+        self.startup_time = None
         
         # Status
         self.status_msg = ""
         self.point_radius = 3
 
+        # 后台预取前后若干张图像
+        self.prefetcher = ImagePrefetcher(
+            (self.image_panel_width, self.screen_height), radius=3)
+        # 标注文件在后台线程写入，保存不阻塞界面
+        self.writer = LabelWriter()
+        # 性能面板（F3）与 trace 导出（F4），关闭时几乎没有开销
+        self.profiler = Profiler()
+        self.hud_rect = None
+
+        # 模型辅助预标注（M 键开关）
+        self.assist = None
+        self.assist_weights = os.path.join(os.path.dirname(os.path.abspath(__file__)), "best.pt")
+        self.assist_repo = None  # ArmorDet 仓库路径，best.pt 反序列化需要其 models 包
+        self.proposals = None  # 当前图像的模型候选
+        self.proposals_file = None  # 已取过候选的图像，接受/丢弃后不再重复显示
+        self.assist_msg = ""
+
     def get_color_for_id(self, class_id):
         """智能生成颜色"""
         if class_id in self.id_colors:
@@ -139,36 +257,237 @@ class AnnotationApp:
             json.dump(self.id_colors, f)
 
     def load_images_from_folder(self, folder_path):
-        self.image_files = [os.path.join(folder_path, f) for f in os.listdir(folder_path) 
-                          if f.lower().endswith(('png', 'jpg', 'jpeg', 'bmp'))]
+        # 递归扫描在后台进行，扫到第一张图即可开始标注
+        self.image_dir = folder_path
+        self.dataset = DatasetIndex(folder_path, self.save_directory)
+        self.dataset.start_scan(
+            on_complete=lambda: pygame.event.post(pygame.event.Event(DATASET_SCANNED)))
+        self.dataset.wait_for_first()
+        self.image_files = self.dataset.files  # 与索引共享同一列表，扫描中持续增长
         if not self.image_files:
             print(f"No images found in {folder_path}")
             self.running = False
 
+    def load_video(self, video_path):
+        # 视频直接作为帧源按需解码，按步长采样，标注以帧号命名
+        from video import VideoSource
+
+        self.image_dir = os.path.abspath(video_path)
+        try:
+            self.video = VideoSource(
+                video_path, self.video_stride,
+                on_indexed=lambda: pygame.event.post(pygame.event.Event(VIDEO_INDEXED)))
+        except IOError as e:
+            print(e)
+            self.running = False
+            return
+        self.prefetcher.read = self.video.read
+        self.image_files = self.video.frames
+        # 模型辅助和角点吸附按文件读图，暂不支持视频帧
+        if self.assist:
+            self.toggle_assist()
+        if self.snap:
+            self.toggle_snap()
+        if not self.image_files:
+            print(f"No frames found in {video_path}")
+            self.running = False
+
+    def video_indexed(self):
+        self.status_msg = (f"Image {self.current_index+1}/{len(self.image_files)}  "
+                           f"({self.video.status_text()})")
+        self.prefetcher.schedule(self.current_index)
+
+    def load_images_from_server(self, url):
+        # 图像按批从任务服务器租借，快用完时后台再租一批追加到列表末尾
+        from tasks import TaskClient
+
+        self.tasks = TaskClient(url)
+        try:
+            self.image_files = self.tasks.lease(self.lease_batch)
+        except OSError as e:
+            print(f"Failed to reach task server {url}: {e}")
+            self.image_files = []
+            self.running = False
+            return
+        if not self.image_files:
+            print("No images left to label on the server")
+            self.running = False
+
+    def lease_more(self):
+        if self.leasing:
+            return
+        self.leasing = True
+
+        def run():
+            try:
+                paths = self.tasks.lease(self.lease_batch)
+            except Exception as e:
+                self.tasks.failed += 1
+                self.tasks.errors.append(f"lease: {e}")
+                paths = []
+            pygame.event.post(pygame.event.Event(TASKS_LEASED, paths=paths))
+
+        threading.Thread(target=run, name="task-lease", daemon=True).start()
+
+    def tasks_leased(self, paths):
+        self.leasing = False
+        self.image_files.extend(paths)  # 与预取器共享同一列表
+        self.prefetcher.schedule(self.current_index)
+        if not paths and self.current_index >= len(self.image_files) - 1:
+            self.status_msg = "No more images on the server"
+
     def load_image(self, file_path):
-        if not os.path.exists(file_path):
+        with self.profiler.span('load_image'):
+            return self._load_image(file_path)
+
+    def _load_image(self, file_path):
+        """读取并显示图像，失败时返回 False 且不改变当前图像"""
+        if not self.video and not os.path.exists(file_path):
             print(f"Error: Image {file_path} not found!")
-            return self.skip_to_next_image()
+            return False
 
-        self.current_file = file_path
-        self.original_image = cv2.imread(file_path)
+        # 预取命中时直接取用已缩放好的 surface
+        decoded = self.prefetcher.get(file_path)
         
-        if self.original_image is None:
+        if decoded is None:
             print(f"Error: Failed to read {file_path}")
-            return self.skip_to_next_image()
+            return False
 
-        self.original_image = cv2.cvtColor(self.original_image, cv2.COLOR_BGR2RGB)
-        self.image = pygame.surfarray.make_surface(
-            np.transpose(self.original_image, (1, 0, 2))
-        )
+        self.current_file = file_path
+        self.image = decoded.surface
+        self.image_size = decoded.image_size
+        if self.pyramid is not None:
+            self.pyramid.close()
+            self.pyramid = None
+        self.prefetcher.schedule(self.current_index)
+        self.proposals = None
+        self.proposals_file = None
+        if self.assist:
+            self.assist.schedule(self.image_files, self.current_index)
+            self.refresh_proposals()
+        if self.snap:
+            self.snap.schedule(self.image_files, self.current_index)
+        if self.propagate:
+            self.propagate.schedule(self.image_files, self.current_index)
+        if self.tasks and len(self.image_files) - self.current_index <= 2:
+            self.lease_more()
         self.status_msg = f"Image {self.current_index+1}/{len(self.image_files)}"
         self.fit_image_to_screen()
+        return True
+
+    def go_to(self, index, step=1):
+        """切换到第 index 张图，读图失败时沿 step 方向继续；先把当前图的修改写回"""
+        self.write_back()
+        previous = self.current_index
+        source = self.state if self.propagate and step > 0 else None
+        while 0 <= index < len(self.image_files):
+            self.current_index = index
+            if self.load_image(self.image_files[index]):
+                self.track_source = source
+                self.attach_state(self.image_files[index])
+                return True
+            index += step
+        self.current_index = previous
+        self.status_msg = "Last image reached" if step > 0 else "First image reached"
+        if self.tasks and step > 0 and self.leasing:
+            self.status_msg = "Waiting for more images from the server"
+        return False
+
+    def attach_state(self, path):
+        """取出（或首次访问时新建）该图的标注状态；已有标注文件只在首次访问时
+        交给写入线程读取（排在该文件尚未落盘的写入之后），读完经 LABELS_LOADED 填入"""
+        state = self.states.get(path)
+        if state is None:
+            store = AnnotationStore(max_points=self.max_points)
+            state = ImageState(path, self.image_size, store, History(max_entries=1000))
+            self.states.put(path, state)
+            label_path = self.label_path(path)
+            if label_path:
+                state.loading = True
+                self.writer.load(label_path, read_labels, lambda labels, error: pygame.event.post(
+                    pygame.event.Event(LABELS_LOADED, path=path, labels=labels, error=error)))
+        self.state = state
+        self.annotations = state.store
+        self.history = state.history
+        self.selected_annotation = -1
+        self.index_version = -1  # 换了一个 store，版本号不再可比
+        self.annotations_changed()
+        if not state.loading:
+            self.state_ready()
+
+    def labels_loaded(self, path, labels, error):
+        state = self.states.peek(path)
+        if state is None or not state.loading:
+            return
+        state.loading = False
+        if error is not None:
+            self.status_msg = f"Failed to read labels for {os.path.basename(path)}: {error}"
+        elif labels is not None:
+            ids, quads = labels
+            quads = quads * np.array(state.image_size, np.float32)
+            for quad, class_id in zip(quads, ids.tolist()):
+                state.store.insert(len(state.store), quad, class_id)
+            state.mark_saved()
+        if state is self.state:
+            self.annotations_changed()
+            self.state_ready()
+
+    def state_ready(self):
+        """当前图的标注就绪后调用：向前切到一张还没有标注的图时，把上一张图的四边形跟踪过来作为候选"""
+        source, self.track_source = self.track_source, None
+        if source is not None and len(source.store) and not len(self.annotations):
+            self.propagate.track(source.path, source.store.quads, source.store.ids,
+                                 self.current_file)
+
+    def labels_loading(self):
+        if self.state is None or not self.state.loading:
+            return False
+        self.status_msg = "Loading labels..."
+        return True
+
+    @property
+    def sink(self):
+        """标注的去向（任务服务器或本地写入线程），供状态栏显示进度和错误"""
+        return self.tasks or self.writer
+
+    def label_path(self, image_path):
+        if not self.save_directory:
+            return None
+        return label_path_for(image_path, self.image_dir, self.save_directory)
+
+    def submit_labels(self, path, store, image_size, only_existing=False):
+        """only_existing 为真时只在标注文件已存在时写入（由写入线程判断），用于清空"""
+        if self.tasks:
+            self.tasks.submit(path, format_labels(store.ids, store.quads, image_size))
+            return None
+        label_path = self.label_path(path)
+        self.writer.submit(label_path, format_labels(store.ids, store.quads, image_size),
+                           only_existing)
+        # 没有完成的四边形时不算已标注，恢复进度时仍会回到这张图；
+        # 只清空已有文件时，原本就没有标注的图保持原状态（如 skipped）
+        if self.dataset and (len(store) or not only_existing
+                             or self.dataset.status(path) == 'labeled'):
+            self.dataset.set_status(path, 'labeled' if len(store) else 'unlabeled')
+        return label_path
+
+    def write_back(self):
+        """当前图有未写盘的修改时交给后台写入线程"""
+        state = self.state
+        if state is None or not state.dirty or not (self.save_directory or self.tasks):
+            return
+        # 标注全被撤销或删光时，只有原来就有标注文件才需要写回（清空）
+        if not len(state.store) and self.tasks:
+            state.mark_saved()
+            return
+        self.submit_labels(state.path, state.store, state.image_size,
+                           only_existing=not len(state.store))
+        state.mark_saved()
 
     def fit_image_to_screen(self):        
-        img_h, img_w = self.original_image.shape[:2]
-        scale_w = (self.image_panel_width - 40) / img_w
-        scale_h = (self.screen_height - 40) / img_h
-        self.image_scale = min(scale_w, scale_h)
+        img_w, img_h = self.image_size
+        self.fit_scale = fit_scale(self.image_size,
+                                   (self.image_panel_width, self.screen_height))
+        self.image_scale = self.fit_scale
         
         scaled_w = int(img_w * self.image_scale)
         scaled_h = int(img_h * self.image_scale)
@@ -177,51 +496,317 @@ class AnnotationApp:
             (self.screen_height - scaled_h) // 2
         )
         
-        scaled_image = pygame.transform.scale(self.image, (scaled_w, scaled_h))
-        self.image = scaled_image
+        # 预取得到的 surface 已是显示尺寸，无需再次缩放
+        if self.image.get_size() != (scaled_w, scaled_h):
+            self.image = pygame.transform.scale(self.image, (scaled_w, scaled_h))
+        self.invalidate_background()
 
-    def update_display(self):
-        self.screen.fill((40, 40, 40))
+    def is_zoomed(self):
+        return self.image_scale != self.fit_scale
+
+    def zoom_at(self, screen_pos, factor):
+        """以鼠标位置为中心缩放，保持光标下的图像点不动"""
+        if not self.image:
+            return
+        # 小图的适配比例本身可能已超过最大放大倍数，此时上限取适配比例，不会缩到适配以下
+        max_scale = max(self.fit_scale, self.max_zoom_scale)
+        new_scale = min(max(self.image_scale * factor, self.fit_scale), max_scale)
+        if new_scale == self.image_scale:
+            return
+        if new_scale == self.fit_scale:
+            return self.fit_image_to_screen()
+
+        img_x = (screen_pos[0] - self.image_offset[0]) / self.image_scale
+        img_y = (screen_pos[1] - self.image_offset[1]) / self.image_scale
+        self.image_scale = new_scale
+        self.image_offset = (screen_pos[0] - img_x * new_scale,
+                             screen_pos[1] - img_y * new_scale)
+        self.invalidate_background()
+        self.status_msg = f"Zoom {self.image_scale / self.fit_scale:.1f}x"
+
+    def pan_by(self, dx, dy):
+        if not self.is_zoomed():
+            return
+        self.image_offset = (self.image_offset[0] + dx, self.image_offset[1] + dy)
+        self.invalidate_background()
+
+    def mark_dirty(self, rect):
+        self.dirty_rects.append(pygame.Rect(rect))
+
+    def invalidate_background(self):
+        """底图（图像区域）需要重建"""
+        self.background = None
+        self.invalidate_overlay()
+
+    def invalidate_overlay(self):
+        """标注层需要整体重绘（删除、撤销、换图等）"""
+        self.overlay_valid = False
+        self.mark_dirty(self.image_panel_rect)
+
+    def annotations_changed(self):
+        """标注结构变化后重绘标注层并重建索引"""
+        self.drag = None
+        self.invalidate_overlay()
+
+    def ensure_index(self):
+        # 只在已完成的四边形变化时重建，未完成的点击不影响索引
+        if self.index_version != self.annotations.structure_version:
+            self.index.build(self.annotations.quads)
+            self.index_version = self.annotations.structure_version
+        return self.index
+
+    def quad_to_screen(self, index):
+        quad = self.annotations.quads[index] * self.image_scale + self.image_offset
+        return quad.astype(int)
+
+    def annotation_rect(self, index):
+        """标注在屏幕上的大致范围（含线宽和ID文字）"""
+        quad = self.quad_to_screen(index)
+        (x0, y0), (x1, y1) = quad.min(axis=0), quad.max(axis=0)
+        return pygame.Rect(x0, y0, x1 - x0, y1 - y0).inflate(40, 40)
+
+    def render_glyph(self, text, color):
+        """渲染结果按 (文字, 颜色) 缓存，ID 很少变化，不必每次重新渲染"""
+        key = (text, color)
+        surf = self.glyphs.get(key)
+        if surf is None:
+            surf = self.title_font.render(text, True, color)
+            self.glyphs[key] = surf
+        return surf
+
+    def invalidate_all(self):
+        self.invalidate_background()
+        self.panel_state = None
+
+    def render_background(self):
+        self.background = pygame.Surface(self.image_panel_rect.size)
+        self.background.fill((40, 40, 40))
+        if not self.image:
+            return
+        if not self.is_zoomed():
+            self.background.blit(self.image, self.image_offset)
+            return
+        # 放大后只从金字塔中取可见瓦片，各层在预取线程池中解码，不阻塞界面
+        if self.pyramid is None:
+            from tiles import TilePyramid
+            path = self.current_file
+            self.pyramid = TilePyramid(
+                path, self.image_size, read=self.prefetcher.read,
+                submit=self.prefetcher.submit,
+                on_ready=lambda: pygame.event.post(pygame.event.Event(PYRAMID_READY, path=path)))
+        if not self.pyramid.render_view(self.background, self.image_scale,
+                                        self.image_offset, self.image_panel_rect):
+            self.render_preview()
+
+    def render_preview(self):
+        """金字塔还没有可用的层时，先把显示尺寸的图放大顶上"""
+        factor = self.image_scale / self.fit_scale
+        ox, oy = self.image_offset
+        panel = self.image_panel_rect
+        view = pygame.Rect(int((panel.left - ox) / factor), int((panel.top - oy) / factor),
+                           int(panel.width / factor) + 2, int(panel.height / factor) + 2)
+        view = view.clip(self.image.get_rect())
+        if not view:
+            return
+        part = self.image.subsurface(view)
+        size = (round(view.width * factor), round(view.height * factor))
+        self.background.blit(pygame.transform.scale(part, size),
+                             (round(view.x * factor + ox), round(view.y * factor + oy)))
+
+    def render_overlay(self):
+        if self.overlay is None:
+            self.overlay = pygame.Surface(self.image_panel_rect.size, pygame.SRCALPHA)
+        self.overlay.fill((0, 0, 0, 0))
+        # 所有四边形一次性变换到屏幕坐标，中心点同样批量计算
+        quads = self.annotations.to_screen(self.image_scale, self.image_offset)
+        ids = self.annotations.ids
+        dragged = self.drag['index'] if self.drag else -1
+        if dragged != -1:  # 拖动中的标注在合成时单独绘制
+            keep = np.arange(len(ids)) != dragged
+            quads, ids = quads[keep], ids[keep]
+        self.draw_quads(self.overlay, quads, ids)
+        self.draw_pending(self.overlay)
+        self.draw_proposals(self.overlay)
+        self.overlay_valid = True
+
+    def draw_quads(self, surface, quads, ids):
+        """按 线框、ID、角点 的顺序分层批量绘制，quads 为屏幕坐标 (N,4,2)"""
+        label_pos = (quads.sum(axis=1) // 4 - 10).tolist()
+        ids = ids.tolist()
+        points = quads.reshape(-1, 2).tolist()
+        for k, class_id in enumerate(ids):
+            pygame.draw.lines(surface, self.get_color_for_id(class_id), True,
+                              points[4*k:4*k+4], 3)
+        yellow = (255, 255, 0)
+        surface.blits([(self.render_glyph(str(class_id), yellow), pos)
+                       for class_id, pos in zip(ids, label_pos)], doreturn=False)
+        for point in points:
+            pygame.draw.circle(surface, (250, 50, 50), point, self.point_radius)
+
+    def draw_annotation(self, surface, index, highlight=False):
+        """绘制单个标注，返回受影响的屏幕区域"""
+        return self.draw_quad(surface, self.quad_to_screen(index).tolist(),
+                              int(self.annotations.ids[index]), highlight)
+
+    def draw_quad(self, surface, quad, class_id, highlight=False):
+        color = self.get_color_for_id(class_id)
+        if highlight:
+            color = tuple(min(c+50, 255) for c in color)
         
-        # Draw image area
-        if self.image:
-            self.screen.blit(self.image, self.image_offset)
-            
-            # Draw annotations
-            for idx, ann in enumerate(self.annotations):
-                points = self.scale_points(ann['points'], to_screen=True)
-                color = self.get_color_for_id(ann['id'])
-                if idx == self.selected_annotation:
-                    color = tuple(min(c+50, 255) for c in color)
-                
-                if len(points) >= 8:
-                    # Draw quadrilateral
-                    pygame.draw.lines(self.screen, color, True, [
-                        (points[0], points[1]),
-                        (points[2], points[3]),
-                        (points[4], points[5]),
-                        (points[6], points[7])
-                    ], 3)
-                    
-                    # Draw class ID
-                    center_x = sum(points[::2]) // 4
-                    center_y = sum(points[1::2]) // 4
-                    id_surf = self.title_font.render(str(ann['id']), True, (255, 255, 0))
-                    self.screen.blit(id_surf, (center_x - 10, center_y - 10))
-                
-                # Draw points
-                for i in range(0, len(points), 2):
-                    pygame.draw.circle(self.screen, (250, 50, 50), 
-                                     (points[i], points[i+1]), self.point_radius)
+        # Draw quadrilateral
+        rect = pygame.draw.lines(surface, color, True, quad, 3)
+        
+        # Draw class ID
+        center_x = sum(p[0] for p in quad) // 4
+        center_y = sum(p[1] for p in quad) // 4
+        id_surf = self.render_glyph(str(class_id), (255, 255, 0))
+        rect = rect.union(surface.blit(id_surf, (center_x - 10, center_y - 10)))
+        
+        # Draw points
+        for point in quad:
+            rect = rect.union(pygame.draw.circle(surface, (250, 50, 50),
+                                                 point, self.point_radius))
+        return rect
+
+    def draw_proposals(self, surface, origin=(0, 0)):
+        """候选用细线绘制，跟踪置信度低的用橙色标出；按 A 接受、X 丢弃。
+        origin 为 surface 左上角的屏幕坐标"""
+        if self.proposals is None:
+            return
+        quads = (self.proposals['quads'] * self.image_scale + self.image_offset).astype(int)
+        quads -= np.asarray(origin, int)
+        low = self.proposals.get('low')
+        for i, quad in enumerate(quads.tolist()):
+            color = (255, 140, 0) if low is not None and low[i] else (230, 230, 230)
+            pygame.draw.lines(surface, color, True, quad, 1)
+
+    def draw_pending(self, surface, origin=(0, 0)):
+        """绘制尚未凑满四个点的标注，origin 为 surface 左上角的屏幕坐标"""
+        rect = None
+        points = self.annotations.pending_to_screen(self.image_scale, self.image_offset)
+        points -= np.asarray(origin, np.int32)
+        for point in points.tolist():
+            dot = pygame.draw.circle(surface, (250, 50, 50), point, self.point_radius)
+            rect = dot if rect is None else rect.union(dot)
+        return rect
+
+    def update_display(self):
+        if not self.event_driven:
+            self.invalidate_all()
+
+        if self.background is None:
+            self.render_background()
+        if not self.overlay_valid:
+            self.render_overlay()
+
+        # 右键菜单出现/消失/移动时，新旧两处都需要刷新
+        menu_rect = None
+        if self.context_menu:
+            menu_rect = pygame.Rect(self.context_menu['pos'], (200, 100))
+        if self.selected_annotation != self.drawn_selection:
+            self.drawn_selection = self.selected_annotation
+            self.mark_dirty(self.image_panel_rect)
+        if menu_rect != self.menu_rect:
+            for rect in (self.menu_rect, menu_rect):
+                if rect is not None:
+                    self.mark_dirty(rect)
+            self.menu_rect = menu_rect
+
+        panel_rect = pygame.Rect(self.image_panel_width, 0,
+                                 self.control_panel_width, self.screen_height)
+        panel_state = (self.status_msg, self.input_text, self.input_active, self.class_id,
+                       self.prefetcher.stats_text(), self.sink.status_text(), self.assist_msg)
+        if panel_state != self.panel_state or panel_rect.collidelist(self.dirty_rects) != -1:
+            self.panel_state = panel_state
+            self.mark_dirty(panel_rect)
+
+        hud = None
+        if self.profiler.hud:
+            hud = self.render_hud()
+            hud_rect = hud.get_rect(topleft=(10, 10))
+            self.mark_dirty(hud_rect.union(self.hud_rect) if self.hud_rect else hud_rect)
+            self.hud_rect = hud_rect
+        elif self.hud_rect is not None:
+            self.mark_dirty(self.hud_rect)  # 关闭后擦除
+            self.hud_rect = None
+
+        if self.grid is not None and self.grid.dirty:
+            self.mark_dirty(self.image_panel_rect)
+
+        prompt_state = (self.prompt['label'], self.prompt['text']) if self.prompt else None
+        if prompt_state != self.drawn_prompt:
+            self.drawn_prompt = prompt_state
+            self.mark_dirty(self.prompt_rect)
+
+        if not self.dirty_rects:
+            return  # 没有变化则不重绘
+
+        rects = [rect.clip(self.screen.get_rect()) for rect in self.dirty_rects]
+        self.dirty_rects = []
+        selected = None
+        if 0 <= self.selected_annotation < len(self.annotations):
+            selected = self.selected_annotation
+        dragged = self.drag['index'] if self.drag else None
+
+        if self.grid is not None and self.image_panel_rect.collidelist(rects) != -1:
+            # 网格只绘制可见格子，开销与图像数量无关，直接整体重绘
+            self.screen.set_clip(self.image_panel_rect)
+            self.grid.current = self.current_index
+            self.grid.draw(self.screen)
+            if hud is not None:
+                self.screen.blit(hud, self.hud_rect)
+            self.screen.set_clip(None)
+
+        for rect in rects:
+            area = rect.clip(self.image_panel_rect)
+            if not area or self.grid is not None:
+                continue
+            self.screen.blit(self.background, area, area)
+            self.screen.blit(self.overlay, area, area)
+            if selected is not None or dragged is not None:
+                self.screen.set_clip(area)
+                if dragged is not None:
+                    self.draw_annotation(self.screen, dragged, highlight=True)
+                if selected is not None:
+                    self.draw_annotation(self.screen, selected, highlight=True)
+                self.screen.set_clip(None)
+            if hud is not None and area.colliderect(self.hud_rect):
+                self.screen.set_clip(area)
+                self.screen.blit(hud, self.hud_rect)
+                self.screen.set_clip(None)
 
         # Draw control panel
-        self.draw_control_panel()
+        if panel_rect.collidelist(rects) != -1:
+            self.draw_control_panel()
         
         # Draw context menu
         if self.context_menu:
             self.draw_context_menu()
+
+        if self.prompt and self.prompt_rect.collidelist(rects) != -1:
+            self.draw_prompt()
             
-        pygame.display.flip()
+        pygame.display.update(rects)
+
+    def render_hud(self):
+        lines = self.profiler.hud_lines() or ["collecting..."]
+        surfs = [self.title_font.render(line, True, (230, 230, 230)) for line in lines]
+        width = max(s.get_width() for s in surfs) + 16
+        hud = pygame.Surface((width, 22 * len(surfs) + 10), pygame.SRCALPHA)
+        hud.fill((0, 0, 0, 170))
+        for i, surf in enumerate(surfs):
+            hud.blit(surf, (8, 5 + 22 * i))
+        return hud
+
+    def toggle_trace(self):
+        if self.profiler.tracing:
+            path = self.profiler.stop_trace()
+            self.status_msg = f"Trace saved: {os.path.basename(path)}"
+        else:
+            path = os.path.join(".annotation_cache", "traces",
+                                time.strftime("trace-%Y%m%d-%H%M%S.json"))
+            self.profiler.start_trace(path)
+            self.status_msg = "Trace recording (F4 to stop)"
 
     def scale_points(self, points, to_screen=True):
         scaled = []
@@ -246,7 +831,8 @@ class AnnotationApp:
             btn.draw(self.screen)
             
         # 当前ID显示
-        current_id_surf = self.font.render(f"Current ID: {self.class_id}", True, (255,255,255))
+        current_id_surf = self.font.render(f"Current ID: {self.class_label(self.class_id)}",
+                                           True, (255,255,255))
         self.screen.blit(current_id_surf, (self.image_panel_width + 20, 470))
         
         # 输入框
@@ -258,6 +844,14 @@ class AnnotationApp:
         # 状态信息
         status_surf = self.title_font.render(self.status_msg, True, (200,200,200))
         self.screen.blit(status_surf, (self.image_panel_width + 20, self.screen_height - 50))
+        if self.assist_msg:
+            assist_surf = self.title_font.render(self.assist_msg, True, (150,150,150))
+            self.screen.blit(assist_surf, (self.image_panel_width + 20, self.screen_height - 100))
+        writer_color = (231, 76, 60) if self.sink.errors else (150,150,150)
+        writer_surf = self.title_font.render(self.sink.status_text(), True, writer_color)
+        self.screen.blit(writer_surf, (self.image_panel_width + 20, self.screen_height - 75))
+        cache_surf = self.title_font.render(self.prefetcher.stats_text(), True, (150,150,150))
+        self.screen.blit(cache_surf, (self.image_panel_width + 20, self.screen_height - 25))
 
     def draw_context_menu(self):
         menu_x, menu_y = self.context_menu['pos']
@@ -276,8 +870,41 @@ class AnnotationApp:
         text_surf = self.title_font.render("Delete", True, (255,255,255))
         self.screen.blit(text_surf, (menu_x+20, menu_y+60))
 
-    def handle_events(self):
-        for event in pygame.event.get():
+    def draw_prompt(self):
+        rect = self.prompt_rect
+        pygame.draw.rect(self.screen, (45, 45, 45), rect, border_radius=6)
+        pygame.draw.rect(self.screen, (52, 152, 219), rect, 2, border_radius=6)
+        label = self.title_font.render(self.prompt['label'], True, (220, 220, 220))
+        self.screen.blit(label, (rect.x + 15, rect.y + 12))
+        box = pygame.Rect(rect.x + 15, rect.y + 40, rect.width - 30, 36)
+        pygame.draw.rect(self.screen, (30, 30, 30), box, border_radius=3)
+        text = self.font.render(self.prompt['text'] + "|", True, (255, 255, 255))
+        self.screen.blit(text, (box.x + 8, box.y + 4))
+        hint = self.title_font.render("Enter: OK   Esc: cancel", True, (140, 140, 140))
+        self.screen.blit(hint, (rect.x + 15, rect.bottom - 26))
+
+    def open_prompt(self, label, on_submit, text="", allowed=str.isdigit):
+        """在窗口内弹出输入框，回车时以输入内容调用 on_submit，Esc 取消"""
+        self.prompt = {'label': label, 'text': text, 'on_submit': on_submit,
+                       'allowed': allowed}
+        self.input_active = False
+
+    def handle_prompt_key(self, event):
+        prompt = self.prompt
+        if event.key in (pygame.K_RETURN, pygame.K_KP_ENTER):
+            self.prompt = None
+            prompt['on_submit'](prompt['text'])
+        elif event.key == pygame.K_ESCAPE:
+            self.prompt = None
+        elif event.key == pygame.K_BACKSPACE:
+            prompt['text'] = prompt['text'][:-1]
+        elif event.unicode and prompt['allowed'](event.unicode) and len(prompt['text']) < 32:
+            prompt['text'] += event.unicode
+
+    def handle_events(self, events=None):
+        if events is None:
+            events = pygame.event.get()
+        for event in events:
             if event.type == pygame.QUIT:
                 self.running = False
                 
@@ -286,6 +913,14 @@ class AnnotationApp:
                 
             elif event.type == pygame.MOUSEMOTION:
                 self.handle_mouse_move(event)
+
+            elif event.type == pygame.MOUSEWHEEL:
+                mouse_pos = pygame.mouse.get_pos()
+                if self.grid is not None:
+                    # 按像素平滑滚动，触控板的小幅滚动也能体现
+                    self.grid.scroll_by(-event.precise_y * self.grid.cell_h / 2)
+                elif self.image_panel_rect.collidepoint(mouse_pos):
+                    self.zoom_at(mouse_pos, 1.25 ** event.y)
                 
             elif event.type == pygame.MOUSEBUTTONUP:
                 self.handle_mouse_up(event)
@@ -293,8 +928,44 @@ class AnnotationApp:
             elif event.type == pygame.KEYDOWN:
                 self.handle_key_down(event)
 
+            elif event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+                self.invalidate_all()
+
+            elif event.type == ASSIST_READY:
+                self.refresh_proposals()
+
+            elif event.type == CORNERS_READY:
+                self.refresh_corners(event.path)
+
+            elif event.type == DATASET_SCANNED:
+                self.dataset_scanned()
+
+            elif event.type == PROPAGATE_READY:
+                self.refresh_propagation(event.path)
+
+            elif event.type == VIDEO_INDEXED:
+                self.video_indexed()
+
+            elif event.type == TASKS_LEASED:
+                self.tasks_leased(event.paths)
+
+            elif event.type == PYRAMID_READY:
+                if self.pyramid is not None and event.path == self.pyramid.path:
+                    self.background = None  # 换用更精细的层重绘底图，标注层不变
+                    self.mark_dirty(self.image_panel_rect)
+
+            elif event.type == LABELS_LOADED:
+                self.labels_loaded(event.path, event.labels, event.error)
+
+            elif event.type == THUMBS_READY:
+                self.thumbs_posted = False
+                if self.grid is not None:
+                    self.grid.dirty = True
+
     def handle_mouse_down(self, event):
         mouse_pos = event.pos
+        if event.button in (4, 5):  # 滚轮由 MOUSEWHEEL 处理
+            return
         
         # 关闭右键菜单
         if self.context_menu and event.button != self.context_menu['button']:
@@ -307,7 +978,7 @@ class AnnotationApp:
                     if btn.text.startswith("Save"):
                         self.save_annotations()
                     elif btn.text.startswith("Skip"):
-                        self.skip_to_next_image()
+                        self.skip_image()
                     elif btn.text.startswith("Undo"):
                         self.undo()
                     elif btn.text.startswith("Delete"):
@@ -325,10 +996,21 @@ class AnnotationApp:
                 self.input_active = False
             return
                 
+        if self.grid is not None:
+            index = self.grid.index_at(mouse_pos)
+            if event.button == 1 and index is not None:
+                self.open_from_grid(index)
+            return
+
         # 图片区域点击
         img_pos = self.screen_to_image_pos(mouse_pos)
-        if event.button == 1:  # 左键
-            self.add_annotation_point(img_pos)
+        if event.button == 2:  # 中键拖动平移
+            self.pan_anchor = mouse_pos
+        elif event.button == 1:  # 左键
+            # 靠近已有角点时拖动修正，按住 Shift 则强制新增点
+            shift = pygame.key.get_mods() & pygame.KMOD_SHIFT
+            if shift or not self.start_drag(img_pos):
+                self.add_annotation_point(img_pos)
             self.context_menu = None
         elif event.button == 3:  # 右键
             self.handle_right_click(mouse_pos)
@@ -336,13 +1018,7 @@ class AnnotationApp:
     def handle_right_click(self, mouse_pos):
         # 检测是否点击在已有标注上
         img_pos = self.screen_to_image_pos(mouse_pos)
-        selected = -1
-        for idx, ann in enumerate(self.annotations):
-            if len(ann['points']) < 8:
-                continue
-            if self.point_in_polygon(img_pos, ann['points']):
-                selected = idx
-                break
+        selected = self.ensure_index().hit_test(img_pos)
                 
         if selected != -1:
             self.selected_annotation = selected
@@ -355,8 +1031,42 @@ class AnnotationApp:
             self.selected_annotation = -1
             self.context_menu = None
 
+    def start_drag(self, img_pos):
+        if not self.image:
+            return False
+        hit = self.ensure_index().nearest_vertex(
+            img_pos, self.vertex_pick_radius / self.image_scale)
+        if hit is None:
+            return False
+        index, vertex = hit
+        self.drag = {
+            'index': index,
+            'vertex': vertex,
+            'old': self.annotations.get_vertex(index, vertex)
+        }
+        self.invalidate_overlay()
+        return True
+
+    def finish_drag(self):
+        drag = self.drag
+        self.drag = None
+        new = self.annotations.get_vertex(drag['index'], drag['vertex'])
+        snapped = self.snap_point(new)
+        if snapped != new:
+            self.annotations.set_vertex(drag['index'], drag['vertex'], snapped)
+            new = self.annotations.get_vertex(drag['index'], drag['vertex'])
+        if new != drag['old']:
+            self.history.execute(MoveVertex(drag['index'], drag['vertex'], drag['old'], new),
+                                 self.annotations)
+            self.status_msg = "Corner moved"
+        self.annotations_changed()
+
     def handle_mouse_up(self, event):
-        if event.button == 3 and self.context_menu:
+        if event.button == 2:
+            self.pan_anchor = None
+        elif event.button == 1 and self.drag:
+            self.finish_drag()
+        elif event.button == 3 and self.context_menu:
             # 处理右键菜单点击
             mouse_pos = event.pos
             menu_x, menu_y = self.context_menu['pos']
@@ -374,30 +1084,94 @@ class AnnotationApp:
         """修改选中标注的ID"""
         if self.selected_annotation == -1:
             return
-            
-        root = tk.Tk()
-        root.withdraw()
-        new_id = simpledialog.askinteger("Change ID", "Enter new ID:", parent=root)
-        if new_id is not None:
-            self.annotations[self.selected_annotation]['id'] = new_id
-            self.status_msg = f"Changed ID to {new_id}"
+        index = self.selected_annotation
+
+        def submit(text):
+            new_id = self.parse_class_id(text)
+            if new_id is None or index >= len(self.annotations):
+                return
+            self.history.execute(ChangeId(index, new_id), self.annotations)
+            self.annotations_changed()
+            self.status_msg = f"Changed ID to {self.class_label(new_id)}"
+
+        self.open_prompt("Change ID of selected annotation:", submit,
+                         str(int(self.annotations.ids[index])))
+
+    def parse_class_id(self, text):
+        """解析并校验类别 ID，失败时更新状态栏并返回 None"""
+        try:
+            class_id = int(text)
+        except ValueError:
+            self.status_msg = "Invalid ID format"
+            return None
+        if self.class_names and not 0 <= class_id < len(self.class_names):
+            self.status_msg = f"ID must be 0-{len(self.class_names) - 1}"
+            return None
+        return class_id
+
+    def class_label(self, class_id):
+        if 0 <= class_id < len(self.class_names):
+            return f"{class_id} ({self.class_names[class_id]})"
+        return str(class_id)
 
     def handle_mouse_move(self, event):
-        pass  # 保持空实现避免报错
+        if self.drag:
+            index = self.drag['index']
+            self.mark_dirty(self.annotation_rect(index))
+            self.annotations.set_vertex(index, self.drag['vertex'],
+                                        self.screen_to_image_pos(event.pos))
+            self.mark_dirty(self.annotation_rect(index))
+        elif self.pan_anchor is not None:
+            self.pan_by(event.pos[0] - self.pan_anchor[0], event.pos[1] - self.pan_anchor[1])
+            self.pan_anchor = event.pos
 
     def handle_key_down(self, event):
+        if self.prompt:
+            self.handle_prompt_key(event)
+            return
+        if self.grid is not None:
+            self.handle_grid_key(event)
+            return
+
         # 快捷键
-        if event.key == pygame.K_RETURN:
+        if event.key == pygame.K_TAB:
+            self.open_grid()
+        elif event.key == pygame.K_RETURN:
             if self.input_active:
                 self.set_current_id()
             else:
                 self.save_annotations()
         elif event.key == pygame.K_RIGHT:
-            self.skip_to_next_image()
+            self.skip_image()
+        elif event.key == pygame.K_LEFT:
+            self.previous_image()
+        elif event.key == pygame.K_g:
+            self.jump_to_image()
+        elif event.key == pygame.K_F3:
+            self.profiler.toggle_hud()
+        elif event.key == pygame.K_F4:
+            self.toggle_trace()
+        elif event.key == pygame.K_HOME:
+            self.fit_image_to_screen()
+        elif event.key == pygame.K_s:
+            self.toggle_snap()
+        elif event.key == pygame.K_p:
+            self.toggle_propagate()
+        elif event.key == pygame.K_m:
+            self.toggle_assist()
+        elif event.key == pygame.K_a:
+            self.accept_proposals()
+        elif event.key == pygame.K_x:
+            self.discard_proposals()
         elif event.key == pygame.K_DELETE:
             self.delete_selected()
         elif event.key == pygame.K_z and (pygame.key.get_mods() & pygame.KMOD_CTRL):
-            self.undo()
+            if pygame.key.get_mods() & pygame.KMOD_SHIFT:
+                self.redo()
+            else:
+                self.undo()
+        elif event.key == pygame.K_y and (pygame.key.get_mods() & pygame.KMOD_CTRL):
+            self.redo()
             
         # 输入处理
         if self.input_active:
@@ -406,24 +1180,101 @@ class AnnotationApp:
             elif event.unicode.isdigit():
                 self.input_text += event.unicode
 
-    def set_current_id(self):
+    def handle_grid_key(self, event):
+        grid = self.grid
+        page = grid.cols * max(1, grid.rect.height // grid.cell_h)
+        moves = {pygame.K_LEFT: -1, pygame.K_RIGHT: 1, pygame.K_UP: -grid.cols,
+                 pygame.K_DOWN: grid.cols, pygame.K_PAGEUP: -page, pygame.K_PAGEDOWN: page}
+        if event.key in (pygame.K_TAB, pygame.K_ESCAPE):
+            self.close_grid()
+        elif event.key == pygame.K_RETURN:
+            self.open_from_grid(grid.cursor)
+        elif event.key in moves:
+            grid.move_cursor(moves[event.key])
+        elif event.key == pygame.K_HOME:
+            grid.move_cursor(-grid.cursor)
+        elif event.key == pygame.K_END:
+            grid.move_cursor(len(self.image_files))
+
+    def open_grid(self):
+        from grid import GridView, ThumbnailCache
+
+        if self.thumbs is None:
+            self.thumbs = ThumbnailCache(read=self.video.read if self.video else None,
+                                         on_ready=self.post_thumbs_ready)
+        self.grid = GridView(self.image_panel_rect, self.image_files, self.thumbs,
+                             self.grid_info, self.title_font, self.current_index)
+        self.context_menu = None
+        self.status_msg = "Grid: arrows/wheel to browse, Enter or click to open, Tab to close"
+        self.mark_dirty(self.image_panel_rect)
+
+    def close_grid(self):
+        self.grid = None
+        self.thumbs.request([])  # 取消还没开始的缩略图任务
+        self.status_msg = f"Image {self.current_index+1}/{len(self.image_files)}"
+        self.mark_dirty(self.image_panel_rect)
+
+    def open_from_grid(self, index):
+        self.close_grid()
+        if index != self.current_index:
+            self.go_to(index, step=1 if index > self.current_index else -1)
+
+    def post_thumbs_ready(self):
+        # 在缩略图线程中调用；一批缩略图只投递一次事件，避免塞满事件队列
+        if not self.thumbs_posted:
+            self.thumbs_posted = True
+            pygame.event.post(pygame.event.Event(THUMBS_READY))
+
+    def grid_info(self, path):
+        """网格角标：(状态, 四边形数)，数量优先取内存中的标注，其次取标注文件的行数"""
+        state = self.states.peek(path)
+        count = len(state.store) if state is not None and not state.loading else self.label_count(path)
+        status = self.dataset.status(path) if self.dataset else None
+        if status is None:
+            status = 'labeled' if count is not None else 'unlabeled'
+        return status, count
+
+    def label_count(self, path):
+        """标注文件中的四边形数，按 mtime 缓存；没有标注文件时返回 None"""
+        label_path = self.label_path(path)
+        if not label_path:
+            return None
+        try:
+            mtime = os.stat(label_path).st_mtime_ns
+        except OSError:
+            return None
+        cached = self.label_counts.peek(label_path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
         try:
-            new_id = int(self.input_text)
+            count = len(read_labels(label_path)[0])
+        except (OSError, ValueError):
+            return None
+        self.label_counts.put(label_path, (mtime, count))
+        return count
+
+    def set_current_id(self):
+        new_id = self.parse_class_id(self.input_text)
+        if new_id is not None:
             self.class_id = new_id
-            self.status_msg = f"Current ID set to {new_id}"
-        except:
-            self.status_msg = "Invalid ID format"
+            self.status_msg = f"Current ID set to {self.class_label(new_id)}"
 
     def edit_id_color(self):
-        try:
-            target_id = int(self.input_text)
-            color = colorchooser.askcolor(title=f"Choose color for ID {target_id}")[0]
-            if color:
-                self.id_colors[target_id] = tuple(map(int, color[:3]))
-                self.save_id_colors()
-                self.status_msg = f"Color updated for ID {target_id}"
-        except:
-            self.status_msg = "Invalid ID format"
+        target_id = self.parse_class_id(self.input_text)
+        if target_id is None:
+            return
+
+        def submit(text):
+            if len(text) != 6:
+                self.status_msg = "Color must be RRGGBB"
+                return
+            self.id_colors[target_id] = tuple(int(text[i:i+2], 16) for i in (0, 2, 4))
+            self.save_id_colors()
+            self.invalidate_overlay()
+            self.status_msg = f"Color updated for ID {target_id}"
+
+        self.open_prompt(f"Color for ID {target_id} (hex RRGGBB):", submit,
+                         allowed=lambda c: c in "0123456789abcdefABCDEF")
 
     def screen_to_image_pos(self, screen_pos):
         x = (screen_pos[0] - self.image_offset[0]) / self.image_scale
@@ -431,22 +1282,57 @@ class AnnotationApp:
         return (int(x), int(y))
 
     def add_annotation_point(self, img_pos):
-        if not self.image:
+        if not self.image or self.labels_loading():
             return
 
-        self.record_history()
-        
-        if not self.annotations or len(self.annotations[-1]['points']) >= self.max_points*2:
-            self.annotations.append({
-                'id': self.class_id,
-                'points': [],
-                'selected': False
-            })
-            
-        self.annotations[-1]['points'].extend(img_pos)
-        if len(self.annotations[-1]['points']) == self.max_points*2:
+        img_pos = self.snap_point(img_pos)
+        command = AddPoint(img_pos, self.class_id)
+        self.history.execute(command, self.annotations)
+        completed = not self.annotations.pending
+        # 只重绘新增部分所在的区域，按整层重绘的图层顺序合成，避免整层重绘
+        self.repaint_overlay(self.command_rects(command))
+        if completed:
             self.status_msg = "Quadrilateral completed"
 
+    def snap_point(self, img_pos):
+        """吸附到半径内最近的亚像素角点；角点尚未算好或附近没有时原样返回"""
+        if not self.snap:
+            return img_pos
+        grid = self.snap.get(self.current_file)
+        if grid is None:
+            return img_pos
+        hit = grid.nearest(img_pos, self.snap_radius / self.image_scale)
+        return hit if hit is not None else img_pos
+
+    def refresh_corners(self, path):
+        """角点检测完成（或失败）后更新状态栏；吸附已关闭时忽略队列中残留的事件"""
+        if not self.snap or path != self.current_file:
+            return
+        error = self.snap.error(path)
+        if error:
+            self.status_msg = f"Snap error: {error}"
+            return
+        grid = self.snap.get(path)
+        if grid is not None:
+            self.status_msg = f"Snap ready: {len(grid)} corners"
+
+    def toggle_snap(self):
+        if self.snap:
+            self.snap.shutdown()
+            self.snap = None
+            self.status_msg = "Snap off"
+            return
+        if self.video:
+            self.status_msg = "Snap is not available for video frames"
+            return
+        from corners import CornerService
+        self.snap = CornerService(
+            on_ready=lambda path: pygame.event.post(pygame.event.Event(CORNERS_READY, path=path)))
+        if self.image_files:
+            self.snap.schedule(self.image_files, self.current_index)
+        grid = self.snap.get(self.current_file)
+        self.status_msg = f"Snap on: {len(grid)} corners" if grid else "Snap on: detecting corners..."
+
     def point_in_polygon(self, point, polygon):
         x, y = point
         n = len(polygon)//2
@@ -461,79 +1347,370 @@ class AnnotationApp:
         return inside
 
     def save_annotations(self):
-        if not self.current_file or not self.save_directory:
+        if not self.current_file or not (self.save_directory or self.tasks) or self.labels_loading():
             return
 
-        base_name = os.path.basename(self.current_file).split('.')[0]
-        yolo_path = os.path.join(self.save_directory, f"{base_name}.txt")
+        with self.profiler.span('save_annotations'):
+            yolo_path = self.submit_labels(self.current_file, self.annotations, self.image_size)
+            if self.state is not None:
+                self.state.mark_saved()
         
-        with open(yolo_path, 'w') as f:
-            img_h, img_w = self.original_image.shape[:2]
-            for ann in self.annotations:
-                points = ann['points']
-                if len(points) != 8:
-                    continue
-                    
-                normalized = [f"{ann['id']}"] + \
-                            [f"{p/img_w} {points[i+1]/img_h}" for i, p in enumerate(points[::2])]
-                f.write(' '.join(normalized) + '\n')
-        
-        self.status_msg = f"Saved to {os.path.basename(yolo_path)}"
+        if yolo_path:
+            self.status_msg = f"Saved to {os.path.basename(yolo_path)}"
+        else:
+            self.status_msg = f"Submitted {os.path.basename(self.current_file)}"
         self.skip_to_next_image()
 
     def skip_to_next_image(self):
-        if self.current_index < len(self.image_files)-1:
-            self.current_index += 1
-            self.load_image(self.image_files[self.current_index])
-            self.annotations = []
-        else:
-            self.status_msg = "Last image reached"
+        self.go_to(self.current_index + 1)
+
+    def previous_image(self):
+        self.go_to(self.current_index - 1, step=-1)
+
+    def jump_to_image(self):
+        def submit(text):
+            if text:
+                self.go_to(int(text) - 1, step=1 if int(text) - 1 >= self.current_index else -1)
+
+        self.open_prompt(f"Go to image (1-{len(self.image_files)}):", submit)
+
+    def skip_image(self):
+        """跳过当前图像，未标注的图记为 skipped，下次打开时不再作为起点"""
+        if self.tasks:
+            self.tasks.skip(self.current_file)
+        elif self.dataset and self.dataset.status(self.current_file) == 'unlabeled':
+            self.dataset.set_status(self.current_file, 'skipped')
+        self.skip_to_next_image()
+
+    def dataset_scanned(self):
+        # 增量扫描可能改变了列表，按路径重新定位当前图像
+        index = self.dataset.index_of(self.current_file)
+        if index is not None:
+            self.current_index = index
+        counts = self.dataset.counts()
+        self.status_msg = (f"Image {self.current_index+1}/{len(self.image_files)} "
+                           f"({counts['labeled']} labeled, {counts['unlabeled']} unlabeled)")
+        self.prefetcher.schedule(self.current_index)
 
     def delete_selected(self):
         if self.selected_annotation != -1:
-            del self.annotations[self.selected_annotation]
+            self.history.execute(DeleteAnnotation(self.selected_annotation), self.annotations)
             self.selected_annotation = -1
+            self.annotations_changed()
             self.update_display()
             self.status_msg = "Annotation deleted"
 
-    def record_history(self):
-        self.history.append(copy.deepcopy(self.annotations))
+    def toggle_assist(self):
+        if self.assist:
+            self.assist.shutdown()
+            self.assist = None
+            self.proposals = None
+            self.assist_msg = ""
+            self.invalidate_overlay()
+            return
+        if self.video:
+            self.assist_msg = "Assist is not available for video frames"
+            return
+        from assist import AssistService
+        try:
+            self.assist = AssistService(
+                self.assist_weights, self.assist_repo,
+                on_ready=lambda path: pygame.event.post(pygame.event.Event(ASSIST_READY)))
+        except OSError as e:
+            self.assist_msg = f"Assist unavailable: {e}"
+            return
+        self.assist_msg = "Assist: loading model..."
+        if self.image_files:
+            self.assist.schedule(self.image_files, self.current_index)
+
+    def toggle_propagate(self):
+        if self.propagate:
+            self.propagate.shutdown()
+            self.propagate = None
+            self.status_msg = "Propagation off"
+            return
+        from propagate import PropagationService
+        self.propagate = PropagationService(
+            self.prefetcher,
+            on_ready=lambda path: pygame.event.post(pygame.event.Event(PROPAGATE_READY, path=path)))
+        if self.image_files:
+            self.propagate.schedule(self.image_files, self.current_index)
+        self.status_msg = "Propagation on: quads follow to the next image"
+
+    def refresh_propagation(self, path):
+        """跟踪结果到达后作为当前图的候选显示"""
+        if not self.propagate or path != self.current_file:
+            return
+        error = self.propagate.error(path)
+        if error:
+            self.status_msg = f"Propagation error: {error}"
+            return
+        result = self.propagate.get(path)
+        if result is None or self.proposals_file == path or len(self.annotations):
+            return
+        self.proposals = result
+        self.proposals_file = path
+        low = int(result['low'].sum())
+        self.status_msg = (f"Tracked {len(result['ids'])} quads"
+                           + (f", {low} low confidence (orange)" if low else ""))
+        self.invalidate_overlay()
+
+    def refresh_proposals(self):
+        """后台推理结果到达后显示当前图像的候选"""
+        if not self.assist:
+            return
+        if self.assist.failed:
+            reason = self.assist.failed
+            self.toggle_assist()
+            self.assist_msg = f"Assist off: {reason}"
+            return
+        if self.proposals_file == self.current_file:
+            return
+        error = self.assist.error(self.current_file)
+        if error:
+            self.assist_msg = f"Assist error: {error}"
+            return
+        result = self.assist.get(self.current_file)
+        if result is None:
+            self.assist_msg = "Assist: running..."
+            return
+        self.proposals = result
+        self.proposals_file = self.current_file
+        source = "cached" if result['cached'] else "CPU"
+        self.assist_msg = (f"Assist: {len(result['ids'])} proposals, "
+                           f"{result['latency'] * 1000:.0f} ms ({source})")
+        self.invalidate_overlay()
+
+    def accept_proposals(self):
+        if self.proposals is None or not len(self.proposals['ids']) or self.labels_loading():
+            return
+        self.history.execute(AddAnnotations(self.proposals['quads'], self.proposals['ids']),
+                             self.annotations)
+        self.status_msg = f"Accepted {len(self.proposals['ids'])} proposals"
+        self.proposals = None
+        self.annotations_changed()
+
+    def discard_proposals(self):
+        if self.proposals is None:
+            return
+        self.proposals = None
+        self.invalidate_overlay()
 
     def undo(self):
-        if self.history:
-            self.annotations = self.history.pop()
-            self.update_display()
-            self.status_msg = "Undo successful"
+        command = self.history.peek_undo()
+        if command is None:
+            return
+        before = self.command_rects(command)
+        self.history.undo(self.annotations)
+        self.command_applied(command, before)
+        self.status_msg = "Undo successful"
+
+    def redo(self):
+        command = self.history.peek_redo()
+        if command is None:
+            return
+        before = self.command_rects(command)
+        self.history.redo(self.annotations)
+        self.command_applied(command, before)
+        self.status_msg = "Redo successful"
+
+    def command_applied(self, command, before):
+        """撤销/重做后只重绘命令前后涉及的区域，不重建整个标注层"""
+        self.selected_annotation = -1
+        if self.drag:  # 拖动中的标注不在标注层上，整层重绘
+            self.annotations_changed()
+            return
+        self.repaint_overlay(before + self.command_rects(command))
+
+    def command_rects(self, command):
+        """命令涉及的标注与未完成点在屏幕上的范围；未完成点各取一个小矩形，
+        不取它们的外接框，以免几个分散的点圈进大片无关标注"""
+        count = len(self.annotations)
+        rects = [self.annotation_rect(i) for i in command.indices(self.annotations)
+                 if 0 <= i < count]
+        size = 2 * self.point_radius + 4
+        points = self.annotations.pending_to_screen(self.image_scale, self.image_offset)
+        rects.extend(pygame.Rect(0, 0, size, size).move(x - size // 2, y - size // 2)
+                     for x, y in points.tolist())
+        return rects
+
+    def repaint_overlay(self, rects):
+        """只重绘标注层上的若干 rect：与之相交的标注完整地画在一张临时层上再拷回，
+        直接裁剪绘制会改变线段的光栅化结果，与整层重绘不一致"""
+        for rect in rects:
+            self.mark_dirty(rect)
+        if not self.overlay_valid:
+            return
+        panel = self.overlay.get_rect()
+        rects = [rect.clip(panel) for rect in rects]
+        rects = [rect for rect in rects if rect]
+        if not rects:
+            return
+        quads = self.annotations.to_screen(self.image_scale, self.image_offset)
+        # 与 annotation_rect 一致地外扩 20 像素，把 ID 文字也算在内
+        mins, maxs = quads.min(axis=1) - 20, quads.max(axis=1) + 20
+        hit = np.zeros(len(quads), bool)
+        for rect in rects:
+            hit |= ((mins[:, 0] < rect.right) & (maxs[:, 0] >= rect.left)
+                    & (mins[:, 1] < rect.bottom) & (maxs[:, 1] >= rect.top))
+
+        # 临时层要容纳所有参与绘制的线段，拷回时才与整层重绘逐像素一致
+        points = [mins[hit], maxs[hit],
+                  self.annotations.pending_to_screen(self.image_scale, self.image_offset)]
+        if self.proposals is not None:
+            proposals = self.proposals['quads'] * self.image_scale + self.image_offset
+            points.append(proposals.reshape(-1, 2).astype(np.int32))
+        points = np.concatenate([p.reshape(-1, 2) for p in points])
+        bounds = rects[0].unionall(rects[1:])
+        if len(points):
+            (x0, y0), (x1, y1) = points.min(axis=0), points.max(axis=0)
+            bounds.union_ip(pygame.Rect(x0, y0, x1 - x0, y1 - y0).inflate(20, 20))
+        bounds = bounds.clip(panel)
+
+        origin = bounds.topleft
+        scratch = pygame.Surface(bounds.size, pygame.SRCALPHA)
+        self.draw_quads(scratch, quads[hit] - np.asarray(origin, np.int32),
+                        self.annotations.ids[hit])
+        self.draw_pending(scratch, origin)
+        self.draw_proposals(scratch, origin)
+        for rect in rects:
+            self.overlay.fill((0, 0, 0, 0), rect)
+            self.overlay.blit(scratch, rect, rect.move(-bounds.x, -bounds.y))
+
+    def ask_folders(self):
+        """未通过命令行指定目录时，退回 Tk 对话框选择"""
+        import tkinter as tk
+        from tkinter import filedialog
 
-    def run(self):
-        self.screen = pygame.display.set_mode((self.screen_width, self.screen_height))
-        pygame.display.set_caption("Four-point Annotation Tool")
-        
-        # 选择文件夹
         root = tk.Tk()
         root.withdraw()
-        
         img_folder = filedialog.askdirectory(title="Select Image Folder")
-        if not img_folder:
-            return
-        self.load_images_from_folder(img_folder)
-        if not self.image_files:
-            return
-            
-        out_folder = filedialog.askdirectory(title="Select Output Folder")
+        out_folder = filedialog.askdirectory(title="Select Output Folder") if img_folder else None
+        root.destroy()
+        return img_folder, out_folder
+
+    def run(self, img_folder=None, out_folder=None, start=None, server=None):
+        if not img_folder and not server:
+            img_folder, out_folder = self.ask_folders()
+            if not img_folder:
+                return
         if out_folder:
             self.save_directory = out_folder
             os.makedirs(out_folder, exist_ok=True)
-            
-        self.load_image(self.image_files[0])
+
+        self.screen = pygame.display.set_mode((self.screen_width, self.screen_height))
+        pygame.display.set_caption("Four-point Annotation Tool")
+
+        if server:
+            self.load_images_from_server(server)
+        elif is_video(img_folder):
+            self.load_video(img_folder)
+        else:
+            self.load_images_from_folder(img_folder)
+        if not self.image_files:
+            return
+        self.prefetcher.set_files(self.image_files)
+
+        # 默认从上次中断处（第一张未标注图像）继续
+        if start is None and self.dataset:
+            start = self.dataset.first_unlabeled()
+        elif start is None and self.video:
+            start = self.video.first_unlabeled(self.save_directory)
+        if not self.go_to(min(max(start or 0, 0), len(self.image_files) - 1)):
+            print("No readable images")
+            return
+        self.update_display()
+        self.startup_time = time.perf_counter() - _START
+        print(f"First image shown in {self.startup_time:.2f}s")
+        self.status_msg = f"{self.status_msg}  (ready in {self.startup_time:.2f}s)"
 
         while self.running:
-            self.handle_events()
-            self.update_display()
+            events = None
+            if self.event_driven:
+                # 空闲时阻塞等待事件，超时后仅刷新状态栏等后台变化
+                event = pygame.event.wait(self.idle_timeout)
+                events = [event] if event.type != pygame.NOEVENT else []
+                events += pygame.event.get()
+            if self.profiler.enabled:
+                self.profiler.begin_frame()  # 此前的等待计为空闲，不计入帧耗时
+            with self.profiler.span('events'):
+                self.handle_events(events)
+            with self.profiler.span('update_display'):
+                self.update_display()
+            if self.profiler.enabled:
+                self.profiler.frame()
             self.clock.tick(60)
 
+        self.profiler.stop_trace()
+        self.write_back()
+        self.writer.close()  # 退出前确保所有标注落盘
+        if self.tasks:
+            self.tasks.close()  # 发完提交并退回未完成的租约
+        if self.assist:
+            self.assist.shutdown()
+        if self.snap:
+            self.snap.shutdown()
+        if self.propagate:
+            self.propagate.shutdown()
+        if self.thumbs:
+            self.thumbs.shutdown()
+        self.prefetcher.shutdown()
+        if self.video:
+            self.video.close()
+        if self.dataset:
+            self.dataset.close()
+        if self.pyramid is not None:
+            self.pyramid.close()
         pygame.quit()
 
-if __name__ == '__main__':
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Four-point annotation tool")
+    parser.add_argument("image_dir", nargs='?',
+                        help="image folder or video file (a folder dialog is shown when omitted)")
+    parser.add_argument("-o", "--output",
+                        help="label folder (default: the image folder, or a folder named "
+                             "after the video)")
+    parser.add_argument("--stride", type=int, default=1,
+                        help="label every Nth frame when the source is a video")
+    parser.add_argument("--start", type=int,
+                        help="start at this image index (default: first unlabeled image)")
+    parser.add_argument("--classes",
+                        help="comma-separated class names, or a file with one name per line")
+    parser.add_argument("--assist", action="store_true", help="start with model assist on")
+    parser.add_argument("--weights", help="model weights for assist (default: best.pt)")
+    parser.add_argument("--repo", help="ArmorDet checkout providing the models package")
+    parser.add_argument("--snap", action="store_true",
+                        help="snap clicked points to detected sub-pixel corners")
+    parser.add_argument("--propagate", action="store_true",
+                        help="track the previous image's quads into the next one as proposals")
+    parser.add_argument("--hud", action="store_true", help="show the profiling overlay")
+    parser.add_argument("--trace", help="record a Chrome trace of the session to this file")
+    parser.add_argument("--server",
+                        help="lease images from a task server (python tasks.py serve) at this URL")
+    args = parser.parse_args(argv)
+
     app = AnnotationApp()
-    app.run()
\ No newline at end of file
+    if args.classes:
+        app.class_names = load_class_names(args.classes)
+    if args.weights:
+        app.assist_weights = args.weights
+    app.assist_repo = args.repo
+    if args.hud:
+        app.profiler.toggle_hud()
+    if args.trace:
+        app.profiler.start_trace(args.trace)
+    if args.assist:
+        app.toggle_assist()
+    if args.snap:
+        app.toggle_snap()
+    if args.propagate:
+        app.toggle_propagate()
+    app.video_stride = args.stride
+    output = args.output or args.image_dir
+    if not args.output and args.image_dir and is_video(args.image_dir):
+        output = os.path.splitext(args.image_dir)[0]
+    app.run(args.image_dir, output, args.start, args.server)
+
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
@@ -0,0 +1,120 @@
+"""best.pt 四点检测模型的加载与推理（CPU）
+
+best.pt 是 ArmorDet（基于 YOLOv5 修改）训练得到的检查点，Detect 头每个候选输出 43 维：
+前 8 维为四个角点的像素坐标 (x1, y1, ..., x4, y4)，第 9 维为目标置信度，其余 34 维为类别分数。
+反序列化需要 ArmorDet 仓库中的 models 包，可通过 repo_dir 指定其路径。
+"""
+import os
+import sys
+
+import cv2
+import numpy as np
+
+KEYPOINTS = slice(0, 8)
+OBJECTNESS = 8
+CLASSES = slice(9, None)
+
+# 进程池中每个工作进程只加载一次模型；加载失败时记下原因
+_worker_model = None
+_worker_error = None
+
+
+class ModelLoadError(RuntimeError):
+    """工作进程中模型加载失败，消息为真正的原因（缺少 torch、找不到 models 包等）"""
+
+
+def load_model(weights, repo_dir=None):
+    try:
+        import torch
+    except ImportError:
+        raise ImportError("Model assist requires PyTorch (pip install torch)")
+    if repo_dir and repo_dir not in sys.path:
+        sys.path.insert(0, repo_dir)
+    try:
+        ckpt = torch.load(weights, map_location='cpu', weights_only=False)
+    except ModuleNotFoundError as e:
+        if e.name and e.name.split('.')[0] == 'models':
+            raise ImportError(f"{os.path.basename(weights)} needs the ArmorDet models package "
+                              f"({e}); pass its checkout with --repo") from e
+        raise
+    model = ckpt['ema'] if ckpt.get('ema') is not None else ckpt['model']
+    return model.float().eval()
+
+
+def init_worker(weights, repo_dir=None):
+    """ProcessPoolExecutor 的 initializer：限制单进程线程数并加载模型。
+    失败时不抛出：initializer 抛异常会使整个进程池损坏且看不到原因，
+    改为记下原因，由之后的每个任务以 ModelLoadError 报告"""
+    global _worker_model, _worker_error
+    cv2.setNumThreads(1)
+    try:
+        _worker_model = load_model(weights, repo_dir)
+        import torch
+        torch.set_num_threads(1)  # 多进程并行时避免线程数相互争抢
+    except Exception as e:
+        _worker_error = str(e) or type(e).__name__
+
+
+def worker_model():
+    if _worker_model is None:
+        raise ModelLoadError(_worker_error or "model is not loaded")
+    return _worker_model
+
+
+def check_worker():
+    """探测任务：工作进程中的模型可用时返回 True，否则抛出 ModelLoadError"""
+    worker_model()
+    return True
+
+
+def letterbox(bgr, size=640):
+    """等比缩放并居中填充到 size x size，返回 (图像, 缩放比, (pad_x, pad_y))"""
+    h, w = bgr.shape[:2]
+    r = min(size / h, size / w)
+    new_w, new_h = int(round(w * r)), int(round(h * r))
+    resized = cv2.resize(bgr, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    pad_x, pad_y = (size - new_w) / 2, (size - new_h) / 2
+    top, left = int(round(pad_y - 0.1)), int(round(pad_x - 0.1))
+    canvas = np.full((size, size, 3), 114, np.uint8)
+    canvas[top:top+new_h, left:left+new_w] = resized
+    return canvas, r, (left, top)
+
+
+def postprocess(pred, r, pad, conf_thres=0.5, iou_thres=0.45):
+    """pred: (N,43) 单张图的原始输出；返回 (ids, quads(M,4,2), scores)，坐标为原图像素"""
+    obj = pred[:, OBJECTNESS]
+    cls_scores = pred[:, CLASSES]
+    ids = cls_scores.argmax(axis=1)
+    scores = obj * cls_scores[np.arange(len(pred)), ids]
+    keep = scores > conf_thres
+    if not keep.any():
+        return np.empty(0, np.int32), np.empty((0, 4, 2), np.float32), np.empty(0, np.float32)
+
+    quads = pred[keep, KEYPOINTS].reshape(-1, 4, 2)
+    ids, scores = ids[keep], scores[keep]
+    quads = (quads - np.asarray(pad, np.float32)) / r
+
+    # 以角点的外接框做 NMS
+    mins, maxs = quads.min(axis=1), quads.max(axis=1)
+    boxes = np.concatenate([mins, maxs - mins], axis=1).tolist()
+    order = cv2.dnn.NMSBoxes(boxes, scores.tolist(), conf_thres, iou_thres)
+    order = np.asarray(order, np.int64).reshape(-1)
+    return ids[order].astype(np.int32), quads[order].astype(np.float32), \
+        scores[order].astype(np.float32)
+
+
+def predict(model, images, size=640, conf_thres=0.5, iou_thres=0.45):
+    """对一批 BGR 图像做推理，返回每张图的 (ids, quads, scores)"""
+    import torch
+
+    batch, metas = [], []
+    for bgr in images:
+        canvas, r, pad = letterbox(bgr, size)
+        batch.append(cv2.cvtColor(canvas, cv2.COLOR_BGR2RGB).transpose(2, 0, 1))
+        metas.append((r, pad))
+    x = torch.from_numpy(np.ascontiguousarray(np.stack(batch))).float() / 255
+
+    with torch.no_grad():
+        out = model(x)
+    pred = (out[0] if isinstance(out, (list, tuple)) else out).numpy()
+    return [postprocess(p, r, pad, conf_thres, iou_thres) for p, (r, pad) in zip(pred, metas)]
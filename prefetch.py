@@ -0,0 +1,234 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import pygame
+
+from dataset import read_image_size
+
+# JPEG 等格式可在解码时直接缩小，解码器只输出缩小后的像素；缩小倍数 -> imread 标志
+REDUCED_FLAGS = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4,
+                 8: cv2.IMREAD_REDUCED_COLOR_8}
+
+
+class LRUCache:
+    """按字节数和/或条数限制容量的LRU缓存（线程安全），两个上限都为 None 时不淘汰"""
+
+    def __init__(self, max_bytes=None, max_items=None):
+        self.max_bytes = max_bytes
+        self.max_items = max_items
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def peek(self, key):
+        """读取但不计入命中统计、不调整顺序"""
+        with self._lock:
+            item = self._items.get(key)
+            return item[0] if item is not None else None
+
+    def _over(self):
+        return ((self.max_bytes is not None and self.current_bytes > self.max_bytes) or
+                (self.max_items is not None and len(self._items) > self.max_items))
+
+    def put(self, key, value, nbytes=0):
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[1]
+            self._items[key] = (value, nbytes)
+            self.current_bytes += nbytes
+            # 超出上限时从最久未使用的一端淘汰，但至少保留刚放入的一项
+            while self._over() and len(self._items) > 1:
+                _, (_, size) = self._items.popitem(last=False)
+                self.current_bytes -= size
+
+    def discard(self, key):
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[1]
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.current_bytes = 0
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._items
+
+    def __len__(self):
+        with self._lock:
+            return len(self._items)
+
+
+class DecodedImage:
+    """已解码并缩放到显示尺寸的图像"""
+
+    def __init__(self, path, surface, buffer, image_size, scale):
+        self.path = path
+        self.surface = surface
+        self.buffer = buffer  # surface 直接引用该内存，需保持存活
+        self.image_size = image_size  # 原图 (w, h)
+        self.scale = scale
+
+    @property
+    def nbytes(self):
+        return self.buffer.nbytes
+
+
+def fit_scale(image_size, view_size, margin=40):
+    """计算让图像完整显示在视图内的缩放比例"""
+    img_w, img_h = image_size
+    view_w, view_h = view_size
+    return min((view_w - margin) / img_w, (view_h - margin) / img_h)
+
+
+def imread_reduced(path, view_size, margin=40):
+    """按显示所需的分辨率读图：先从文件头得到原图尺寸，再选不低于显示尺寸的最大缩小倍数解码。
+    返回 (BGR, 原图 (w, h))，读取失败时返回 (None, None)"""
+    size = read_image_size(path)
+    if size is not None and min(size) > 0:
+        scale = fit_scale(size, view_size, margin)
+        for factor in sorted(REDUCED_FLAGS, reverse=True):
+            if scale * factor > 1:
+                continue
+            bgr = cv2.imread(path, REDUCED_FLAGS[factor])
+            if bgr is None:
+                break
+            h, w = bgr.shape[:2]
+            img_w, img_h = size
+            # EXIF 方向会让解码结果相对文件头尺寸转 90°；对不上时退回完整解码
+            if abs(w * factor - img_w) < factor and abs(h * factor - img_h) < factor:
+                return bgr, (img_w, img_h)
+            if abs(w * factor - img_h) < factor and abs(h * factor - img_w) < factor:
+                return bgr, (img_h, img_w)
+            break
+    bgr = cv2.imread(path)
+    if bgr is None:
+        return None, None
+    return bgr, (bgr.shape[1], bgr.shape[0])
+
+
+def decode_image(path, view_size, read=None):
+    """读取图像并缩放到显示尺寸，可在工作线程中调用（cv2 会释放GIL）；
+    read 为自定义解码函数（如视频帧源），默认从磁盘读图像文件。
+    全分辨率只在放大（瓦片金字塔）或角点检测时另行解码"""
+    if read is None:
+        bgr, image_size = imread_reduced(path, view_size) if os.path.exists(path) else (None, None)
+    else:
+        bgr = read(path)
+        image_size = None if bgr is None else (bgr.shape[1], bgr.shape[0])
+    if bgr is None:
+        return None
+
+    img_w, img_h = image_size
+    scale = fit_scale(image_size, view_size)
+    scaled_w = max(1, int(img_w * scale))
+    scaled_h = max(1, int(img_h * scale))
+    if (scaled_w, scaled_h) != (bgr.shape[1], bgr.shape[0]):
+        interpolation = cv2.INTER_AREA if scaled_w < bgr.shape[1] else cv2.INTER_LINEAR
+        bgr = cv2.resize(bgr, (scaled_w, scaled_h), interpolation=interpolation)
+        rgb = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB, dst=bgr)  # 缩放结果是新数组，原地转换
+    else:
+        rgb = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+
+    surface = pygame.image.frombuffer(rgb.data, (scaled_w, scaled_h), 'RGB')
+    return DecodedImage(path, surface, rgb, image_size, scale)
+
+
+class ImagePrefetcher:
+    """在后台线程池中预解码当前图像前后各 radius 张图"""
+
+    def __init__(self, view_size, radius=3, workers=2, max_bytes=256 * 1024 * 1024):
+        self.view_size = view_size
+        self.read = None  # 自定义解码函数，见 decode_image
+        self.radius = radius
+        self.cache = LRUCache(max_bytes)
+        self.files = []
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers,
+                                            thread_name_prefix="prefetch")
+
+    def set_files(self, files):
+        self.files = files
+        self.cache.clear()
+        with self._lock:
+            for future in self._pending.values():
+                future.cancel()
+            self._pending.clear()
+
+    def get(self, path):
+        """取出已解码图像；未命中时等待正在进行的任务或直接在当前线程解码"""
+        entry = self.cache.get(path)
+        if entry is not None:
+            return entry
+
+        with self._lock:
+            future = self._pending.get(path)
+            # 尚未开始的任务直接取消，改为在当前线程解码
+            if future is not None and future.cancel():
+                del self._pending[path]
+                future = None
+        if future is not None:
+            return future.result()
+        entry = decode_image(path, self.view_size, self.read)
+        if entry is not None:
+            self.cache.put(path, entry, entry.nbytes)
+        return entry
+
+    def schedule(self, index):
+        """以 index 为中心提交预取任务，并取消窗口外尚未开始的任务"""
+        lo = max(0, index - self.radius)
+        hi = min(len(self.files), index + self.radius + 1)
+        # 先近后远，优先解码前进方向的下一张
+        order = sorted(range(lo, hi), key=lambda i: (abs(i - index), i < index))
+        wanted = [self.files[i] for i in order if i != index]
+
+        with self._lock:
+            for path in list(self._pending):
+                if path not in wanted and self._pending[path].cancel():
+                    del self._pending[path]
+            for path in wanted:
+                if path in self._pending or path in self.cache:
+                    continue
+                future = self._executor.submit(self._load, path)
+                self._pending[path] = future
+
+    def _load(self, path):
+        try:
+            entry = decode_image(path, self.view_size, self.read)
+            if entry is not None:
+                self.cache.put(path, entry, entry.nbytes)
+            return entry
+        finally:
+            with self._lock:
+                self._pending.pop(path, None)
+
+    def submit(self, func, *args):
+        """在预取线程池中执行其他解码任务（如放大时的全分辨率解码），返回 Future"""
+        return self._executor.submit(func, *args)
+
+    def stats_text(self):
+        cache = self.cache
+        return (f"Cache hit {cache.hits} / miss {cache.misses}  "
+                f"{len(cache)} ready, {cache.current_bytes / 2**20:.0f} MB")
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,110 @@
+"""无界面批量预标注：用 best.pt 对整个目录推理并写出 YOLO 四点标注
+
+用法:
+    python prelabel.py IMAGE_DIR OUTPUT_DIR [--weights best.pt] [--workers 4] [--batch-size 8]
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import cv2
+
+from dataset import iter_images, label_path_for
+from label_io import write_labels
+from model import ModelLoadError, check_worker, init_worker, predict, worker_model
+
+
+def needs_label(image_path, label_path):
+    """已有且比图像新的标注视为完成，用于断点续跑"""
+    try:
+        return os.path.getmtime(label_path) < os.path.getmtime(image_path)
+    except OSError:
+        return True
+
+
+def _label_batch(jobs, conf_thres):
+    """在工作进程中解码一批图像、批量推理并写出标注，返回处理的张数"""
+    images, targets = [], []
+    for image_path, label_path in jobs:
+        bgr = cv2.imread(image_path)
+        if bgr is None:
+            continue
+        images.append(bgr)
+        targets.append(label_path)
+    if not images:
+        return 0
+
+    results = predict(worker_model(), images, conf_thres=conf_thres)
+    for bgr, label_path, (ids, quads, _) in zip(images, targets, results):
+        write_labels(label_path, ids, quads, (bgr.shape[1], bgr.shape[0]))
+    return len(images)
+
+
+def iter_batches(image_dir, output_dir, batch_size, stats):
+    batch = []
+    for image_path in iter_images(image_dir):
+        label_path = label_path_for(image_path, image_dir, output_dir)
+        if not needs_label(image_path, label_path):
+            stats['skipped'] += 1
+            continue
+        batch.append((image_path, label_path))
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def run(image_dir, output_dir, weights, repo_dir=None, workers=4, batch_size=8,
+        conf_thres=0.5):
+    stats = {'labeled': 0, 'skipped': 0}
+    start = time.perf_counter()
+    executor = ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+        initializer=init_worker, initargs=(weights, repo_dir))
+    with executor:
+        # 先确认工作进程里的模型能加载，失败时以 ModelLoadError 给出真正的原因
+        executor.submit(check_worker).result()
+        # 同时在途的批次有上限，内存占用与数据集大小无关
+        pending = set()
+        for batch in iter_batches(image_dir, output_dir, batch_size, stats):
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                stats['labeled'] += sum(f.result() for f in done)
+            pending.add(executor.submit(_label_batch, batch, conf_thres))
+        for future in pending:
+            stats['labeled'] += future.result()
+
+    elapsed = time.perf_counter() - start
+    stats['seconds'] = elapsed
+    stats['images_per_sec'] = stats['labeled'] / elapsed if elapsed else 0.0
+    return stats
+
+
+def main():
+    default_weights = os.path.join(os.path.dirname(os.path.abspath(__file__)), "best.pt")
+    parser = argparse.ArgumentParser(description="Pre-label an image folder with best.pt")
+    parser.add_argument("image_dir")
+    parser.add_argument("output_dir")
+    parser.add_argument("--weights", default=default_weights)
+    parser.add_argument("--repo", help="ArmorDet checkout providing the models package")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--conf", type=float, default=0.5)
+    args = parser.parse_args()
+
+    try:
+        stats = run(args.image_dir, args.output_dir, args.weights, args.repo,
+                    args.workers, args.batch_size, args.conf)
+    except (ModelLoadError, BrokenProcessPool) as e:
+        sys.exit(f"prelabel: model unavailable: {e}")
+    print(f"Labeled {stats['labeled']} images, skipped {stats['skipped']} up-to-date, "
+          f"{stats['seconds']:.1f}s ({stats['images_per_sec']:.1f} images/sec)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""主循环各阶段的计时：屏幕角落的性能面板，以及可选的 Chrome trace 导出
+
+关闭时 span() 返回共享的空上下文，开销只有一次属性判断。
+trace 文件采用 Chrome trace-event 的 JSON 数组格式，边记录边写盘，
+末尾的 ] 可以省略，因此程序异常退出时文件仍可在 chrome://tracing 或 Perfetto 中打开。
+"""
+import json
+import os
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+
+import numpy as np
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, self.start, time.perf_counter_ns())
+        return False
+
+
+def current_rss_mb():
+    """当前常驻内存；非 Linux 平台退而使用峰值"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1 << 20)
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / 1024
+
+
+class Profiler:
+    def __init__(self, history=600):
+        self.hud = False
+        self.enabled = False
+        self.samples = defaultdict(lambda: deque(maxlen=history))
+        self.frame_times = deque(maxlen=history)  # 每帧处理事件与绘制的耗时，不含空闲等待
+        self.trace_path = None
+        self._trace = None
+        self._trace_lock = threading.Lock()
+        self._origin = time.perf_counter_ns()
+        self._frame_start = None
+        self._last_frame = None
+
+    def _update_enabled(self):
+        self.enabled = self.hud or self._trace is not None
+        self._frame_start = None
+        self._last_frame = None
+
+    def toggle_hud(self):
+        self.hud = not self.hud
+        self._update_enabled()
+        return self.hud
+
+    @property
+    def tracing(self):
+        return self._trace is not None
+
+    def span(self, name):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name)
+
+    def record(self, name, start_ns, end_ns):
+        self.samples[name].append((end_ns - start_ns) / 1e6)
+        if self._trace is not None:
+            self._write_event({'name': name, 'ph': 'X', 'pid': os.getpid(),
+                               'tid': threading.get_ident(),
+                               'ts': (start_ns - self._origin) / 1e3,
+                               'dur': (end_ns - start_ns) / 1e3})
+
+    def begin_frame(self):
+        """等到事件、开始处理时调用；与上一帧结束之间的时间记为 idle"""
+        now = time.perf_counter_ns()
+        if self._last_frame is not None:
+            self.record('idle', self._last_frame, now)
+        self._frame_start = now
+
+    def frame(self):
+        """每轮主循环绘制完成时调用，记录本帧从 begin_frame 起的耗时"""
+        now = time.perf_counter_ns()
+        if self._frame_start is not None:
+            self.frame_times.append((now - self._frame_start) / 1e6)
+        self._frame_start = None
+        self._last_frame = now
+
+    def percentiles(self, name, qs=(50, 95)):
+        values = self.samples.get(name)
+        if not values:
+            return None
+        return np.percentile(np.fromiter(values, float, len(values)), qs)
+
+    def start_trace(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._trace_lock:
+            self._trace = open(path, 'w')
+            self._trace.write('[\n')
+        self.trace_path = path
+        self._update_enabled()
+
+    def stop_trace(self):
+        with self._trace_lock:
+            if self._trace is None:
+                return None
+            self._trace.write(json.dumps({'name': 'trace_end', 'ph': 'i', 's': 'g',
+                                          'pid': os.getpid(), 'tid': 0,
+                                          'ts': (time.perf_counter_ns() - self._origin) / 1e3}))
+            self._trace.write('\n]\n')
+            self._trace.close()
+            self._trace = None
+        self._update_enabled()
+        return self.trace_path
+
+    def _write_event(self, event):
+        with self._trace_lock:
+            if self._trace is not None:
+                self._trace.write(json.dumps(event) + ',\n')
+
+    def hud_lines(self):
+        lines = []
+        if self.frame_times:
+            frames = np.fromiter(self.frame_times, float, len(self.frame_times))
+            recent = frames[-60:]
+            idle = list(self.samples['idle'])[-60:]
+            # FPS 按帧耗时加空闲计，反映实际刷新频率；帧耗时本身只含处理与绘制
+            period = recent.mean() + (np.mean(idle) if idle else 0.0)
+            lines.append(f"frame {np.median(recent):.1f} ms  p95 {np.percentile(frames, 95):.1f}"
+                         f"  {1000 / max(period, 1e-6):.0f} FPS")
+            if idle:
+                lines.append(f"idle p50 {np.median(idle):.1f} ms")
+        for name in ('events', 'update_display', 'load_image', 'save_annotations'):
+            p = self.percentiles(name)
+            if p is not None:
+                lines.append(f"{name} p50 {p[0]:.1f}  p95 {p[1]:.1f} ms")
+        rss = current_rss_mb()
+        if rss is not None:
+            lines.append(f"RSS {rss:.0f} MB")
+        if self.tracing:
+            lines.append(f"trace -> {os.path.basename(self.trace_path)}")
+        return lines
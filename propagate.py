@@ -0,0 +1,178 @@
+"""把上一张图的四边形跟踪到下一张图，作为可编辑的候选
+
+在预取器已缩放到显示尺寸的图像上做金字塔 LK 光流，跟踪每个四边形的四个角点和框内的特征点，
+前后向一致的点足够多时按单应变换搬运四个角点，否则直接用跟踪到的角点；
+一致点的比例作为置信度，低于阈值的四边形会被标出来。
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from prefetch import LRUCache
+
+WIN_SIZE = (15, 15)
+MAX_LEVEL = 3
+LK_CRITERIA = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 20, 0.03)
+
+
+class TrackFrame:
+    """一张图的灰度图与特征点（显示尺寸坐标），scale 为相对原图的缩放比例"""
+
+    def __init__(self, gray, scale, features=None):
+        self.scale = scale
+        self.gray = gray
+        if features is None:
+            features = cv2.goodFeaturesToTrack(gray, 3000, 0.01, 5)
+            features = (np.empty((0, 2), np.float32) if features is None
+                        else features.reshape(-1, 2))
+        self.features = features
+
+    def resized(self, size):
+        """缩放到 size=(w, h) 的副本，两张图显示尺寸不同时用来对齐光流金字塔；
+        宽高比不同时 scale 变为按轴的 (sx, sy)"""
+        h, w = self.gray.shape
+        factor = np.array([size[0] / w, size[1] / h], np.float32)
+        gray = cv2.resize(self.gray, size, interpolation=cv2.INTER_AREA)
+        return TrackFrame(gray, self.scale * factor, self.features * factor)
+
+
+def _lk(prev, curr, points):
+    """前向加后向光流，返回跟踪结果和前后向误差（未跟踪到的点误差为 inf）"""
+    if not len(points):
+        return points, np.empty(0, np.float32)
+    src = points.reshape(-1, 1, 2)
+    dst, status, _ = cv2.calcOpticalFlowPyrLK(prev.gray, curr.gray, src, None,
+                                              winSize=WIN_SIZE, maxLevel=MAX_LEVEL,
+                                              criteria=LK_CRITERIA)
+    back, back_status, _ = cv2.calcOpticalFlowPyrLK(curr.gray, prev.gray, dst, None,
+                                                    winSize=WIN_SIZE, maxLevel=MAX_LEVEL,
+                                                    criteria=LK_CRITERIA)
+    error = np.linalg.norm(back - src, axis=2).ravel()
+    error[(status.ravel() == 0) | (back_status.ravel() == 0)] = np.inf
+    return dst.reshape(-1, 2), error
+
+
+def track_quads(prev, curr, quads, fb_thres=1.0, min_score=0.6, max_features=16):
+    """把 (N,4,2) 原图坐标的四边形从 prev 跟踪到 curr，返回 (四边形, 置信度, 低置信掩码)"""
+    quads = np.asarray(quads, np.float32)
+    n = len(quads)
+    if curr.gray.shape != prev.gray.shape:
+        # calcOpticalFlowPyrLK 要求两帧尺寸一致
+        curr = curr.resized(prev.gray.shape[::-1])
+    corners = (quads * prev.scale).reshape(-1, 2)
+
+    # 每个四边形外接框（外扩 10%）内的特征点，和所有角点一起做一次光流
+    lo, hi = quads.min(axis=1) * prev.scale, quads.max(axis=1) * prev.scale
+    pad = (hi - lo) * 0.1
+    fx, fy = prev.features[:, 0], prev.features[:, 1]
+    inside = ((fx >= (lo - pad)[:, :1]) & (fx <= (hi + pad)[:, :1]) &
+              (fy >= (lo - pad)[:, 1:]) & (fy <= (hi + pad)[:, 1:]))
+    # 特征点按质量降序排列，每个四边形只取最强的若干个，点数与四边形数成正比
+    inside &= np.cumsum(inside, axis=1) <= max_features
+    used = inside.any(axis=0)
+    points = np.concatenate([corners, prev.features[used]]).astype(np.float32)
+    tracked, error = _lk(prev, curr, points)
+    good = error < fb_thres
+    inside = inside[:, used]
+
+    result = np.empty_like(quads)
+    scores = np.zeros(n, np.float32)
+    for i in range(n):
+        corner_src = corners[4 * i:4 * i + 4]
+        corner_dst = tracked[4 * i:4 * i + 4]
+        corner_good = good[4 * i:4 * i + 4]
+        feat = 4 * n + np.flatnonzero(inside[i])
+        src = np.concatenate([corner_src[corner_good], points[feat][good[feat]]])
+        dst = np.concatenate([corner_dst[corner_good], tracked[feat][good[feat]]])
+        total = 4 + len(feat)
+        if len(src) >= 6:
+            H, mask = cv2.findHomography(src, dst, cv2.RANSAC, 2.0)
+            if H is not None:
+                moved = cv2.perspectiveTransform(corner_src.reshape(-1, 1, 2), H).reshape(4, 2)
+                result[i] = moved / curr.scale
+                scores[i] = mask.sum() / total
+                continue
+        if corner_good.any():
+            # 点太少拟合不了单应：跟丢的角点按其余角点的中位位移平移
+            shift = np.median(corner_dst[corner_good] - corner_src[corner_good], axis=0)
+            moved = np.where(corner_good[:, None], corner_dst, corner_src + shift)
+            result[i] = moved / curr.scale
+            scores[i] = corner_good.sum() / total
+        else:
+            result[i] = quads[i] * prev.scale / curr.scale
+    low = scores < min_score
+    return result, scores, low
+
+
+class PropagationService:
+    """后台为当前图和下一张图准备灰度图和特征点，切图后在同一个工作线程里完成跟踪"""
+
+    def __init__(self, prefetcher, max_frames=4, on_ready=None):
+        self.prefetcher = prefetcher
+        self.on_ready = on_ready
+        self.frames = LRUCache(max_items=max_frames)
+        self.results = {}
+        self.errors = {}  # 图像 -> 准备或跟踪失败的原因，成功后清除
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="propagate")
+
+    def _frame(self, path):
+        frame = self.frames.peek(path)
+        if frame is None:
+            # 直接用预取器解码并缩放好的图像，不再单独读图
+            decoded = self.prefetcher.cache.peek(path) or self.prefetcher.get(path)
+            if decoded is None:
+                raise IOError(f"Failed to read {path}")
+            gray = cv2.cvtColor(decoded.buffer, cv2.COLOR_RGB2GRAY)
+            frame = TrackFrame(gray, decoded.scale)
+            self.frames.put(path, frame)
+        return frame
+
+    def schedule(self, files, index):
+        """预先准备当前图和下一张图的跟踪数据"""
+        keep = set(files[max(0, index - 1):index + 2])
+        with self._lock:
+            for path in [p for p in self.errors if p not in keep]:
+                del self.errors[path]
+        for path in files[index:index + 2]:
+            if path not in self.frames:
+                self._executor.submit(self._prepare, path)
+
+    def _prepare(self, path):
+        try:
+            self._frame(path)
+        except Exception as e:
+            with self._lock:
+                self.errors[path] = str(e) or type(e).__name__
+
+    def track(self, prev_path, quads, ids, path):
+        """把 prev_path 上的标注跟踪到 path，完成后通过 on_ready(path) 通知"""
+        self._executor.submit(self._track, prev_path, np.array(quads), np.array(ids), path)
+
+    def _track(self, prev_path, quads, ids, path):
+        try:
+            quads, scores, low = track_quads(self._frame(prev_path), self._frame(path), quads)
+        except Exception as e:
+            with self._lock:
+                self.errors[path] = str(e) or type(e).__name__
+        else:
+            with self._lock:
+                self.errors.pop(path, None)
+                self.results = {path: {'ids': ids, 'quads': quads, 'scores': scores,
+                                       'low': low}}
+        if self.on_ready:
+            self.on_ready(path)
+
+    def get(self, path):
+        with self._lock:
+            return self.results.get(path)
+
+    def error(self, path):
+        """该图最近一次跟踪失败的原因，没有失败时返回 None"""
+        with self._lock:
+            return self.errors.get(path)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
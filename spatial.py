@@ -0,0 +1,133 @@
+import numpy as np
+
+# 网格坐标编码为一个 int64 键，单轴支持 ±2^20 个格子
+_KEY_BIAS = 1 << 20
+_KEY_STRIDE = 1 << 21
+
+
+def _cell_key(cx, cy):
+    return (cy + _KEY_BIAS) * _KEY_STRIDE + (cx + _KEY_BIAS)
+
+
+def points_in_quads(point, quads):
+    """射线法判断一个点是否落在每个四边形内，quads 形状为 (N,4,2)"""
+    x, y = point
+    xi = quads[:, :, 0]
+    yi = quads[:, :, 1]
+    xj = np.roll(xi, -1, axis=1)
+    yj = np.roll(yi, -1, axis=1)
+    straddle = (yi > y) != (yj > y)
+    dy = np.where(straddle, yj - yi, 1)
+    cross = x < (xj - xi) * (y - yi) / dy + xi
+    return np.count_nonzero(straddle & cross, axis=1) % 2 == 1
+
+
+class SpatialIndex:
+    """四边形的均匀网格索引，命中测试与最近顶点查询均批量向量化计算"""
+
+    def __init__(self, cell_size=64, max_cells_per_quad=64):
+        self.cell_size = cell_size
+        self.max_cells_per_quad = max_cells_per_quad
+        self.build(np.empty((0, 4, 2), np.float32))
+
+    def build(self, quads, ids=None):
+        """quads: (N,4,2) 图像坐标；ids: 每个四边形对应的标注下标"""
+        quads = np.asarray(quads, np.float32).reshape(-1, 4, 2)
+        self.quads = quads
+        self.ids = np.arange(len(quads)) if ids is None else np.asarray(ids)
+
+        mins = np.floor(quads.min(axis=1) / self.cell_size).astype(np.int64)
+        maxs = np.floor(quads.max(axis=1) / self.cell_size).astype(np.int64)
+        span = maxs - mins + 1
+        ncells = span[:, 0] * span[:, 1]
+
+        # 覆盖格子过多的大四边形单独存放，每次查询都参与检测
+        big = ncells > self.max_cells_per_quad
+        self.oversize = np.nonzero(big)[0]
+        small = np.nonzero(~big)[0]
+
+        counts = ncells[small]
+        owner = np.repeat(small, counts)
+        starts = np.repeat(np.cumsum(counts) - counts, counts)
+        local = np.arange(counts.sum()) - starts
+        width = span[owner, 0]
+        cx = mins[owner, 0] + local % width
+        cy = mins[owner, 1] + local // width
+
+        keys = _cell_key(cx, cy)
+        order = np.argsort(keys, kind='stable')
+        self.cell_keys = keys[order]
+        self.cell_quads = owner[order]
+
+    def candidates(self, x0, y0, x1, y1):
+        """返回包围盒可能与给定矩形相交的四边形下标"""
+        size = self.cell_size
+        cx = np.arange(int(np.floor(x0 / size)), int(np.floor(x1 / size)) + 1)
+        cy = np.arange(int(np.floor(y0 / size)), int(np.floor(y1 / size)) + 1)
+        keys = _cell_key(cx[None, :], cy[:, None]).ravel()
+        lo = np.searchsorted(self.cell_keys, keys, side='left')
+        hi = np.searchsorted(self.cell_keys, keys, side='right')
+        parts = [self.cell_quads[a:b] for a, b in zip(lo, hi) if b > a]
+        if len(self.oversize):
+            parts.append(self.oversize)
+        if not parts:
+            return np.empty(0, np.int64)
+        return np.unique(np.concatenate(parts))
+
+    def hit_test(self, point):
+        """返回包含该点的标注下标（多个时取最小），没有则返回 -1"""
+        cand = self.candidates(point[0], point[1], point[0], point[1])
+        if not len(cand):
+            return -1
+        inside = points_in_quads(point, self.quads[cand])
+        if not inside.any():
+            return -1
+        return int(self.ids[cand[inside]].min())
+
+    def nearest_vertex(self, point, radius):
+        """返回 radius 范围内最近的角点 (标注下标, 顶点序号)，没有则返回 None"""
+        x, y = point
+        cand = self.candidates(x - radius, y - radius, x + radius, y + radius)
+        if not len(cand):
+            return None
+        verts = self.quads[cand].reshape(-1, 2)
+        d2 = (verts[:, 0] - x) ** 2 + (verts[:, 1] - y) ** 2
+        best = int(np.argmin(d2))
+        if d2[best] > radius * radius:
+            return None
+        return int(self.ids[cand[best // 4]]), best % 4
+
+
+class PointGrid:
+    """点集的均匀网格索引，用于在半径内查找最近点（如吸附角点）"""
+
+    def __init__(self, points, cell_size=16):
+        self.cell_size = cell_size
+        points = np.asarray(points, np.float32).reshape(-1, 2)
+        cells = np.floor(points / cell_size).astype(np.int64)
+        keys = _cell_key(cells[:, 0], cells[:, 1])
+        order = np.argsort(keys, kind='stable')
+        self.keys = keys[order]
+        self.points = points[order]
+
+    def __len__(self):
+        return len(self.points)
+
+    def nearest(self, point, radius):
+        """返回 radius 范围内最近的点 (x, y)，没有则返回 None"""
+        x, y = point
+        size = self.cell_size
+        cx = np.arange(int(np.floor((x - radius) / size)), int(np.floor((x + radius) / size)) + 1)
+        cy = np.arange(int(np.floor((y - radius) / size)), int(np.floor((y + radius) / size)) + 1)
+        keys = _cell_key(cx[None, :], cy[:, None]).ravel()
+        lo = np.searchsorted(self.keys, keys, side='left')
+        hi = np.searchsorted(self.keys, keys, side='right')
+        parts = [self.points[a:b] for a, b in zip(lo, hi) if b > a]
+        if not parts:
+            return None
+        cand = np.concatenate(parts)
+        d2 = (cand[:, 0] - x) ** 2 + (cand[:, 1] - y) ** 2
+        best = int(np.argmin(d2))
+        if d2[best] > radius * radius:
+            return None
+        return float(cand[best, 0]), float(cand[best, 1])
@@ -0,0 +1,110 @@
+import numpy as np
+
+
+class AnnotationStore:
+    """紧凑的标注存储：已完成的四边形放在 (N,4,2) float32 数组里，ID 为并行的 int32 数组；
+    正在绘制、尚未凑满四个点的标注单独存放在 pending 中"""
+
+    def __init__(self, capacity=64, max_points=4):
+        self.max_points = max_points
+        self._quads = np.empty((capacity, max_points, 2), np.float32)
+        self._ids = np.empty(capacity, np.int32)
+        self.count = 0
+        self.pending = []  # [(x, y), ...]
+        self.pending_id = 0
+        self.version = 0  # 每次修改（含未完成的点）递增，供渲染缓存判断是否过期
+        self.structure_version = 0  # 只在已完成的四边形变化时递增，供索引和写盘判断
+
+    @property
+    def quads(self):
+        return self._quads[:self.count]
+
+    @property
+    def ids(self):
+        return self._ids[:self.count]
+
+    def __len__(self):
+        return self.count
+
+    def _touch(self, structural=True):
+        self.version += 1
+        if structural:
+            self.structure_version += 1
+
+    def _reserve(self, size):
+        if size <= len(self._ids):
+            return
+        capacity = max(size, len(self._ids) * 2)
+        quads = np.empty((capacity, self.max_points, 2), np.float32)
+        ids = np.empty(capacity, np.int32)
+        quads[:self.count] = self.quads
+        ids[:self.count] = self.ids
+        self._quads, self._ids = quads, ids
+
+    def add_point(self, point, class_id):
+        """追加一个点，凑满四个点时转入数组；返回该点是否补全了一个四边形"""
+        if not self.pending:
+            self.pending_id = class_id
+        self.pending.append(tuple(point))
+        completed = len(self.pending) == self.max_points
+        if completed:
+            self.insert(self.count, self.pending, self.pending_id)
+            self.pending = []
+        self._touch(structural=False)  # 补全时 insert 已更新结构版本
+        return completed
+
+    def remove_point(self):
+        """撤销最后一个点；若 pending 为空则把最后一个四边形拆回 pending"""
+        if not self.pending and self.count:
+            quad, class_id = self.delete(self.count - 1)
+            self.pending = [tuple(p) for p in quad.tolist()]
+            self.pending_id = int(class_id)
+        if self.pending:
+            self.pending.pop()
+        self._touch(structural=False)  # 拆回 pending 时 delete 已更新结构版本
+
+    def insert(self, index, quad, class_id):
+        self._reserve(self.count + 1)
+        self._quads[index+1:self.count+1] = self._quads[index:self.count]
+        self._ids[index+1:self.count+1] = self._ids[index:self.count]
+        self._quads[index] = quad
+        self._ids[index] = class_id
+        self.count += 1
+        self._touch()
+
+    def delete(self, index):
+        quad = self._quads[index].copy()
+        class_id = int(self._ids[index])
+        self._quads[index:self.count-1] = self._quads[index+1:self.count]
+        self._ids[index:self.count-1] = self._ids[index+1:self.count]
+        self.count -= 1
+        self._touch()
+        return quad, class_id
+
+    def set_id(self, index, class_id):
+        self._ids[index] = class_id
+        self._touch()
+
+    def get_vertex(self, index, vertex):
+        x, y = self._quads[index, vertex]
+        return (float(x), float(y))
+
+    def set_vertex(self, index, vertex, point):
+        self._quads[index, vertex] = point
+        self._touch()
+
+    def clear(self):
+        structural = self.count > 0
+        self.count = 0
+        self.pending = []
+        self._touch(structural)
+
+    def to_screen(self, scale, offset):
+        """一次性把所有四边形变换到屏幕坐标，返回 (N,4,2) int32"""
+        return (self.quads * scale + np.asarray(offset, np.float32)).astype(np.int32)
+
+    def pending_to_screen(self, scale, offset):
+        if not self.pending:
+            return np.empty((0, 2), np.int32)
+        pts = np.asarray(self.pending, np.float32)
+        return (pts * scale + np.asarray(offset, np.float32)).astype(np.int32)
@@ -0,0 +1,398 @@
+"""多人协同标注的本地任务服务器：按批租借图像，过期回收，标注经单一写入线程落盘
+
+用法:
+    python tasks.py serve IMAGE_DIR LABEL_DIR [--port 8765] [--ttl 600] [--max-lease 64]
+    python tasks.py simulate IMAGE_DIR [--clients 4] [--batch 8] [--delay 0.01]
+
+客户端（python main.py --server http://127.0.0.1:8765）与服务器共享文件系统，
+租约中返回的是图像的绝对路径。接口均为 JSON over HTTP：
+    POST /lease    {client, count}            -> {lease, expires, images: [{path, rel}]}
+    POST /renew    {lease}                    -> {expires}
+    POST /submit   {lease, client, rel, text} -> {ok}
+    POST /release  {lease, rels, status}      -> {ok}   未完成的图退回，status=skipped 则不再分配
+    GET  /status                              -> 各状态计数与活动租约
+/lease 的 count 须为正整数，超过服务器上限（--max-lease）时按上限分配。
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from dataset import DatasetIndex, label_path_for
+from writer import LabelWriter
+
+
+class TaskError(Exception):
+    pass
+
+
+class TaskState:
+    """服务器端状态：租约、图像归属；所有操作在一把锁内串行执行"""
+
+    def __init__(self, image_dir, label_dir, ttl=600, manifest_path=None, max_lease=64):
+        self.image_dir = os.path.abspath(image_dir)
+        self.label_dir = os.path.abspath(label_dir)
+        self.ttl = ttl
+        self.max_lease = max_lease  # 单次租借的图像数上限
+        self.dataset = DatasetIndex(image_dir, label_dir, manifest_path)
+        self.dataset.start_scan().join()
+        self.writer = LabelWriter()
+        self.leases = {}  # lease -> {'client', 'rels': set, 'expires'}
+        self.leased = {}  # rel -> lease
+        self.labeled_by = {}  # rel -> client，本次运行中由谁提交
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        for lease_id in [k for k, v in self.leases.items() if v['expires'] < now]:
+            self._drop(lease_id)
+
+    def _drop(self, lease_id):
+        lease = self.leases.pop(lease_id, None)
+        if lease:
+            for rel in lease['rels']:
+                self.leased.pop(rel, None)
+
+    def lease(self, client, count):
+        # bool 是 int 的子类，也要排除；count<=0 时下面的循环永远凑不满，会租出全部图像
+        if not isinstance(count, int) or isinstance(count, bool) or count < 1:
+            raise ValueError(f"count must be a positive integer, got {count!r}")
+        count = min(count, self.max_lease)
+        with self._lock:
+            now = time.time()
+            self._expire(now)
+            rels = []
+            # 顺着 (status, key) 索引取未标注且未被租出的图，代价与已租出数量加 count 成正比
+            for _, rel in self.dataset.iter_status('unlabeled'):
+                if rel not in self.leased:
+                    rels.append(rel)
+                    if len(rels) == count:
+                        break
+            if not rels:
+                return {'lease': None, 'images': []}
+            lease_id = uuid.uuid4().hex
+            self.leases[lease_id] = {'client': client, 'rels': set(rels),
+                                     'expires': now + self.ttl}
+            for rel in rels:
+                self.leased[rel] = lease_id
+            return {'lease': lease_id, 'expires': now + self.ttl,
+                    'images': [{'rel': rel, 'path': os.path.join(self.image_dir, rel)}
+                               for rel in rels]}
+
+    def renew(self, lease_id):
+        with self._lock:
+            lease = self.leases.get(lease_id)
+            if lease is None:
+                raise TaskError("lease expired")
+            lease['expires'] = time.time() + self.ttl
+            return {'expires': lease['expires']}
+
+    def submit(self, lease_id, client, rel, text):
+        with self._lock:
+            self._expire(time.time())
+            holder = self.leased.get(rel)
+            if holder is not None and holder != lease_id:
+                raise TaskError(f"{rel} is leased to another client")
+            path = os.path.join(self.image_dir, rel)
+            status = self.dataset.status(path)
+            if status is None:
+                raise TaskError(f"unknown image {rel}")
+            # 已被别人提交过的图不允许覆盖；自己提交过的可以再次修改
+            if status == 'labeled' and self.labeled_by.get(rel, client) != client:
+                raise TaskError(f"{rel} was labeled by another client")
+            label_path = label_path_for(path, self.image_dir, self.label_dir)
+            os.makedirs(os.path.dirname(label_path), exist_ok=True)
+            self.writer.submit(label_path, text)
+            self.dataset.set_status(path, 'labeled')
+            self.labeled_by[rel] = client
+            lease = self.leases.get(holder)
+            if lease is not None:
+                lease['rels'].discard(rel)
+                del self.leased[rel]
+                if not lease['rels']:
+                    del self.leases[holder]
+            return {'ok': True}
+
+    def release(self, lease_id, rels=None, status=None):
+        with self._lock:
+            lease = self.leases.get(lease_id)
+            if lease is None:
+                return {'ok': True}
+            for rel in list(lease['rels'] if rels is None else rels):
+                if rel not in lease['rels']:
+                    continue
+                lease['rels'].discard(rel)
+                del self.leased[rel]
+                if status == 'skipped':
+                    self.dataset.set_status(os.path.join(self.image_dir, rel), 'skipped')
+            if not lease['rels']:
+                del self.leases[lease_id]
+            return {'ok': True}
+
+    def status(self):
+        with self._lock:
+            self._expire(time.time())
+            return {'counts': self.dataset.counts(), 'leases': len(self.leases),
+                    'leased_images': len(self.leased), 'written': self.writer.written}
+
+    def close(self):
+        self.writer.close()
+        self.dataset.close()
+
+
+class TaskHandler(BaseHTTPRequestHandler):
+    state = None  # 由 make_server 设置
+
+    def _reply(self, code, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/status":
+            self._reply(200, self.state.status())
+        else:
+            self._reply(404, {'error': 'not found'})
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            req = json.loads(self.rfile.read(length) or b"{}")
+            if self.path == "/lease":
+                result = self.state.lease(req['client'], req.get('count', 8))
+            elif self.path == "/renew":
+                result = self.state.renew(req['lease'])
+            elif self.path == "/submit":
+                result = self.state.submit(req.get('lease'), req['client'], req['rel'],
+                                           req['text'])
+            elif self.path == "/release":
+                result = self.state.release(req['lease'], req.get('rels'), req.get('status'))
+            else:
+                return self._reply(404, {'error': 'not found'})
+        except TaskError as e:
+            return self._reply(409, {'error': str(e)})
+        except (KeyError, ValueError) as e:
+            return self._reply(400, {'error': f"bad request: {e}"})
+        self._reply(200, result)
+
+    def log_message(self, format, *args):
+        pass  # 请求量大时不刷屏
+
+
+def make_server(state, host="127.0.0.1", port=8765):
+    handler = type("BoundTaskHandler", (TaskHandler,), {'state': state})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+class TaskClient:
+    """任务服务器客户端：租约心跳续期，提交在后台串行发送，不阻塞界面"""
+
+    def __init__(self, url, client_id=None, timeout=10):
+        self.url = url.rstrip('/')
+        self.client_id = client_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.timeout = timeout
+        self.leases = {}  # lease -> 过期时间
+        self.lease_of = {}  # 绝对路径 -> (lease, rel)，提交后仍保留，改过的图可以再次提交
+        self.held = set()  # 当前租约下还没有提交或跳过的图像，重新租到时再次计入
+        self.errors = deque(maxlen=20)
+        self.failed = 0
+        self.submitted = 0
+        self._lock = threading.Lock()
+        self._sender = ThreadPoolExecutor(max_workers=1, thread_name_prefix="task-submit")
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+    def _call(self, path, payload=None):
+        data = None if payload is None else json.dumps(payload).encode()
+        request = urllib.request.Request(self.url + path, data=data,
+                                         headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            raise TaskError(json.loads(e.read() or b"{}").get('error', str(e)))
+
+    def lease(self, count=8):
+        """租一批图像，返回绝对路径列表（没有剩余时为空）"""
+        result = self._call("/lease", {'client': self.client_id, 'count': count})
+        if not result['lease']:
+            return []
+        with self._lock:
+            self.leases[result['lease']] = result['expires']
+            for image in result['images']:
+                self.lease_of[image['path']] = (result['lease'], image['rel'])
+                self.held.add(image['path'])
+        self._start_heartbeat(result['expires'] - time.time())
+        return [image['path'] for image in result['images']]
+
+    def _start_heartbeat(self, ttl):
+        if self._heartbeat is not None:
+            return
+        interval = max(1.0, ttl / 3)
+
+        def run():
+            while not self._stop.wait(interval):
+                with self._lock:
+                    leases = list(self.leases)
+                for lease_id in leases:
+                    try:
+                        self._call("/renew", {'lease': lease_id})
+                    except (TaskError, OSError):
+                        with self._lock:
+                            self.leases.pop(lease_id, None)
+                            # 租约已失效，其中的图像不再计为持有
+                            self.held -= {path for path, (lease, _) in self.lease_of.items()
+                                          if lease == lease_id}
+
+        self._heartbeat = threading.Thread(target=run, name="task-heartbeat", daemon=True)
+        self._heartbeat.start()
+
+    def owns(self, path):
+        return path in self.lease_of
+
+    def submit(self, path, text):
+        """异步提交一张图的标注"""
+        with self._lock:
+            lease_id, rel = self.lease_of[path]
+            self.held.discard(path)
+        return self._sender.submit(self._send, "/submit", {
+            'lease': lease_id, 'client': self.client_id, 'rel': rel, 'text': text})
+
+    def skip(self, path):
+        with self._lock:
+            lease_id, rel = self.lease_of[path]
+            self.held.discard(path)
+        return self._sender.submit(self._send, "/release", {
+            'lease': lease_id, 'rels': [rel], 'status': 'skipped'})
+
+    def _send(self, path, payload):
+        try:
+            self._call(path, payload)
+            if path == "/submit":
+                self.submitted += 1
+        except (TaskError, OSError) as e:
+            self.failed += 1
+            self.errors.append(f"{payload.get('rel') or payload.get('rels')}: {e}")
+            raise
+
+    def status_text(self):
+        if self.errors:
+            return f"Server error ({self.failed}): {self.errors[-1]}"
+        return f"Server: {self.submitted} submitted, {len(self.held)} leased"
+
+    def close(self):
+        """等待提交发完，并把未完成的租约退回"""
+        self._sender.shutdown(wait=True)
+        self._stop.set()
+        with self._lock:
+            leases = list(self.leases)
+        for lease_id in leases:
+            try:
+                self._call("/release", {'lease': lease_id})
+            except (TaskError, OSError):
+                pass
+
+
+def _simulated_annotator(url, batch, delay, results):
+    """模拟一个标注员：不断租图、"标注"、提交，直到没有剩余"""
+    client = TaskClient(url)
+    done = []
+    while True:
+        paths = client.lease(batch)
+        if not paths:
+            break
+        for path in paths:
+            time.sleep(delay)
+            client.submit(path, "0 0.1 0.1 0.2 0.1 0.2 0.2 0.1 0.2\n")
+            done.append(path)
+    client.close()
+    results.put((client.client_id, done, list(client.errors)))
+
+
+def simulate(image_dir, clients=4, batch=8, delay=0.01):
+    """本地起服务器和若干标注进程，验证无重复标注并给出吞吐"""
+    workdir = tempfile.mkdtemp(prefix="annotation-tasks-")
+    state = TaskState(image_dir, workdir, manifest_path=os.path.join(workdir, "manifest.sqlite"))
+    server = make_server(state, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    ctx = multiprocessing.get_context('spawn')
+    results = ctx.Queue()
+    start = time.perf_counter()
+    procs = [ctx.Process(target=_simulated_annotator, args=(url, batch, delay, results))
+             for _ in range(clients)]
+    for proc in procs:
+        proc.start()
+    outcomes = [results.get() for _ in procs]
+    for proc in procs:
+        proc.join()
+    elapsed = time.perf_counter() - start
+
+    labeled = [path for _, done, _ in outcomes for path in done]
+    errors = [e for _, _, errs in outcomes for e in errs]
+    status = state.status()
+    server.shutdown()
+    state.close()
+    shutil.rmtree(workdir, ignore_errors=True)
+    return {'clients': clients, 'images': len(labeled), 'unique': len(set(labeled)),
+            'errors': errors, 'counts': status['counts'], 'seconds': elapsed,
+            'images_per_sec': len(labeled) / elapsed if elapsed else 0.0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local task server for shared labeling")
+    sub = parser.add_subparsers(dest="command", required=True)
+    serve = sub.add_parser("serve")
+    serve.add_argument("image_dir")
+    serve.add_argument("label_dir")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8765)
+    serve.add_argument("--ttl", type=float, default=600, help="lease lifetime in seconds")
+    serve.add_argument("--max-lease", type=int, default=64, help="max images per lease")
+    sim = sub.add_parser("simulate")
+    sim.add_argument("image_dir")
+    sim.add_argument("--clients", type=int, nargs="+", default=[1, 2, 4])
+    sim.add_argument("--batch", type=int, default=8)
+    sim.add_argument("--delay", type=float, default=0.01,
+                     help="simulated labeling time per image in seconds")
+    args = parser.parse_args()
+
+    if args.command == "simulate":
+        for clients in args.clients:
+            r = simulate(args.image_dir, clients, args.batch, args.delay)
+            dup = r['images'] - r['unique']
+            print(f"{clients} clients: {r['images']} images in {r['seconds']:.2f}s "
+                  f"({r['images_per_sec']:.1f} images/sec), {r['counts']['labeled']} labeled, "
+                  f"duplicates {dup}, errors {len(r['errors'])}")
+        return
+
+    state = TaskState(args.image_dir, args.label_dir, args.ttl, max_lease=args.max_lease)
+    server = make_server(state, args.host, args.port)
+    print(f"Serving {len(state.dataset.files)} images on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        state.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import json
+import os
+import tarfile
+
+import cv2
+import numpy as np
+import pytest
+
+from export import STATE_FILE, Exporter
+from label_io import format_labels
+
+QUAD = np.array([[(1, 1), (6, 1), (6, 6), (1, 6)]], np.float32)
+
+
+@pytest.fixture
+def dataset(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # 标注缓存默认建在当前目录下
+    images, labels = tmp_path / "images", tmp_path / "labels"
+    images.mkdir()
+    labels.mkdir()
+    for i in range(8):
+        cv2.imwrite(str(images / f"{i}.png"), np.full((8, 8, 3), i, np.uint8))
+        if i != 7:  # 没有标注文件的图不导出
+            (labels / f"{i}.txt").write_text(format_labels([i % 2], QUAD, (8, 8)))
+    return str(images), str(labels), str(tmp_path / "out")
+
+
+def test_export_and_resume(dataset):
+    images, labels, out = dataset
+    stats = Exporter(images, labels, out, val_fraction=0.3, workers=2).export_shards(1024)
+    assert stats['samples'] == 7 and stats['skipped'] == 0
+    names = sorted(n for n in os.listdir(out) if n.endswith('.tar'))
+    members = []
+    for name in names:
+        with tarfile.open(os.path.join(out, name)) as tar:
+            members += tar.getnames()
+    assert len(names) > 2  # 分片足够小，每个只放一两张图
+    assert len(members) == 14 and "7.png" not in members
+    with open(os.path.join(out, STATE_FILE)) as f:
+        assert sorted(json.load(f)) == names
+
+    # 重新运行时摘要未变的分片全部跳过
+    stats = Exporter(images, labels, out, val_fraction=0.3, workers=2).export_shards(1024)
+    assert stats['shards'] == 0 and stats['skipped'] == len(names)
+
+    # 改动一个标注只重写它所在的分片
+    with open(os.path.join(labels, "0.txt"), 'a') as f:
+        f.write(format_labels([1], QUAD, (8, 8)))
+    stats = Exporter(images, labels, out, val_fraction=0.3, workers=2).export_shards(1024)
+    assert stats['shards'] == 1 and stats['skipped'] == len(names) - 1
+
+
+def test_coco_resume(dataset):
+    images, labels, out = dataset
+    stats = Exporter(images, labels, out, val_fraction=0.3, workers=2).export_coco(chunk_size=2)
+    assert stats['images'] == 7 and stats['annotations'] == 7
+    splits = [n for n in os.listdir(out) if n.endswith('.json') and n != STATE_FILE]
+    total = 0
+    for name in splits:
+        with open(os.path.join(out, name)) as f:
+            total += len(json.load(f)['images'])
+    assert total == 7
+
+    stats = Exporter(images, labels, out, val_fraction=0.3, workers=2).export_coco()
+    assert stats['images'] == 0 and stats['skipped'] == len(splits)
+
+    # 输出被删掉时即使摘要未变也要重新生成
+    os.remove(os.path.join(out, splits[0]))
+    stats = Exporter(images, labels, out, val_fraction=0.3, workers=2).export_coco()
+    assert stats['skipped'] == len(splits) - 1 and os.path.exists(os.path.join(out, splits[0]))
@@ -0,0 +1,71 @@
+import numpy as np
+
+from history import AddAnnotations, AddPoint, ChangeId, DeleteAnnotation, History, MoveVertex
+from store import AnnotationStore
+
+SQUARE = [(0, 0), (10, 0), (10, 10), (0, 10)]
+
+
+def snapshot(store):
+    return store.ids.tolist(), store.quads.tolist(), list(store.pending)
+
+
+def drawn(history, store, count=1):
+    for i in range(count):
+        for x, y in SQUARE:
+            history.execute(AddPoint((x + 20 * i, y), i), store)
+
+
+def test_undo_redo_round_trip():
+    store, history = AnnotationStore(), History()
+    drawn(history, store, 2)
+    states = [snapshot(store)]
+    commands = [DeleteAnnotation(0), ChangeId(0, 9), MoveVertex(0, 1, (30, 0), (35, 2)),
+                AddAnnotations(np.zeros((2, 4, 2), np.float32), [4, 5])]
+    for command in commands:
+        history.execute(command, store)
+        states.append(snapshot(store))
+    for expected in reversed(states[:-1]):
+        history.undo(store)
+        assert snapshot(store) == expected
+    for expected in states[1:]:
+        history.redo(store)
+        assert snapshot(store) == expected
+
+
+def test_execute_clears_redo():
+    store, history = AnnotationStore(), History()
+    history.execute(AddPoint((0, 0), 0), store)
+    history.undo(store)
+    assert history.peek_redo() is not None
+    history.execute(AddPoint((1, 1), 0), store)
+    assert history.peek_redo() is None and history.redo(store) is None
+    assert store.pending == [(1, 1)]
+
+
+def test_empty_stacks_return_none():
+    store, history = AnnotationStore(), History()
+    assert history.undo(store) is None and history.redo(store) is None
+    assert history.peek_undo() is None
+
+
+def test_capacity_drops_oldest():
+    store, history = AnnotationStore(), History(max_entries=3)
+    for i in range(5):
+        history.execute(AddPoint((i, i), 0), store)
+    while history.undo(store):
+        pass
+    assert store.pending == [(0, 0), (1, 1)]  # 最早的两步已被挤出，无法撤销
+
+
+def test_indices_cover_changed_quads():
+    store, history = AnnotationStore(), History()
+    drawn(history, store, 2)
+    command = history.peek_undo()
+    assert list(command.indices(store)) == [1]
+    history.undo(store)
+    assert list(command.indices(store)) == []  # 拆回 pending 后不再对应已完成的四边形
+    accept = AddAnnotations(np.zeros((3, 4, 2), np.float32), [0, 1, 2])
+    history.execute(accept, store)
+    assert list(accept.indices(store)) == [1, 2, 3]
+    assert DeleteAnnotation(2).indices(store) == [2]
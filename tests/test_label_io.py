@@ -0,0 +1,80 @@
+import os
+
+import numpy as np
+import pytest
+
+from label_io import LabelCache, format_labels, load_class_names, parse_labels, read_labels, \
+    write_labels
+
+QUADS = np.array([[(10, 20), (30, 20), (30, 60), (10, 60)],
+                  [(0, 0), (100, 0), (100, 50), (0, 50)]], np.float32)
+
+
+def test_format_parse_round_trip():
+    text = format_labels([3, 1], QUADS, (100, 200))
+    ids, quads = parse_labels(text)
+    assert ids.tolist() == [3, 1]
+    np.testing.assert_allclose(quads * (100, 200), QUADS, atol=1e-4)
+
+
+def test_parse_drops_misaligned_lines():
+    # 7 个字段的行加 11 个字段的行，总数是 9 的倍数，但两行都不完整
+    text = ("0 0.1 0.1 0.2 0.1 0.2\n"
+            "1 0.1 0.1 0.2 0.1 0.2 0.2 0.1 0.2 0.5 0.5\n"
+            "2 0.1 0.1 0.2 0.1 0.2 0.2 0.1 0.2\n"
+            "\n")
+    ids, quads = parse_labels(text)
+    assert ids.tolist() == [2] and quads.shape == (1, 4, 2)
+
+
+def test_parse_empty():
+    ids, quads = parse_labels("")
+    assert ids.shape == (0,) and quads.shape == (0, 4, 2)
+
+
+def test_parse_rejects_non_numeric():
+    with pytest.raises(ValueError):
+        parse_labels("a 0 0 0 0 0 0 0 0\n")
+
+
+def test_write_labels_atomic(tmp_path):
+    path = tmp_path / "sub" / "a.txt"
+    write_labels(str(path), [0, 1], QUADS, (100, 200))
+    ids, _ = read_labels(str(path))
+    assert ids.tolist() == [0, 1]
+    assert os.listdir(path.parent) == ["a.txt"]
+
+
+def test_load_class_names(tmp_path):
+    assert load_class_names("car, person,,") == ["car", "person"]
+    names = tmp_path / "names.txt"
+    names.write_text("car\n\nperson\n")
+    assert load_class_names(str(names)) == ["car", "person"]
+
+
+def write(path, text):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+
+
+def test_label_cache_incremental(tmp_path):
+    labels = tmp_path / "labels"
+    write(labels / "a.txt", format_labels([0], QUADS[:1], (100, 200)))
+    write(labels / "d" / "b.txt", format_labels([1, 2], QUADS, (100, 200)) + "5 1 2\n")
+    cache_dir = str(tmp_path / "cache")
+    cache = LabelCache(str(labels), cache_dir)
+    assert cache.update() == 2
+    assert cache.names == ["a.txt", os.path.join("d", "b.txt")]
+    assert cache.get(os.path.join("d", "b.txt"))[0].tolist() == [1, 2]
+    assert cache.get("missing.txt") is None
+    assert cache.malformed.tolist() == [0, 1]
+    assert cache.file_index().tolist() == [0, 1, 1]
+
+    # 重新打开时直接用磁盘上的缓存，未变化的文件不再解析
+    cache = LabelCache(str(labels), cache_dir)
+    assert len(cache) == 2 and cache.update() == 0
+    write(labels / "c.txt", "x y\nnot numbers at all 1 2 3 4 5\n")
+    assert cache.update() == 1
+    assert cache.get("c.txt")[0].tolist() == []
+    assert cache.malformed.tolist() == [0, -1, 1]  # 无法解析的文件整体记为 -1
+    assert cache.ids.tolist() == [0, 1, 2]
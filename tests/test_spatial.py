@@ -0,0 +1,58 @@
+import numpy as np
+
+from spatial import PointGrid, SpatialIndex, points_in_quads
+
+
+def square(x, y, size):
+    return [(x, y), (x + size, y), (x + size, y + size), (x, y + size)]
+
+
+def test_points_in_quads():
+    quads = np.array([square(0, 0, 10), square(5, 5, 10)], np.float32)
+    assert points_in_quads((7, 7), quads).tolist() == [True, True]
+    assert points_in_quads((2, 2), quads).tolist() == [True, False]
+    assert points_in_quads((20, 20), quads).tolist() == [False, False]
+
+
+def test_hit_test_matches_brute_force():
+    rng = np.random.default_rng(0)
+    origins = rng.uniform(0, 1000, (200, 2))
+    sizes = rng.uniform(5, 80, 200)
+    quads = np.array([square(x, y, s) for (x, y), s in zip(origins, sizes)], np.float32)
+    quads[0] = square(-50, -50, 2000)  # 覆盖格子过多，走 oversize 路径
+    index = SpatialIndex(cell_size=32, max_cells_per_quad=16)
+    index.build(quads)
+    assert 0 in index.oversize
+    for point in rng.uniform(-100, 1100, (300, 2)):
+        inside = np.flatnonzero(points_in_quads(point, quads))
+        expected = int(inside.min()) if len(inside) else -1
+        assert index.hit_test(point) == expected
+
+
+def test_hit_test_uses_ids():
+    index = SpatialIndex()
+    index.build(np.array([square(0, 0, 10)], np.float32), ids=[7])
+    assert index.hit_test((5, 5)) == 7
+    assert index.hit_test((50, 50)) == -1
+
+
+def test_empty_index():
+    index = SpatialIndex()
+    assert index.hit_test((0, 0)) == -1
+    assert index.nearest_vertex((0, 0), 10) is None
+
+
+def test_nearest_vertex():
+    index = SpatialIndex(cell_size=16)
+    index.build(np.array([square(0, 0, 10), square(100, 100, 10)], np.float32))
+    assert index.nearest_vertex((11, 1), 3) == (0, 1)
+    assert index.nearest_vertex((99, 111), 3) == (1, 3)
+    assert index.nearest_vertex((50, 50), 3) is None
+
+
+def test_point_grid_nearest():
+    grid = PointGrid([(0, 0), (10, 10), (10.5, 9)], cell_size=4)
+    assert len(grid) == 3
+    assert grid.nearest((10.4, 9.2), 2) == (10.5, 9.0)
+    assert grid.nearest((30, 30), 5) is None
+    assert PointGrid(np.empty((0, 2))).nearest((0, 0), 5) is None
@@ -0,0 +1,83 @@
+import numpy as np
+
+from store import AnnotationStore
+
+SQUARE = [(0, 0), (10, 0), (10, 10), (0, 10)]
+
+
+def add_quad(store, points=SQUARE, class_id=0):
+    for point in points:
+        completed = store.add_point(point, class_id)
+    return completed
+
+
+def test_add_point_completes_quad():
+    store = AnnotationStore()
+    assert not store.add_point((0, 0), 3)
+    assert store.pending == [(0, 0)] and len(store) == 0
+    assert add_quad(store, SQUARE[1:], class_id=7)
+    assert len(store) == 1 and store.pending == []
+    assert store.ids.tolist() == [3]  # 取第一个点时的 ID
+    np.testing.assert_array_equal(store.quads[0], SQUARE)
+
+
+def test_structure_version_ignores_pending_points():
+    store = AnnotationStore()
+    store.add_point((0, 0), 0)
+    store.add_point((1, 0), 0)
+    assert store.version == 2 and store.structure_version == 0
+    store.add_point((1, 1), 0)
+    store.add_point((0, 1), 0)
+    assert store.structure_version == 1
+    store.remove_point()  # 拆回 pending 也改变了已完成的四边形
+    assert len(store) == 0 and len(store.pending) == 3
+    assert store.structure_version == 2
+
+
+def test_remove_point_splits_last_quad():
+    store = AnnotationStore()
+    add_quad(store, class_id=5)
+    store.remove_point()
+    assert store.pending == SQUARE[:3] and store.pending_id == 5
+
+
+def test_insert_delete_keep_order_and_grow():
+    store = AnnotationStore(capacity=2)
+    for i in range(5):
+        store.insert(len(store), np.full((4, 2), i, np.float32), i)
+    store.insert(0, np.full((4, 2), 9, np.float32), 9)
+    assert store.ids.tolist() == [9, 0, 1, 2, 3, 4]
+    quad, class_id = store.delete(2)
+    assert class_id == 1 and quad[0].tolist() == [1, 1]
+    assert store.ids.tolist() == [9, 0, 2, 3, 4]
+    assert store.quads[:, 0, 0].tolist() == [9, 0, 2, 3, 4]
+
+
+def test_vertex_and_id_edits():
+    store = AnnotationStore()
+    add_quad(store)
+    store.set_vertex(0, 2, (12.5, 11))
+    store.set_id(0, 4)
+    assert store.get_vertex(0, 2) == (12.5, 11.0)
+    assert store.ids.tolist() == [4]
+
+
+def test_clear_only_structural_when_not_empty():
+    store = AnnotationStore()
+    store.add_point((0, 0), 0)
+    store.clear()
+    assert store.structure_version == 0 and store.pending == []
+    add_quad(store)
+    before = store.structure_version
+    store.clear()
+    assert len(store) == 0 and store.structure_version == before + 1
+
+
+def test_to_screen():
+    store = AnnotationStore()
+    add_quad(store)
+    screen = store.to_screen(2.0, (5, 1))
+    assert screen.dtype == np.int32
+    assert screen[0].tolist() == [[5, 1], [25, 1], [25, 21], [5, 21]]
+    store.add_point((3, 4), 0)
+    assert store.pending_to_screen(2.0, (5, 1)).tolist() == [[11, 9]]
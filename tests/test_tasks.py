@@ -0,0 +1,81 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from tasks import TaskError, TaskState
+
+
+@pytest.fixture
+def state(tmp_path):
+    images = tmp_path / "images"
+    images.mkdir()
+    for i in range(6):
+        cv2.imwrite(str(images / f"{i}.png"), np.zeros((4, 4, 3), np.uint8))
+    state = TaskState(str(images), str(tmp_path / "labels"),
+                      manifest_path=str(tmp_path / "manifest.sqlite"), max_lease=4)
+    yield state
+    state.writer.close()
+    state.dataset.close()
+
+
+def rels(result):
+    return [image['rel'] for image in result['images']]
+
+
+def test_leases_do_not_overlap(state):
+    a = state.lease("a", 2)
+    b = state.lease("b", 2)
+    assert rels(a) == ["0.png", "1.png"] and rels(b) == ["2.png", "3.png"]
+    assert a['lease'] != b['lease']
+
+
+@pytest.mark.parametrize("count", [0, -1, 2.5, "2", True, None])
+def test_lease_rejects_bad_count(state, count):
+    with pytest.raises(ValueError):
+        state.lease("a", count)
+    assert not state.leases
+
+
+def test_lease_count_is_capped(state):
+    assert len(rels(state.lease("a", 100))) == 4
+    assert len(rels(state.lease("b", 100))) == 2
+    assert state.lease("c", 1) == {'lease': None, 'images': []}
+
+
+def test_expired_lease_is_reclaimed(state):
+    first = state.lease("a", 2)
+    state.leases[first['lease']]['expires'] = 0
+    assert rels(state.lease("b", 2)) == rels(first)
+    with pytest.raises(TaskError):
+        state.renew(first['lease'])
+
+
+def test_submit_writes_label_and_closes_lease(state):
+    lease = state.lease("a", 1)
+    state.submit(lease['lease'], "a", "0.png", "0 0 0 1 0 1 1 0 1\n")
+    state.writer.flush()
+    with open(os.path.join(state.label_dir, "0.txt")) as f:
+        assert f.read().startswith("0 ")
+    assert not state.leases
+    assert rels(state.lease("b", 1)) == ["1.png"]  # 已标注的图不再租出
+    with pytest.raises(TaskError):
+        state.submit(None, "b", "0.png", "")  # 别人提交过的不允许覆盖
+    state.submit(None, "a", "0.png", "")
+
+
+def test_submit_rejects_image_leased_to_another(state):
+    state.lease("a", 1)
+    with pytest.raises(TaskError):
+        state.submit(None, "b", "0.png", "")
+    with pytest.raises(TaskError):
+        state.submit(None, "b", "missing.png", "")
+
+
+def test_release_and_skip(state):
+    lease = state.lease("a", 3)
+    state.release(lease['lease'], ["0.png"], status='skipped')
+    state.release(lease['lease'], ["1.png"])
+    assert rels(state.lease("b", 2)) == ["1.png", "3.png"]
+    assert state.dataset.status(os.path.join(state.image_dir, "0.png")) == 'skipped'
@@ -0,0 +1,66 @@
+import os
+import threading
+
+from writer import LabelWriter
+
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+
+def load(writer, path):
+    done = threading.Event()
+    out = []
+    writer.load(path, read, lambda result, error: (out.append((result, error)), done.set()))
+    assert done.wait(5)
+    return out[0]
+
+
+def test_atomic_replace_and_directories(tmp_path):
+    writer = LabelWriter(fsync_interval=60)
+    path = str(tmp_path / "a" / "b" / "x.txt")
+    try:
+        writer.submit(path, "old")
+        writer.submit(path, "new")
+        assert writer.flush(timeout=5)
+        assert read(path) == "new"
+        assert os.listdir(os.path.dirname(path)) == ["x.txt"]  # 不留临时文件
+        assert writer.written >= 1 and writer.failed == 0
+    finally:
+        writer.close()
+
+
+def test_load_sees_uncommitted_writes(tmp_path):
+    # fsync 间隔很长，读取时写入还在批次里、只在临时文件中
+    writer = LabelWriter(fsync_interval=60)
+    path = str(tmp_path / "x.txt")
+    try:
+        assert load(writer, path) == (None, None)
+        writer.submit(path, "hello")
+        assert load(writer, path) == ("hello", None)
+    finally:
+        writer.close()
+    assert read(path) == "hello"
+
+
+def test_only_existing(tmp_path):
+    writer = LabelWriter()
+    missing = str(tmp_path / "missing.txt")
+    present = tmp_path / "present.txt"
+    present.write_text("1 2 3")
+    writer.submit(missing, "", only_existing=True)
+    writer.submit(str(present), "", only_existing=True)
+    writer.close()
+    assert not os.path.exists(missing)
+    assert present.read_text() == ""
+
+
+def test_failure_is_recorded(tmp_path):
+    blocker = tmp_path / "file"
+    blocker.write_text("")
+    writer = LabelWriter()
+    writer.submit(str(blocker / "x.txt"), "text")  # 父路径是文件，无法创建目录
+    writer.close()
+    assert writer.failed == 1
+    assert writer.status_text().startswith("Write failed (1)")
@@ -0,0 +1,180 @@
+import math
+import os
+import tempfile
+import threading
+
+import cv2
+import numpy as np
+import pygame
+
+from prefetch import REDUCED_FLAGS, LRUCache
+
+
+class TilePyramid:
+    """多分辨率瓦片金字塔，按需解码、按需切片，只生成可见瓦片
+
+    传入 submit（如 ImagePrefetcher.submit）时各层在后台解码，render_view 不会阻塞，
+    所需的层就绪前先用已有的最接近的层代替，就绪后调用 on_ready()"""
+
+    def __init__(self, path, image_size, tile_size=512, cache_bytes=128 * 1024 * 1024,
+                 read=None, submit=None, on_ready=None):
+        self.path = path
+        self.read = read  # 自定义解码函数（如视频帧源），此时不能按缩小比例解码
+        self.submit = submit
+        self.on_ready = on_ready
+        self.image_size = image_size
+        self.tile_size = tile_size
+        self.tiles = LRUCache(cache_bytes)
+        self.levels = {}
+        self.memmap_path = None
+        self.closed = False
+        self._pending = {}  # 层号 -> 后台解码任务
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()  # 各层可能递归依赖同一个全分辨率层，串行构建
+
+        # 最粗一级不超过一个瓦片
+        self.max_level = 0
+        longest = max(image_size)
+        while longest / 2 ** self.max_level > tile_size:
+            self.max_level += 1
+
+    def level_for_scale(self, scale):
+        """选取分辨率不低于屏幕显示所需的最粗一级"""
+        if scale >= 1:
+            return 0
+        level = int(math.floor(math.log2(1 / scale)))
+        return min(level, self.max_level)
+
+    def level_array(self, level):
+        arr = self.levels.get(level)
+        if arr is not None:
+            return arr
+
+        if level == 0:
+            arr = self._decode_full()
+        elif 2 ** level in REDUCED_FLAGS and self.read is None:
+            arr = cv2.imread(self.path, REDUCED_FLAGS[2 ** level])
+            if arr is None:
+                arr = self._downscale(self.level_array(level - 1))
+        else:
+            arr = self._downscale(self.level_array(level - 1))
+        self.levels[level] = arr
+        return arr
+
+    def ready_level(self, level):
+        """返回现在就能用来绘制的层：所需层未就绪时提交后台解码，
+        先退回已就绪的最接近的层（同样接近时取更精细的），一层都没有时返回 None"""
+        if level in self.levels or self.submit is None:
+            return level
+        with self._lock:
+            if level not in self._pending:
+                self._pending[level] = self.submit(self._build, level)
+        if not self.levels:
+            return None
+        return min(self.levels, key=lambda l: (abs(l - level), l))
+
+    def _build(self, level):
+        try:
+            with self._build_lock:
+                if not self.closed:
+                    self.level_array(level)
+        finally:
+            with self._lock:
+                self._pending.pop(level, None)
+        if self.closed:
+            self._remove_memmap()  # 解码期间已经关闭，丢弃刚写好的临时文件
+        elif self.on_ready:
+            self.on_ready()
+
+    def _downscale(self, arr):
+        h, w = arr.shape[:2]
+        return cv2.resize(arr, (max(1, w // 2), max(1, h // 2)),
+                          interpolation=cv2.INTER_AREA)
+
+    def _decode_full(self):
+        """全分辨率只解码一次，写入临时文件后以内存映射方式读取，交由页缓存管理"""
+        bgr = cv2.imread(self.path) if self.read is None else self.read(self.path)
+        if bgr is None:
+            raise IOError(f"Failed to read {self.path}")
+        fd, self.memmap_path = tempfile.mkstemp(suffix='.tiles')
+        os.close(fd)
+        mm = np.memmap(self.memmap_path, dtype=np.uint8, mode='w+', shape=bgr.shape)
+        mm[:] = bgr
+        mm.flush()
+        shape = bgr.shape
+        del mm, bgr
+        return np.memmap(self.memmap_path, dtype=np.uint8, mode='r', shape=shape)
+
+    def tile(self, level, tx, ty):
+        key = (level, tx, ty)
+        cached = self.tiles.get(key)
+        if cached is not None:
+            return cached[0]
+
+        arr = self.level_array(level)
+        size = self.tile_size
+        block = arr[ty*size:(ty+1)*size, tx*size:(tx+1)*size]
+        rgb = cv2.cvtColor(np.ascontiguousarray(block), cv2.COLOR_BGR2RGB)
+        surface = pygame.image.frombuffer(rgb.data, (rgb.shape[1], rgb.shape[0]), 'RGB')
+        # frombuffer 不复制数据，缓存时一并保留数组
+        self.tiles.put(key, (surface, rgb), rgb.nbytes)
+        return surface
+
+    def render_view(self, surface, scale, offset, view_rect):
+        """把 view_rect 内可见的瓦片按 screen = image * scale + offset 画到 surface 上；
+        后台解码时还没有任何一层可用则什么都不画并返回 False"""
+        level = self.ready_level(self.level_for_scale(scale))
+        if level is None:
+            return False
+        arr = self.level_array(level)
+        level_h, level_w = arr.shape[:2]
+        img_w, img_h = self.image_size
+        fx = level_w / img_w
+        fy = level_h / img_h
+        ox, oy = offset
+
+        # 可见区域换算到当前层的像素坐标
+        vx0 = max(0, int((view_rect.left - ox) / scale * fx))
+        vy0 = max(0, int((view_rect.top - oy) / scale * fy))
+        vx1 = min(level_w, int(math.ceil((view_rect.right - ox) / scale * fx)))
+        vy1 = min(level_h, int(math.ceil((view_rect.bottom - oy) / scale * fy)))
+        if vx0 >= vx1 or vy0 >= vy1:
+            return True
+
+        size = self.tile_size
+        for ty in range(vy0 // size, (vy1 - 1) // size + 1):
+            for tx in range(vx0 // size, (vx1 - 1) // size + 1):
+                tile = self.tile(level, tx, ty)
+                # 只裁出瓦片中可见的部分再缩放，避免放大整块瓦片
+                lx0 = max(vx0, tx * size)
+                ly0 = max(vy0, ty * size)
+                lx1 = min(vx1, tx * size + tile.get_width())
+                ly1 = min(vy1, ty * size + tile.get_height())
+                sx0 = round(lx0 / fx * scale + ox)
+                sy0 = round(ly0 / fy * scale + oy)
+                sx1 = round(lx1 / fx * scale + ox)
+                sy1 = round(ly1 / fy * scale + oy)
+                if sx1 <= sx0 or sy1 <= sy0:
+                    continue
+                part = tile.subsurface((lx0 - tx * size, ly0 - ty * size,
+                                        lx1 - lx0, ly1 - ly0))
+                surface.blit(pygame.transform.scale(part, (sx1 - sx0, sy1 - sy0)),
+                             (sx0, sy0))
+        return True
+
+    def close(self):
+        self.closed = True
+        with self._lock:
+            for future in self._pending.values():
+                future.cancel()
+        self.tiles.clear()
+        self.levels.clear()
+        self._remove_memmap()
+
+    def _remove_memmap(self):
+        if self.memmap_path:
+            try:
+                os.remove(self.memmap_path)
+            except OSError:
+                pass
+        self.memmap_path = None
@@ -0,0 +1,203 @@
+"""四点标注数据集校验：对整个标注目录做批量几何检查并输出 JSON 报告和各类别统计
+
+用法:
+    python validate.py LABEL_DIR [--report report.json] [--iou 0.9] [--workers 4]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from label_io import LabelCache
+
+# 逐条标注的问题，按位存放在 uint8 掩码中
+ISSUES = ('out_of_range', 'degenerate', 'non_convex', 'self_intersecting', 'winding', 'duplicate')
+BIT = {name: 1 << i for i, name in enumerate(ISSUES)}
+
+AREA_BINS = np.logspace(-6, 0, 13)
+ASPECT_BINS = np.array([1, 1.25, 1.5, 2, 2.5, 3, 4, 5, 6, 8, 10, np.inf])
+
+
+def _cross(a, b):
+    return a[..., 0] * b[..., 1] - a[..., 1] * b[..., 0]
+
+
+def _segments_cross(p1, p2, q1, q2):
+    """两组线段是否严格相交（不含端点接触）"""
+    d1 = _cross(q2 - q1, p1 - q1)
+    d2 = _cross(q2 - q1, p2 - q1)
+    d3 = _cross(p2 - p1, q1 - p1)
+    d4 = _cross(p2 - p1, q2 - p1)
+    return (d1 * d2 < 0) & (d3 * d4 < 0)
+
+
+def quad_geometry(quads, min_area=1e-6):
+    """对 (N,4,2) 四边形做向量化几何检查，返回 (有符号面积, 长宽比, 问题掩码)"""
+    quads = np.asarray(quads, np.float64)
+    edges = np.roll(quads, -1, axis=1) - quads
+    # 鞋带公式；图像坐标系 y 向下，面积为正表示屏幕上顺时针
+    area = 0.5 * _cross(quads, np.roll(quads, -1, axis=1)).sum(axis=1)
+
+    lengths = np.hypot(edges[..., 0], edges[..., 1])
+    side_a = (lengths[:, 0] + lengths[:, 2]) / 2
+    side_b = (lengths[:, 1] + lengths[:, 3]) / 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        aspect = np.maximum(side_a, side_b) / np.minimum(side_a, side_b)
+
+    turns = _cross(edges, np.roll(edges, -1, axis=1))
+    convex = (turns > 0).all(axis=1) | (turns < 0).all(axis=1)
+    crossing = _segments_cross(quads[:, 0], quads[:, 1], quads[:, 2], quads[:, 3]) | \
+        _segments_cross(quads[:, 1], quads[:, 2], quads[:, 3], quads[:, 0])
+
+    flags = np.zeros(len(quads), np.uint8)
+    flags[((quads < 0) | (quads > 1)).any(axis=(1, 2))] |= BIT['out_of_range']
+    degenerate = np.abs(area) < min_area
+    flags[degenerate] |= BIT['degenerate']
+    flags[~convex & ~crossing & ~degenerate] |= BIT['non_convex']
+    flags[crossing] |= BIT['self_intersecting']
+    return area, aspect, flags
+
+
+def file_pairs(offsets):
+    """同一文件内所有标注两两组合 (i, j), i < j，全部向量化生成"""
+    counts = np.diff(offsets)
+    owner = np.repeat(np.arange(len(counts)), counts)
+    local = np.arange(offsets[-1]) - offsets[:-1][owner]
+    partners = counts[owner] - 1 - local
+    first = np.repeat(np.arange(offsets[-1]), partners)
+    run_start = np.repeat(np.cumsum(partners) - partners, partners)
+    second = first + 1 + (np.arange(len(first)) - run_start)
+    return first, second
+
+
+def duplicate_pairs(quads, offsets, iou_thres=0.9):
+    """同文件内外接框 IoU 超过阈值的标注对，视为重复标注"""
+    i, j = file_pairs(offsets)
+    if not len(i):
+        return i, j
+    mins, maxs = quads.min(axis=1), quads.max(axis=1)
+    inter = np.clip(np.minimum(maxs[i], maxs[j]) - np.maximum(mins[i], mins[j]), 0, None)
+    inter = inter[:, 0] * inter[:, 1]
+    box = (maxs - mins).prod(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        iou = inter / (box[i] + box[j] - inter)
+    dup = iou > iou_thres
+    return i[dup], j[dup]
+
+
+def _histograms(values, ids, classes, bins):
+    counts = {}
+    for class_id in classes:
+        hist, _ = np.histogram(values[(ids == class_id) & np.isfinite(values)], bins)
+        counts[int(class_id)] = hist.tolist()
+    return counts
+
+
+def validate(label_dir, iou_thres=0.9, min_area=1e-6, workers=4, chunk=1 << 17):
+    cache = LabelCache(label_dir)
+    cache.update()
+    ids, quads = np.asarray(cache.ids), np.asarray(cache.quads)
+    offsets = np.asarray(cache.offsets)
+
+    # 分块在线程池中计算，大数组上的 numpy 运算会释放 GIL
+    n = len(ids)
+    bounds = [(lo, min(lo + chunk, n)) for lo in range(0, n, chunk)]
+    area = np.empty(n)
+    aspect = np.empty(n)
+    flags = np.empty(n, np.uint8)
+
+    def run(bound):
+        lo, hi = bound
+        area[lo:hi], aspect[lo:hi], flags[lo:hi] = quad_geometry(quads[lo:hi], min_area)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(run, bounds))
+
+    # 绕向以数据集多数为准，少数派记为问题
+    valid = (flags & (BIT['degenerate'] | BIT['self_intersecting'])) == 0
+    clockwise = area > 0
+    majority_cw = clockwise[valid].sum() * 2 >= valid.sum()
+    flags[valid & (clockwise != majority_cw)] |= BIT['winding']
+
+    dup_i, dup_j = duplicate_pairs(quads, offsets, iou_thres)
+    flags[dup_j] |= BIT['duplicate']
+
+    owner = cache.file_index()
+    local = np.arange(n) - offsets[:-1][owner]
+    flagged = np.flatnonzero(flags)
+    issues = [{'file': cache.names[f], 'index': int(k),
+               'issues': [name for name in ISSUES if bits & BIT[name]]}
+              for f, k, bits in zip(owner[flagged].tolist(), local[flagged].tolist(),
+                                    flags[flagged].tolist())]
+    duplicates = [{'file': cache.names[f], 'index': int(a), 'duplicate_of': int(b)}
+                  for f, a, b in zip(owner[dup_j].tolist(), local[dup_j].tolist(),
+                                     local[dup_i].tolist())]
+    malformed = np.asarray(cache.malformed)
+    bad_files = [{'file': cache.names[f], 'malformed_lines': int(malformed[f])
+                  if malformed[f] > 0 else 'unreadable'}
+                 for f in np.flatnonzero(malformed).tolist()]
+
+    classes, class_counts = np.unique(ids, return_counts=True)
+    abs_area = np.abs(area)
+    per_class = {}
+    for class_id, count in zip(classes.tolist(), class_counts.tolist()):
+        mask = ids == class_id
+        per_class[class_id] = {
+            'count': count,
+            'area_mean': float(abs_area[mask].mean()),
+            'area_median': float(np.median(abs_area[mask])),
+            'issues': int(np.count_nonzero(flags[mask])),
+        }
+    area_hist = _histograms(abs_area, ids, classes, AREA_BINS)
+    aspect_hist = _histograms(aspect, ids, classes, ASPECT_BINS)
+    for class_id in per_class:
+        per_class[class_id]['area_hist'] = area_hist[class_id]
+        per_class[class_id]['aspect_hist'] = aspect_hist[class_id]
+
+    return {
+        'label_dir': cache.label_dir,
+        'files': len(cache),
+        'quads': n,
+        'winding': 'clockwise' if majority_cw else 'counterclockwise',
+        'summary': {name: int(np.count_nonzero(flags & BIT[name])) for name in ISSUES},
+        'malformed_files': bad_files,
+        'issues': issues,
+        'duplicates': duplicates,
+        'classes': per_class,
+        'bins': {'area': AREA_BINS.tolist(), 'aspect': ASPECT_BINS[:-1].tolist() + ['inf']},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Validate a four-point label folder")
+    parser.add_argument("label_dir")
+    parser.add_argument("--report", help="write the JSON report here")
+    parser.add_argument("--iou", type=float, default=0.9, help="duplicate IoU threshold")
+    parser.add_argument("--min-area", type=float, default=1e-6,
+                        help="normalized area below which a quad is degenerate")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    report = validate(args.label_dir, args.iou, args.min_area, args.workers)
+    elapsed = time.perf_counter() - start
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=1)
+    print(f"{report['files']} files, {report['quads']} quads checked in {elapsed:.2f}s")
+    for name, count in report['summary'].items():
+        if count:
+            print(f"  {name}: {count}")
+    if report['malformed_files']:
+        print(f"  malformed files: {len(report['malformed_files'])}")
+    failed = any(report['summary'].values()) or report['malformed_files']
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""把视频文件当作帧序列来标注：按需解码，不再先把每一帧导出成 JPEG
+
+帧的"路径"是 <视频路径>/<帧号:06d>，与图像目录下的文件一样作为键使用，
+标注因此按帧写成 <标注目录>/<帧号:06d>.txt（YOLO 四点格式）。
+首次打开时在后台顺序扫描一遍，记录准确的帧数和关键帧位置并持久化，
+之后随机跳转时据此选择向前解码还是定位到关键帧。
+"""
+import bisect
+import hashlib
+import os
+import threading
+from collections.abc import Sequence
+
+import cv2
+import numpy as np
+
+VIDEO_EXTS = ('mp4', 'avi', 'mov', 'mkv', 'webm', 'm4v', 'mpg', 'mpeg')
+
+
+def is_video(path):
+    return os.path.isfile(path) and path.lower().rsplit('.', 1)[-1] in VIDEO_EXTS
+
+
+def frame_name(frame):
+    return f"{frame:06d}"
+
+
+class FrameIndex:
+    """一次顺序扫描得到的帧数与关键帧帧号"""
+
+    def __init__(self, count, keyframes):
+        self.count = count
+        self.keyframes = keyframes  # 升序帧号列表
+
+    def keyframe_before(self, frame):
+        """不晚于 frame 的最近关键帧"""
+        i = bisect.bisect_right(self.keyframes, frame)
+        return self.keyframes[i - 1] if i else 0
+
+    def save(self, path):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, count=self.count, keyframes=np.asarray(self.keyframes, np.int64))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(int(data['count']), data['keyframes'].tolist())
+
+
+def build_index(video_path, stop=None):
+    """顺序 grab 一遍（不做颜色转换），记录帧数和关键帧；stop 被置位时返回 None"""
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise IOError(f"Failed to open {video_path}")
+    count = 0
+    keyframes = []
+    try:
+        while cap.grab():
+            # 后端不支持关键帧标记时得到 0/-1，此时只记录帧数
+            if cap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME) > 0:
+                keyframes.append(count)
+            count += 1
+            if stop is not None and count % 256 == 0 and stop.is_set():
+                return None
+    finally:
+        cap.release()
+    return FrameIndex(count, keyframes)
+
+
+class FrameList(Sequence):
+    """按步长采样的帧路径序列，按需生成，长视频也只占常数内存"""
+
+    def __init__(self, source):
+        self.source = source
+
+    def __len__(self):
+        return (self.source.count + self.source.stride - 1) // self.source.stride
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return os.path.join(self.source.path, frame_name(i * self.source.stride))
+
+
+class _Reader:
+    def __init__(self, path):
+        self.cap = cv2.VideoCapture(path)
+        self.pos = 0  # 下一次 read 将得到的帧号
+        self.busy = False
+
+
+class VideoSource:
+    """视频帧源：若干个解码器供预取线程并发使用，每个解码器尽量顺序向前读"""
+
+    SEEK_COST = 8  # 一次定位的固定开销，折合成解码帧数
+
+    def __init__(self, path, stride=1, readers=2,
+                 cache_dir=os.path.join(".annotation_cache", "video"), on_indexed=None):
+        self.path = os.path.abspath(path)
+        self.stride = max(1, stride)
+        self.on_indexed = on_indexed
+        self.error = None
+        probe = cv2.VideoCapture(self.path)
+        if not probe.isOpened():
+            raise IOError(f"Failed to open {path}")
+        self.fps = probe.get(cv2.CAP_PROP_FPS) or 0.0
+        # 容器头里的帧数只是估计值，建好索引后以扫描结果为准
+        self.count = max(0, int(probe.get(cv2.CAP_PROP_FRAME_COUNT)))
+        probe.release()
+        self.frames = FrameList(self)
+
+        stat = os.stat(self.path)
+        key = hashlib.sha1(f"{self.path}|{stat.st_size}|{stat.st_mtime_ns}".encode()).hexdigest()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.index_path = os.path.join(cache_dir, f"{key}.npz")
+        self.index = None
+        self._stop = threading.Event()
+        self._indexer = None
+        try:
+            self._set_index(FrameIndex.load(self.index_path))
+        except (OSError, ValueError, KeyError):
+            self._indexer = threading.Thread(target=self._build_index, name="video-index",
+                                             daemon=True)
+            self._indexer.start()
+
+        self._readers = [_Reader(self.path) for _ in range(max(1, readers))]
+        self._cond = threading.Condition()
+
+    def _set_index(self, index):
+        self.index = index
+        self.count = index.count
+
+    def _build_index(self):
+        try:
+            index = build_index(self.path, self._stop)
+        except Exception as e:
+            self.error = str(e) or type(e).__name__
+            return
+        if index is None:
+            return
+        index.save(self.index_path)
+        self._set_index(index)
+        if self.on_indexed:
+            self.on_indexed()
+
+    def frame_of(self, path):
+        """帧路径 -> 帧号"""
+        return int(os.path.basename(path))
+
+    def _plan(self, reader, frame):
+        """从 reader 当前位置读到 frame 的方案：(大约要解码的帧数, 是否需要定位)"""
+        ahead = frame - reader.pos
+        if self.index is None:
+            # 还不知道关键帧在哪：近处顺序向前读，远处交给 FFmpeg 定位
+            if 0 <= ahead <= self.SEEK_COST:
+                return ahead, False
+            return self.SEEK_COST, True
+        # 定位本身有固定开销，之后 FFmpeg 从之前的关键帧解码到目标帧
+        seek_cost = self.SEEK_COST + frame - self.index.keyframe_before(frame)
+        if 0 <= ahead <= seek_cost:
+            return ahead, False
+        return seek_cost, True
+
+    def read(self, path):
+        """解码一帧，返回 BGR 数组；失败返回 None。可在多个线程中同时调用"""
+        frame = self.frame_of(path)
+        with self._cond:
+            while all(r.busy for r in self._readers):
+                self._cond.wait()
+            reader = min((r for r in self._readers if not r.busy),
+                         key=lambda r: self._plan(r, frame)[0])
+            reader.busy = True
+            _, seek = self._plan(reader, frame)
+        try:
+            if seek:
+                reader.cap.set(cv2.CAP_PROP_POS_FRAMES, frame)
+                reader.pos = frame
+            while reader.pos < frame:
+                if not reader.cap.grab():
+                    return None
+                reader.pos += 1
+            ok, bgr = reader.cap.read()
+            if not ok:
+                return None
+            reader.pos += 1
+            return bgr
+        finally:
+            with self._cond:
+                reader.busy = False
+                self._cond.notify_all()
+
+    def first_unlabeled(self, label_dir):
+        """第一个没有标注文件的采样帧在 frames 中的序号"""
+        if not label_dir or not os.path.isdir(label_dir):
+            return 0
+        labeled = {name[:-4] for name in os.listdir(label_dir) if name.endswith('.txt')}
+        for i in range(len(self.frames)):
+            if frame_name(i * self.stride) not in labeled:
+                return i
+        return 0
+
+    def status_text(self):
+        if self.index is None:
+            return f"{len(self.frames)} frames (indexing...)"
+        return f"{len(self.frames)} frames, {len(self.index.keyframes)} keyframes"
+
+    def close(self):
+        self._stop.set()
+        if self._indexer is not None:
+            self._indexer.join()
+        with self._cond:
+            while any(r.busy for r in self._readers):
+                self._cond.wait()
+            for reader in self._readers:
+                reader.cap.release()
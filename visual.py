@@ -1,72 +1,226 @@
-import cv2 as cv
+"""标注可视化：单张查看，或对整个目录批量渲染为标注图、拼图或 MP4 审阅视频
+
+用法:
+    python visual.py IMAGE LABEL
+    python visual.py IMAGE_DIR LABEL_DIR --out OUT [--mode images|sheet|video] [--workers 4]
+"""
+import argparse
+import multiprocessing
 import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2 as cv
 import numpy as np
 
+from dataset import iter_images, label_path_for
+from label_io import read_labels
+
+LINE_COLOR = (0, 255, 0)
+POINT_COLOR = (255, 0, 0)
+
+
+def draw_annotations(img, ids, quads, thickness=1):
+    """一次 polylines 画出全部四边形，再画角点和类别"""
+    if not len(ids):
+        return img
+    h, w = img.shape[:2]
+    pts = np.rint(quads * np.array([w, h], np.float32)).astype(np.int32)
+    cv.polylines(img, list(pts), True, LINE_COLOR, thickness)
+    for x, y in pts.reshape(-1, 2).tolist():
+        cv.circle(img, (x, y), 3, POINT_COLOR, -1)
+    # 类别标在四边形中心稍偏右上的位置
+    centers = pts.mean(axis=1).astype(np.int32) + np.array([10, -10], np.int32)
+    for class_id, (x, y) in zip(ids.tolist(), centers.tolist()):
+        cv.putText(img, str(class_id), (x, y), cv.FONT_HERSHEY_SIMPLEX, 0.5,
+                   LINE_COLOR, 1, cv.LINE_AA)
+    return img
+
+
+def render(image_path, label_path):
+    img = cv.imread(image_path)
+    if img is None:
+        return None
+    if os.path.exists(label_path):
+        draw_annotations(img, *read_labels(label_path))
+    return img
+
+
+def fit_into(img, size, caption=None):
+    """等比缩放后居中放进固定大小的画布，用于拼图格子和视频帧"""
+    w, h = size
+    canvas = np.zeros((h, w, 3), np.uint8)
+    if img is not None:
+        r = min(w / img.shape[1], h / img.shape[0])
+        new_w, new_h = max(1, int(img.shape[1] * r)), max(1, int(img.shape[0] * r))
+        resized = cv.resize(img, (new_w, new_h), interpolation=cv.INTER_AREA)
+        top, left = (h - new_h) // 2, (w - new_w) // 2
+        canvas[top:top+new_h, left:left+new_w] = resized
+    if caption:
+        cv.putText(canvas, caption, (4, 16), cv.FONT_HERSHEY_SIMPLEX, 0.45,
+                   (255, 255, 255), 1, cv.LINE_AA)
+    return canvas
+
+
 def visualize_annotations(image_path, label_path):
     """
     读取图像和同名的标注文件，显示标注点并连接。
     :param image_path: 图像文件路径
     :param label_path: 标注文件路径
     """
-    # 读取图像
     img = cv.imread(image_path)
-    
     if img is None:
         print(f"无法加载图像: {image_path}")
         return
-    
-    # 读取标注文件
     if not os.path.exists(label_path):
         print(f"标注文件不存在: {label_path}")
         return
-    
-    with open(label_path, 'r') as f:
-        for line in f:
-            # 解析标注文件中的坐标
-            parts = line.strip().split()
-            class_id = parts[0]
-            # 提取坐标信息，转换为浮动坐标，然后映射到图像大小
-            coords = [float(x) for x in parts[1:]]
-            
-            # 假设每四个点构成一个多边形，先将坐标转为整数
-            points = [(int(coords[i] * img.shape[1]), int(coords[i+1] * img.shape[0])) for i in range(0, len(coords), 2)]
-            
-            # 绘制每四个点为一个图形
-            for i in range(0, len(points), 4):
-                # 取四个点
-                quadrilateral = points[i:i+4]
-                
-                # 绘制多边形
-                for j in range(len(quadrilateral) - 1):
-                    cv.line(img, quadrilateral[j], quadrilateral[j+1], color=(0, 255, 0), thickness=1)
-                
-                # 如果是闭合的标注，最后一个点和第一个点连接
-                if len(quadrilateral) == 4:
-                    cv.line(img, quadrilateral[-1], quadrilateral[0], color=(0, 255, 0), thickness=1)
-            
-            # 绘制每个点
-            for point in points:
-                cv.circle(img, point, 3, (255, 0, 0), -1)
-            
-            # 计算多边形的中心点，以便显示标签
-            if len(points) >= 4:
-                center = np.mean(points[:4], axis=0).astype(int)
-                # 设置标签显示位置，稍微偏移
-                offset_x, offset_y = 10, -10  # 偏移量
-                label_position = (center[0] + offset_x, center[1] + offset_y)
-                # 显示class_id
-                cv.putText(img, class_id, label_position, cv.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1, cv.LINE_AA)
+
+    draw_annotations(img, *read_labels(label_path))
 
     # 显示带标注的图像
     cv.imshow("Image with annotations", img)
     cv.waitKey(0)
     cv.destroyAllWindows()
 
-if __name__ == "__main__":
-    # 输入图像和标注文件的路径
-    image_path = './8.jpg'
-    label_path = './8.txt'
-    
-    # 调用可视化函数
-    visualize_annotations(image_path, label_path)
 
+def _render_chunk(jobs, mode, size):
+    """工作进程：渲染一组图像。images 模式直接写盘只返回张数，其余模式返回缩放后的画面"""
+    cv.setNumThreads(1)
+    if mode == 'images':
+        count = 0
+        for image_path, label_path, out_path in jobs:
+            img = render(image_path, label_path)
+            if img is None:
+                continue
+            os.makedirs(os.path.dirname(out_path), exist_ok=True)
+            cv.imwrite(out_path, img)
+            count += 1
+        return count
+    return [fit_into(render(image_path, label_path), size, os.path.basename(image_path))
+            for image_path, label_path, _ in jobs]
+
+
+class SheetWriter:
+    """按行列把画面拼成拼图，每满一张立即写盘"""
+
+    def __init__(self, out_dir, tile_size, cols=6, rows=5):
+        self.out_dir = out_dir
+        self.tile_size = tile_size
+        self.cols, self.rows = cols, rows
+        self.tiles = []
+        self.sheets = 0
+        os.makedirs(out_dir, exist_ok=True)
+
+    def add(self, tile):
+        self.tiles.append(tile)
+        if len(self.tiles) == self.cols * self.rows:
+            self.flush()
+
+    def flush(self):
+        if not self.tiles:
+            return
+        w, h = self.tile_size
+        sheet = np.zeros((h * self.rows, w * self.cols, 3), np.uint8)
+        for i, tile in enumerate(self.tiles):
+            r, c = divmod(i, self.cols)
+            sheet[r*h:(r+1)*h, c*w:(c+1)*w] = tile
+        self.sheets += 1
+        cv.imwrite(os.path.join(self.out_dir, f"sheet_{self.sheets:05d}.jpg"), sheet)
+        self.tiles = []
+
+    def close(self):
+        self.flush()
+
+
+class VideoSink:
+    def __init__(self, path, frame_size, fps):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.video = cv.VideoWriter(path, cv.VideoWriter_fourcc(*'mp4v'), fps, frame_size)
+        if not self.video.isOpened():
+            raise IOError(f"Failed to open video writer for {path}")
+
+    def add(self, frame):
+        self.video.write(frame)
+
+    def close(self):
+        self.video.release()
+
+
+def iter_chunks(image_dir, label_dir, out_dir, chunk_size):
+    chunk = []
+    for image_path in iter_images(image_dir):
+        rel = os.path.relpath(image_path, image_dir)
+        chunk.append((image_path, label_path_for(image_path, image_dir, label_dir),
+                      os.path.join(out_dir, rel)))
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def run_batch(image_dir, label_dir, out, mode='images', workers=4, chunk_size=16,
+              tile_size=(320, 240), frame_size=(1280, 720), fps=5, cols=6, rows=5):
+    if mode == 'sheet':
+        sink, size = SheetWriter(out, tile_size, cols, rows), tile_size
+    elif mode == 'video':
+        sink, size = VideoSink(out, frame_size, fps), frame_size
+    else:
+        sink, size = None, None
+
+    count = 0
+    start = time.perf_counter()
+    executor = ProcessPoolExecutor(max_workers=workers,
+                                   mp_context=multiprocessing.get_context('spawn'))
+    try:
+        # 按提交顺序取结果，保证拼图和视频帧顺序与数据集一致；在途任务数有上限
+        pending = deque()
+        chunks = iter_chunks(image_dir, label_dir, out, chunk_size)
+        for chunk in chunks:
+            pending.append(executor.submit(_render_chunk, chunk, mode, size))
+            if len(pending) >= workers * 2:
+                count += _consume(pending.popleft().result(), sink)
+        while pending:
+            count += _consume(pending.popleft().result(), sink)
+    finally:
+        executor.shutdown(cancel_futures=True)
+        if sink is not None:
+            sink.close()
+
+    elapsed = time.perf_counter() - start
+    return {'images': count, 'seconds': elapsed,
+            'images_per_sec': count / elapsed if elapsed else 0.0}
+
+
+def _consume(result, sink):
+    if sink is None:
+        return result
+    for frame in result:
+        sink.add(frame)
+    return len(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Visualize four-point labels")
+    parser.add_argument("image", nargs='?', default='./8.jpg', help="image file or folder")
+    parser.add_argument("label", nargs='?', default='./8.txt', help="label file or folder")
+    parser.add_argument("--out", help="output folder (images/sheet) or .mp4 path (video)")
+    parser.add_argument("--mode", choices=('images', 'sheet', 'video'), default='images')
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--fps", type=float, default=5)
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.image):
+        visualize_annotations(args.image, args.label)
+        return
+    if not args.out:
+        parser.error("--out is required in batch mode")
+    stats = run_batch(args.image, args.label, args.out, args.mode, args.workers, fps=args.fps)
+    print(f"Rendered {stats['images']} images in {stats['seconds']:.1f}s "
+          f"({stats['images_per_sec']:.1f} images/sec)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+
+class LabelWriter:
+    """后台标注写入线程：先写临时文件，按定时批量 fsync 后原子重命名"""
+
+    def __init__(self, fsync_interval=0.5):
+        self.fsync_interval = fsync_interval
+        self.written = 0
+        self.failed = 0
+        self.errors = deque(maxlen=20)
+        self._queue = queue.Queue()
+        self._batch = {}  # 目标路径 -> 已写好的临时文件
+        self._batch_lock = threading.Lock()
+        self._idle = threading.Condition(self._batch_lock)
+        self._closing = False
+        self._directories = set()  # 已确认存在的目录
+        self._thread = threading.Thread(target=self._run, name="label-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, path, text, only_existing=False):
+        """把写入请求放入队列后立即返回；only_existing 为真时目标文件不存在就跳过"""
+        self._queue.put((self._write_temp, (path, text, only_existing)))
+
+    def load(self, path, reader, callback):
+        """排在此前的写入之后，在写入线程上以 reader(path) 读取，结果经 callback(result, error) 返回；
+        文件不存在时 result 为 None，尚未提交的写入读其临时文件"""
+        self._queue.put((self._read, (path, reader, callback)))
+
+    @property
+    def depth(self):
+        with self._batch_lock:
+            return self._queue.qsize() + len(self._batch)
+
+    def status_text(self):
+        if self.errors:
+            return f"Write failed ({self.failed}): {self.errors[-1]}"
+        depth = self.depth
+        if depth:
+            return f"Writing labels: {depth} queued"
+        return f"Labels written: {self.written}"
+
+    def flush(self, timeout=None):
+        """阻塞直到队列清空且批次全部落盘"""
+        self._queue.put(None)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._idle:
+            while self._queue.unfinished_tasks or self._batch:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+        return True
+
+    def close(self):
+        self.flush()
+        self._closing = True
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        last_commit = time.monotonic()
+        while not self._closing:
+            timeout = max(0.0, self.fsync_interval - (time.monotonic() - last_commit))
+            try:
+                item = self._queue.get(timeout=timeout if self._batch else None)
+            except queue.Empty:
+                item = False
+
+            if item:
+                handler, args = item
+                handler(*args)
+            # 到时间、收到 flush 请求或队列已空时提交一批
+            due = time.monotonic() - last_commit >= self.fsync_interval
+            if item is None or due:
+                self._commit()
+                last_commit = time.monotonic()
+            if item is not False:
+                with self._idle:
+                    self._queue.task_done()
+                    self._idle.notify_all()
+
+    def _write_temp(self, path, text, only_existing=False):
+        tmp_path = f"{path}.tmp"
+        directory = os.path.dirname(path)
+        try:
+            if only_existing and path not in self._batch and not os.path.exists(path):
+                return
+            if directory and directory not in self._directories:
+                os.makedirs(directory, exist_ok=True)
+                self._directories.add(directory)
+            with open(tmp_path, 'w') as f:
+                f.write(text)
+            with self._batch_lock:
+                self._batch[path] = tmp_path
+        except OSError as e:
+            self._directories.discard(directory)  # 目录可能被外部删除，下次重新创建
+            self._fail(path, e)
+
+    def _read(self, path, reader, callback):
+        # 批次只在本线程提交，读取期间临时文件不会被重命名
+        with self._batch_lock:
+            source = self._batch.get(path, path)
+        try:
+            result = reader(source)
+        except FileNotFoundError:
+            callback(None, None)
+        except (OSError, ValueError) as e:
+            callback(None, e)
+        else:
+            callback(result, None)
+
+    def _commit(self):
+        with self._batch_lock:
+            batch = list(self._batch.items())
+        directories = set()
+        for path, tmp_path in batch:
+            try:
+                fd = os.open(tmp_path, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+                os.replace(tmp_path, path)
+                directories.add(os.path.dirname(os.path.abspath(path)))
+                self.written += 1
+            except OSError as e:
+                self._fail(path, e)
+        # 目录项也要落盘，重命名才算持久化（Windows 不支持对目录 fsync）
+        if os.name == 'posix':
+            for directory in directories:
+                try:
+                    fd = os.open(directory, os.O_RDONLY)
+                    try:
+                        os.fsync(fd)
+                    finally:
+                        os.close(fd)
+                except OSError:
+                    pass
+        with self._idle:
+            for path, tmp_path in batch:
+                if self._batch.get(path) == tmp_path:
+                    del self._batch[path]
+            self._idle.notify_all()
+
+    def _fail(self, path, error):
+        self.failed += 1
+        self.errors.append(f"{os.path.basename(path)}: {error.strerror or error}")
+        try:
+            os.remove(f"{path}.tmp")
+        except OSError:
+            pass